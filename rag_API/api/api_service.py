@@ -3,34 +3,53 @@
 提供问题查询接口，返回相关的聊天记录内容
 """
 
+import argparse
+import asyncio
+import functools
 import os
 import sys
-from typing import List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Literal, Optional
 import uvicorn
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import json
 import socket
+import threading
+import time
 
 # 设置API密钥
 os.environ["DASHSCOPE_API_KEY"] = "sk-bae62c151c524da4b4ee5f04e4e19a3f"
-import dashscope
-dashscope.api_key = os.environ["DASHSCOPE_API_KEY"]
-
-from langchain_chroma import Chroma
-from langchain_community.embeddings.dashscope import DashScopeEmbeddings
+# dashscope、langchain_chroma（连带 chromadb）在后台加载数据库时才导入，服务进程启动后立即监听端口，
+# /livez 可以马上应答。dashscope 导入时从环境变量读取密钥和 DASHSCOPE_HTTP_BASE_URL
+# （可指向兼容DashScope协议的其他地址，如 benchmarks/fake_embedding_server.py）
+
+# 复用 core/ 中与构建脚本共用的模块
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "core"))
+from query_cache import CachedQueryEmbeddings, IndexGeneration, ResultCache, SearchLatency, SingleFlight
+from query_batcher import MicroBatchEmbeddings
+from collection_stats import STATS_NAME, CollectionStats, CollectionStatsReader, summarize_stats
+from readiness import ReadinessMonitor
+from warmup import StageTimer, load_warmup_queries, touch_index_files
 
 # 请求和响应模型
 class QueryRequest(BaseModel):
     question: str
     max_results: int = 5
     similarity_threshold: float = 0.0
+    filters: Optional[Dict[str, Any]] = None  # 元数据过滤条件，如 {"sender": "张三"}
+    # 检索方式：vector（向量，默认）、lexical（关键词BM25）、hybrid（两者按倒数排名融合）
+    mode: Literal["vector", "lexical", "hybrid"] = "vector"
+
+class QueryBatchRequest(BaseModel):
+    questions: List[QueryRequest]
 
 class ChatRecord(BaseModel):
     content: str
     metadata: Dict[str, Any]
-    similarity_score: float
+    similarity_score: float  # vector 为距离（越小越相似），lexical 为BM25得分，hybrid 为融合得分（越大越相关）
 
 class QueryResponse(BaseModel):
     question: str
@@ -38,6 +57,13 @@ class QueryResponse(BaseModel):
     total_found: int
     status: str
     message: str
+    mode: str = "vector"
+    timings: Optional[Dict[str, float]] = None  # 本次检索各阶段的耗时（毫秒），命中缓存时为空
+
+class QueryBatchResponse(BaseModel):
+    results: List[QueryResponse]
+    total_questions: int
+    status: str
 
 # 初始化FastAPI应用
 app = FastAPI(
@@ -67,38 +93,246 @@ def get_local_ip():
     except:
         return "127.0.0.1"
 
-# 全局变量存储向量数据库
+DB_PATH = os.environ.get("RAG_DB_PATH", "./chroma_wechat_db")
+
+# 查询线程池：embedding请求和Chroma检索都是同步阻塞调用，放到线程池中执行，
+# 一个慢请求不会卡住事件循环里的其他请求。多worker部署时每个进程各有一个线程池
+QUERY_WORKERS = int(os.environ.get("RAG_QUERY_WORKERS", "16"))
+# 排队等待线程池的请求数上限，超过时直接返回503，避免请求无限堆积
+QUERY_QUEUE_LIMIT = int(os.environ.get("RAG_QUERY_QUEUE", "256"))
+query_executor = ThreadPoolExecutor(max_workers=QUERY_WORKERS, thread_name_prefix="query")
+pending_queries = 0
+
+async def run_query(func, *args, **kwargs):
+    """在查询线程池中执行阻塞调用"""
+    global pending_queries
+    if pending_queries >= QUERY_QUEUE_LIMIT:
+        raise HTTPException(status_code=503, detail="服务繁忙，请稍后重试")
+    pending_queries += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(query_executor, functools.partial(func, *args, **kwargs))
+    finally:
+        pending_queries -= 1
+
+# 问题向量缓存：相同问题不再重复调用embedding接口（每个worker进程各有一份）
+EMBED_CACHE_SIZE = int(os.environ.get("RAG_EMBED_CACHE_SIZE", "10000"))
+EMBED_CACHE_TTL = float(os.environ.get("RAG_EMBED_CACHE_TTL", "3600"))
+# /query 结果缓存：按响应大小限制内存，构建脚本更新数据库（索引代数变化）后自动清空
+RESULT_CACHE_MB = float(os.environ.get("RAG_RESULT_CACHE_MB", "64"))
+RESULT_CACHE_TTL = float(os.environ.get("RAG_RESULT_CACHE_TTL", "600"))
+# 问题向量微批处理（默认关闭）：并发请求的问题在 RAG_EMBED_BATCH_MS 毫秒内合并成一次embedding调用
+EMBED_BATCH_MS = float(os.environ.get("RAG_EMBED_BATCH_MS", "0"))
+EMBED_BATCH_SIZE = int(os.environ.get("RAG_EMBED_BATCH_SIZE", "10"))
+# 就绪自检间隔（秒）：后台定期用缓存的问题向量检索一次，探针只读取结果
+READY_CHECK_INTERVAL = float(os.environ.get("RAG_READY_CHECK_INTERVAL", "30"))
+# 启动预热：预读索引文件并执行一组代表性查询，完成前 /readyz 返回503；RAG_WARMUP=0 关闭
+WARMUP_ENABLED = os.environ.get("RAG_WARMUP", "1") != "0"
+WARMUP_QUERIES_FILE = os.environ.get("RAG_WARMUP_QUERIES")
+# /query_batch 单次请求最多的问题数
+MAX_BATCH_QUESTIONS = int(os.environ.get("RAG_MAX_BATCH_QUESTIONS", "32"))
+# 检索后端：chroma（HNSW近似检索，默认）或 numpy（内存映射矩阵上的精确检索，见 core/numpy_index.py）
+SEARCH_BACKEND = os.environ.get("RAG_SEARCH_BACKEND", "chroma")
+# Chroma后端的HNSW参数保存在数据库的集合配置中，由构建脚本设置（见 core/hnsw_params.py）；服务默认只读取，
+# RAG_HNSW_APPLY=1 时在启动时把 RAG_HNSW_EF_SEARCH 写入数据库（多个worker会各自写入同一个值）
+HNSW_APPLY = os.environ.get("RAG_HNSW_APPLY", "0") == "1"
+# NumPy后端的量化模式：空（float32精确检索，默认）、float16 或 int8；量化时粗排候选数为 k 的 RAG_NUMPY_RESCORE 倍
+NUMPY_QUANTIZE = os.environ.get("RAG_NUMPY_QUANTIZE") or None
+NUMPY_RESCORE = int(os.environ.get("RAG_NUMPY_RESCORE", "4"))
+# NumPy后端粗排用降维后的向量：RAG_NUMPY_DIM 为维度（0 不降维，默认），RAG_NUMPY_REDUCE 为 pca 或 truncate
+NUMPY_DIM = int(os.environ.get("RAG_NUMPY_DIM", "0"))
+NUMPY_REDUCE = os.environ.get("RAG_NUMPY_REDUCE", "pca")
+# hybrid 检索时向量和关键词各取前 RAG_HYBRID_DEPTH 条（不少于 max_results）参与融合
+HYBRID_DEPTH = int(os.environ.get("RAG_HYBRID_DEPTH", "50"))
+
+# 全局变量存储向量数据库（每个worker进程在启动时各自加载）
 vectorstore = None
+vectorstore_version = None  # 当前检索的数据对应的索引版本（NumPy后端据此判断是否需要重新导出）
+query_embeddings = None
+result_cache = None
+# 关键词索引（core/lexical_index.py），与向量数据库一起加载，数据库更新后在后台重建
+bm25_index = None
+bm25_version = None
+search_latency = SearchLatency()
+embedding_batcher = None
+# 进行中的 /query 检索，按结果缓存的键合并相同的并发请求
+query_flight = SingleFlight()
+# /stats 读取构建脚本维护的统计文件
+stats_reader = CollectionStatsReader(DB_PATH)
+scanned_stats = None
+# 启动时嵌入一次的测试问题向量，就绪自检复用它，不再调用embedding接口
+probe_vector = None
+prepare_task = None
+
+def create_query_embeddings():
+    """问题向量：缓存 → （可选）微批处理 → DashScope"""
+    global embedding_batcher
+    from langchain_community.embeddings.dashscope import DashScopeEmbeddings, embed_with_retry
+
+    dashscope_embeddings = DashScopeEmbeddings(model="text-embedding-v3")
+
+    def embed_queries(texts):
+        # 与 embed_query 一样使用 text_type="query"，embed_documents 的向量不能用于检索问题
+        result = embed_with_retry(dashscope_embeddings, input=list(texts), text_type="query",
+                                  model=dashscope_embeddings.model)
+        return [item["embedding"] for item in result]
+
+    embeddings = dashscope_embeddings
+    if EMBED_BATCH_MS > 0:
+        embedding_batcher = MicroBatchEmbeddings(
+            dashscope_embeddings,
+            embed_batch=embed_queries,
+            window_ms=EMBED_BATCH_MS,
+            max_items=EMBED_BATCH_SIZE
+        )
+        embeddings = embedding_batcher
+    return CachedQueryEmbeddings(
+        embeddings,
+        model_name="dashscope/text-embedding-v3",
+        max_entries=EMBED_CACHE_SIZE,
+        ttl_seconds=EMBED_CACHE_TTL,
+        embed_batch=embed_queries
+    )
+
+def self_check():
+    """就绪自检：用缓存的测试问题向量检索一条记录（阻塞调用，在查询线程池中执行）"""
+    test_results = vectorstore.similarity_search_by_vector(probe_vector, k=1)
+    if not test_results:
+        raise Exception("测试查询没有返回结果")
+    return {"records": vectorstore._collection.count(), "test_query": len(test_results)}
+
+readiness = ReadinessMonitor(self_check, interval=READY_CHECK_INTERVAL)
 
 def load_vectorstore():
     """加载向量数据库"""
-    global vectorstore
+    global vectorstore, vectorstore_version, query_embeddings, result_cache, probe_vector, bm25_index, bm25_version
 
     try:
-        db_path = "./chroma_wechat_db"
+        db_path = DB_PATH
 
         if not os.path.exists(db_path):
             raise Exception("向量数据库不存在，请先运行 test_csv_final.py 创建数据库")
 
-        embeddings = DashScopeEmbeddings(model="text-embedding-v3")
-        vectorstore = Chroma(
-            persist_directory=db_path,
-            embedding_function=embeddings
-        )
+        embeddings = create_query_embeddings()
+        if SEARCH_BACKEND == "numpy":
+            from numpy_index import load_numpy_index
+
+            # 没有导出或导出后数据库已更新时，先从Chroma集合重新导出
+            store = load_numpy_index(db_path, embeddings, quantize=NUMPY_QUANTIZE, rescore_factor=NUMPY_RESCORE,
+                                     reduce_dim=NUMPY_DIM, reduce_method=NUMPY_REDUCE)
+        else:
+            from langchain_chroma import Chroma
+
+            from hnsw_params import HNSW_PARAMS, apply_hnsw_params, describe_hnsw, hnsw_params_from_env
 
-        # 测试数据库是否可用
-        test_results = vectorstore.similarity_search("测试", k=1)
+            store = Chroma(
+                persist_directory=db_path,
+                embedding_function=embeddings
+            )
+            requested = hnsw_params_from_env()
+            if HNSW_APPLY:
+                # 在第一次检索之前修改 ef_search（写入数据库的集合配置），本进程加载索引时才会生效
+                hnsw = apply_hnsw_params(store._collection, requested)
+            else:
+                hnsw = describe_hnsw(store._collection)
+                for name, value in requested.items():
+                    if hnsw[name] is not None and value != hnsw[name]:
+                        print(f"⚠️ {HNSW_PARAMS[name][1]}={value} 与数据库中的 {name}={hnsw[name]} 不同，服务不修改数据库；"
+                              f"请用构建脚本修改（M、ef_construction 需要重建），ef_search 也可设置 RAG_HNSW_APPLY=1 在启动时写入")
+            print(f"🕸️ HNSW参数: M={hnsw['M']}，ef_construction={hnsw['ef_construction']}，ef_search={hnsw['ef_search']}")
+
+        # 测试数据库是否可用；测试问题的向量保留下来供就绪自检使用
+        vector = embeddings.embed_query("测试")
+        test_results = store.similarity_search_by_vector(vector, k=1)
         print(f"✅ 成功加载向量数据库，测试查询返回 {len(test_results)} 条结果")
 
+        # 关键词索引加载失败不影响向量检索，之后 lexical/hybrid 请求到达时在后台重试
+        index = None
+        try:
+            from lexical_index import load_lexical_index
+
+            index = load_lexical_index(db_path)
+            print(f"✅ 关键词索引: {index.count():,} 条文档，{len(index.vocabulary):,} 个词")
+        except Exception as e:
+            print(f"⚠️ 关键词索引加载失败: {e}")
+
+        # 全部准备好后再发布（加载在后台线程中进行，期间请求可能已经到达）
+        result_cache = ResultCache(
+            IndexGeneration(db_path),
+            max_bytes=int(RESULT_CACHE_MB * 1024 * 1024),
+            ttl_seconds=RESULT_CACHE_TTL
+        )
+        query_embeddings, probe_vector = embeddings, vector
+        vectorstore = store
+        vectorstore_version = result_cache.index.current()
+        bm25_index, bm25_version = index, vectorstore_version if index is not None else None
+
         return True
 
     except Exception as e:
         print(f"❌ 加载向量数据库失败: {e}")
         return False
 
+numpy_refresh = {"thread": None, "failed_at": 0.0}
+bm25_refresh = {"thread": None, "failed_at": 0.0}
+
+def start_refresh(state, target, index_version):
+    """在后台线程中更新落后于数据库的索引，同时只有一个线程；失败后10秒内不再重试"""
+    thread = state["thread"]
+    if (thread is None or not thread.is_alive()) and time.monotonic() - state["failed_at"] > 10:
+        thread = threading.Thread(target=target, args=(index_version,), daemon=True)
+        state["thread"] = thread
+        thread.start()
+
+def current_store_version(index_version):
+    """NumPy索引落后于数据库时在后台重新导出，返回正在使用的矩阵对应的索引版本
+
+    导出完成前继续用旧矩阵检索，返回旧版本，这期间的结果不会写入新版本的缓存。
+    """
+    store_version = vectorstore_version
+    if SEARCH_BACKEND != "numpy" or store_version == index_version:
+        return index_version
+    start_refresh(numpy_refresh, reload_numpy_index, index_version)
+    return store_version
+
+def current_bm25_version(index_version):
+    """关键词索引落后于数据库（或没有加载成功）时在后台重新加载，返回正在使用的索引对应的索引版本"""
+    version = bm25_version
+    if version != index_version:
+        start_refresh(bm25_refresh, reload_bm25_index, index_version)
+    return version
+
+def reload_numpy_index(index_version):
+    global vectorstore, vectorstore_version
+    from numpy_index import load_numpy_index
+
+    try:
+        store = load_numpy_index(DB_PATH, query_embeddings, quantize=NUMPY_QUANTIZE, rescore_factor=NUMPY_RESCORE,
+                                 reduce_dim=NUMPY_DIM, reduce_method=NUMPY_REDUCE)
+        vectorstore = store
+        vectorstore_version = index_version
+        print(f"✅ NumPy索引已更新到索引代数 {store.generation}（{store.count():,} 条向量）")
+    except Exception as e:
+        # 全量重建过程中数据库不完整，稍后由下一个查询重试
+        numpy_refresh["failed_at"] = time.monotonic()
+        print(f"⚠️ NumPy索引更新失败: {e}")
+
+def reload_bm25_index(index_version):
+    global bm25_index, bm25_version
+    from lexical_index import load_lexical_index
+
+    try:
+        # 构建脚本已经重建了索引时直接加载，否则从集合重建
+        index = load_lexical_index(DB_PATH)
+        bm25_index, bm25_version = index, index_version
+        print(f"✅ 关键词索引已更新到索引代数 {index.generation}（{index.count():,} 条文档）")
+    except Exception as e:
+        bm25_refresh["failed_at"] = time.monotonic()
+        print(f"⚠️ 关键词索引更新失败: {e}")
+
 @app.on_event("startup")
 async def startup_event():
-    """应用启动时加载向量数据库"""
+    """应用启动时在后台加载并预热向量数据库"""
     print("🚀 正在启动微信聊天记录API服务...")
 
     # 显示网络信息
@@ -107,15 +341,87 @@ async def startup_event():
     print(f"🌐 局域网访问地址: http://{local_ip}:8000")
     print(f"🏠 本地访问地址: http://localhost:8000")
     print(f"📖 API文档地址: http://{local_ip}:8000/docs")
-
-    success = load_vectorstore()
+    print(f"🧵 查询线程池: {QUERY_WORKERS} 个线程，排队上限 {QUERY_QUEUE_LIMIT}（进程 {os.getpid()}）")
+    print(f"🔎 检索后端: {SEARCH_BACKEND}")
+    if SEARCH_BACKEND == "numpy" and NUMPY_QUANTIZE:
+        print(f"🗜️ NumPy量化模式: {NUMPY_QUANTIZE}，重排 {NUMPY_RESCORE} 倍候选")
+    if SEARCH_BACKEND == "numpy" and NUMPY_DIM:
+        print(f"🗜️ NumPy降维粗排: {NUMPY_REDUCE} {NUMPY_DIM} 维，重排 {NUMPY_RESCORE} 倍候选")
+    if EMBED_BATCH_MS > 0:
+        print(f"📦 问题向量微批处理: 窗口 {EMBED_BATCH_MS:g} ms，每批最多 {EMBED_BATCH_SIZE} 条")
+
+    # 加载和预热在后台进行：期间 /livez 正常响应，/readyz 返回503
+    global prepare_task
+    prepare_task = asyncio.ensure_future(prepare_service(local_ip))
+
+def warmup_skip_files():
+    """NumPy后端不预读检索时用不到整体常驻的向量文件"""
+    if SEARCH_BACKEND != "numpy":
+        return ()
+    from numpy_index import unused_vector_files
+
+    return unused_vector_files(DB_PATH, NUMPY_QUANTIZE, NUMPY_DIM, NUMPY_REDUCE)
+
+def run_warmup_queries(queries):
+    """预热查询：问题向量一次嵌入（之后相同的问题直接命中缓存），再逐个检索，返回每次检索的耗时"""
+    vectors = query_embeddings.embed_queries(queries)
+    latencies = []
+    for vector in vectors:
+        start = time.perf_counter()
+        vectorstore.similarity_search_by_vector(vector, k=5)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+async def prepare_service(local_ip):
+    """加载向量数据库 → 预读索引文件 → 预热查询 → 自检，各阶段耗时记入日志和 /readyz"""
+    loop = asyncio.get_running_loop()
+    timer = StageTimer()
+    readiness.record(False, "加载中")
+
+    with timer.stage("加载向量数据库"):
+        success = await loop.run_in_executor(query_executor, load_vectorstore)
     if not success:
+        readiness.record(False, "向量数据库未加载")
         print("❌ 向量数据库加载失败，API服务可能无法正常工作")
-    else:
-        print("✅ API服务启动成功")
+        return
+
+    if WARMUP_ENABLED:
+        readiness.record(False, "预热中")
+        try:
+            with timer.stage("预读索引文件") as stage:
+                files, size = await loop.run_in_executor(query_executor, touch_index_files, DB_PATH,
+                                                         8 << 20, warmup_skip_files())
+                stage["detail"] = f"（{files} 个文件，{size / 1024 / 1024:.1f} MB）"
+            with timer.stage("预热查询") as stage:
+                queries = load_warmup_queries(WARMUP_QUERIES_FILE)
+                latencies = await loop.run_in_executor(query_executor, run_warmup_queries, queries)
+                if latencies:
+                    stage["detail"] = (f"（{len(queries)} 个问题，首次检索 {latencies[0] * 1000:.1f} ms，"
+                                       f"最后一次 {latencies[-1] * 1000:.1f} ms）")
+        except Exception as e:
+            # 预热失败不影响服务，是否就绪由自检决定
+            print(f"⚠️ 预热失败: {e}")
+
+    with timer.stage("就绪自检"):
+        await readiness.check_now(query_executor)
+    readiness.info["startup_ms"] = timer.summary()
+    readiness.start(query_executor)
+
+    if readiness.ready:
+        print(f"✅ API服务启动成功，就绪用时 {timer.total():.2f} 秒")
         print("🔗 其他设备可通过以下地址访问:")
         print(f"   - http://{local_ip}:8000")
         print("⚠️  请确保防火墙允许8000端口访问")
+    else:
+        print(f"❌ 就绪自检未通过: {readiness.reason}")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """停止后台自检和问题向量微批处理，关闭查询线程池"""
+    readiness.stop()
+    if embedding_batcher is not None:
+        embedding_batcher.close()
+    query_executor.shutdown(wait=False)
 
 @app.get("/")
 async def root():
@@ -124,97 +430,85 @@ async def root():
         "service": "微信聊天记录向量数据库API",
         "version": "1.0.0",
         "status": "运行中" if vectorstore is not None else "数据库未加载",
+        "search_backend": SEARCH_BACKEND,
+        "search_modes": ["vector", "lexical", "hybrid"],
         "endpoints": {
             "查询": "POST /query",
+            "批量查询": "POST /query_batch",
             "健康检查": "GET /health",
-            "统计信息": "GET /stats"
+            "存活探针": "GET /livez",
+            "就绪探针": "GET /readyz",
+            "统计信息": "GET /stats",
+            "缓存统计": "GET /cache_stats"
         }
     }
 
+@app.get("/cache_stats")
+async def cache_stats():
+    """查询缓存的命中率等统计（当前worker进程）"""
+    if query_embeddings is None:
+        raise HTTPException(status_code=503, detail="向量数据库未加载")
+    return {
+        "pid": os.getpid(),
+        "query_embedding": query_embeddings.stats(),
+        "query_result": result_cache.stats(),
+        "coalescing": query_flight.stats(),
+        "search_latency": search_latency.stats(),
+        "embedding_batcher": embedding_batcher.stats() if embedding_batcher else None
+    }
+
+@app.get("/livez")
+async def liveness():
+    """存活探针：事件循环能响应即为存活，不检查数据库"""
+    return {"status": "alive"}
+
+@app.get("/readyz")
+async def readiness_probe(response: Response):
+    """就绪探针：返回缓存的自检结果，未就绪时状态码为503"""
+    if not readiness.ready:
+        response.status_code = 503
+    return readiness.status()
+
 @app.get("/health")
 async def health_check():
-    """健康检查端点"""
-    if vectorstore is None:
-        raise HTTPException(status_code=503, detail="向量数据库未加载")
+    """健康检查端点（读取缓存的自检结果，不调用embedding接口）"""
+    if not readiness.ready:
+        raise HTTPException(status_code=503, detail=f"数据库连接异常: {readiness.reason}")
 
-    try:
-        # 简单测试查询
-        test_results = vectorstore.similarity_search("测试", k=1)
-        return {
-            "status": "健康",
-            "database": "已连接",
-            "test_query": f"成功返回 {len(test_results)} 条结果"
-        }
-    except Exception as e:
-        raise HTTPException(status_code=503, detail=f"数据库连接异常: {str(e)}")
+    return {
+        "status": "健康",
+        "database": "已连接",
+        "test_query": f"成功返回 {readiness.detail.get('test_query', 0)} 条结果",
+        "checked_at": readiness.checked_at
+    }
 
 @app.get("/stats")
 async def get_stats():
-    """获取数据库统计信息"""
+    """获取数据库统计信息（读取入库时维护的精确统计，不调用embedding）"""
+    global scanned_stats
     if vectorstore is None:
         raise HTTPException(status_code=503, detail="向量数据库未加载")
 
-    try:
-        # 获取向量数据库的实际统计信息
-        # Chroma数据库的集合信息
-        collection = vectorstore._collection
-        total_count = collection.count()
-
-        # 获取样本来分析发送者和消息类型
-        sample_results = vectorstore.similarity_search("", k=min(200, total_count))
-
-        # 统计发送者和消息类型
-        senders = set()
-        msg_types = set()
-        time_range = {"earliest": None, "latest": None}
-
-        for doc in sample_results:
-            if 'sender' in doc.metadata:
-                senders.add(doc.metadata['sender'])
-            if 'msg_type' in doc.metadata:
-                msg_types.add(doc.metadata['msg_type'])
-            if 'chat_time' in doc.metadata and doc.metadata['chat_time']:
-                chat_time = doc.metadata['chat_time']
-                if time_range["earliest"] is None or chat_time < time_range["earliest"]:
-                    time_range["earliest"] = chat_time
-                if time_range["latest"] is None or chat_time > time_range["latest"]:
-                    time_range["latest"] = chat_time
+    summary = stats_reader.current()
+    source = STATS_NAME
+    if summary is None:
+        # 旧版构建的数据库没有统计文件：从集合元数据统计一次并保留在内存中
+        if scanned_stats is None:
+            scanned_stats = await run_query(collect_stats)
+        summary = scanned_stats
+        source = "集合元数据扫描（重新构建数据库后改为读取统计文件）"
 
-        return {
-            "total_records": total_count,
-            "sample_analyzed": len(sample_results),
-            "unique_senders": list(senders),
-            "message_types": list(msg_types),
-            "time_range": time_range,
-            "database_path": "./chroma_wechat_db"
-        }
+    return {**summary, "source": source, "database_path": DB_PATH}
 
+def collect_stats():
+    """扫描集合元数据得到统计（阻塞调用，在查询线程池中执行）"""
+    try:
+        return summarize_stats(CollectionStats(STATS_NAME).rescan(vectorstore._collection))
     except Exception as e:
-        # 如果获取总数失败，回退到原方法
-        try:
-            sample_results = vectorstore.similarity_search("", k=100)
-            senders = set()
-            msg_types = set()
-
-            for doc in sample_results:
-                if 'sender' in doc.metadata:
-                    senders.add(doc.metadata['sender'])
-                if 'msg_type' in doc.metadata:
-                    msg_types.add(doc.metadata['msg_type'])
-
-            return {
-                "total_records": f"约 {len(sample_results)}+ (无法获取精确总数)",
-                "sample_analyzed": len(sample_results),
-                "unique_senders": list(senders),
-                "message_types": list(msg_types),
-                "note": f"统计获取部分失败: {str(e)}",
-                "database_path": "./chroma_wechat_db"
-            }
-        except Exception as e2:
-            raise HTTPException(status_code=500, detail=f"获取统计信息失败: {str(e2)}")
+        raise HTTPException(status_code=500, detail=f"获取统计信息失败: {str(e)}")
 
 @app.post("/query", response_model=QueryResponse)
-async def query_records(request: QueryRequest):
+async def query_records(request: QueryRequest, response: Response):
     """查询相关聊天记录"""
 
     if vectorstore is None:
@@ -223,42 +517,251 @@ async def query_records(request: QueryRequest):
     if not request.question.strip():
         raise HTTPException(status_code=400, detail="问题不能为空")
 
+    check_filters(request.filters)
+
+    cache_key = result_cache.key(request.question, request.max_results,
+                                 request.similarity_threshold, request.filters, request.mode)
+    chat_records, index_version = result_cache.get(cache_key)
+    response.headers["X-Index-Generation"] = str(result_cache.generation)
+    if chat_records is not None:
+        response.headers["X-Cache"] = "HIT"
+        return build_query_response(request.question, chat_records, request.mode)
+
+    try:
+        # 相同键的并发请求只执行一次检索，其余请求等待并共享结果
+        timings = {}
+        chat_records, shared = await query_flight.run(
+            cache_key, lambda: search_records(request, cache_key, index_version, timings=timings))
+        response.headers["X-Cache"] = "COALESCED" if shared else "MISS"
+        return build_query_response(request.question, chat_records, request.mode, None if shared else timings)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"查询失败: {str(e)}")
+
+def check_filters(filters):
+    """过滤条件不合法时返回400：先按Chroma的规则检查，再检查Chroma校验放过的部分（如未知的 $ 键），两种后端的行为一致"""
+    if not filters:
+        return
+    from chromadb.api.types import validate_where
+    from numpy_index import validate_filter
+
     try:
-        # 在向量数据库中搜索相关内容
-        results = vectorstore.similarity_search_with_score(
-            request.question,
-            k=request.max_results
+        validate_where(filters)
+        validate_filter(filters, numpy=SEARCH_BACKEND == "numpy")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"过滤条件不合法: {e}")
+
+async def search_records(request, cache_key, index_version, query_vector=None, timings=None):
+    """检索并写入结果缓存，返回 ChatRecord 列表；已有问题向量时直接按向量检索
+
+    各阶段耗时（毫秒）写入 timings，并按检索方式计入 /cache_stats 的 search_latency。
+    """
+    timings = {} if timings is None else timings
+    index_version = search_version(request.mode, index_version)
+    # 检索在线程池中执行，不阻塞事件循环；total_ms 包含在线程池中排队的时间
+    start = time.perf_counter()
+    results = await run_query(run_search, request, query_vector, timings)
+    timings["total_ms"] = elapsed_ms(start)
+    search_latency.record(request.mode, timings)
+    return cache_records(request, results, cache_key, index_version)
+
+def search_version(mode, index_version):
+    """本次检索用到的索引对应的版本：任一索引落后于数据库时返回落后的版本，结果不写入新版本的缓存"""
+    versions = []
+    if mode != "lexical":
+        versions.append(current_store_version(index_version))
+    if mode != "vector":
+        versions.append(current_bm25_version(index_version))
+    return next((version for version in versions if version != index_version), index_version)
+
+def elapsed_ms(start):
+    return round((time.perf_counter() - start) * 1000, 3)
+
+def run_search(request, query_vector, timings):
+    """按检索方式检索（阻塞调用，在查询线程池中执行），返回 [(Document, 分数)]"""
+    if request.mode == "lexical":
+        return lexical_search(request, request.max_results, timings)
+    if request.mode == "hybrid":
+        return hybrid_search(request, query_vector, timings)
+    return vector_search(request, request.max_results, query_vector, timings)
+
+def vector_search(request, k, query_vector, timings):
+    """向量检索，分数为距离；没有问题向量时先计算"""
+    if query_vector is None:
+        start = time.perf_counter()
+        query_vector = query_embeddings.embed_query(request.question)
+        timings["embed_ms"] = elapsed_ms(start)
+    start = time.perf_counter()
+    results = vectorstore.similarity_search_by_vector_with_relevance_scores(
+        query_vector, k=k, filter=request.filters)
+    timings["vector_ms"] = elapsed_ms(start)
+    return results
+
+def lexical_search(request, k, timings):
+    """关键词（BM25）检索，分数为BM25得分；文档和元数据从向量数据库中按ID读取
+
+    有过滤条件时先从向量数据库取出满足条件的ID，只在这些文档中检索
+    （Chroma 同时按 ids 和 where 读取很慢，几百个ID就要上秒）。
+    """
+    from langchain_core.documents import Document
+
+    index = bm25_index
+    if index is None:
+        raise HTTPException(status_code=503, detail="关键词索引未加载")
+    allowed = None
+    if request.filters:
+        start = time.perf_counter()
+        allowed = vectorstore._collection.get(where=request.filters, include=[])["ids"]
+        timings["filter_ms"] = elapsed_ms(start)
+    start = time.perf_counter()
+    hits = index.search(request.question, k, ids=allowed)
+    timings["lexical_ms"] = elapsed_ms(start)
+    if not hits:
+        return []
+
+    start = time.perf_counter()
+    found = vectorstore._collection.get(ids=[doc_id for doc_id, _ in hits], include=["documents", "metadatas"])
+    documents = {doc_id: Document(page_content=document, metadata=metadata or {}, id=doc_id)
+                 for doc_id, document, metadata in zip(found["ids"], found["documents"], found["metadatas"])}
+    timings["fetch_ms"] = elapsed_ms(start)
+    return [(documents[doc_id], score) for doc_id, score in hits if doc_id in documents]
+
+def hybrid_search(request, query_vector, timings):
+    """向量和关键词各取前 HYBRID_DEPTH 条，按倒数排名融合，分数为融合得分"""
+    from lexical_index import reciprocal_rank_fusion
+
+    depth = max(request.max_results, HYBRID_DEPTH)
+    rankings = [vector_search(request, depth, query_vector, timings), lexical_search(request, depth, timings)]
+    start = time.perf_counter()
+    documents = {}
+    for results in rankings:
+        for doc, _ in results:
+            documents.setdefault(doc.id or doc.page_content, doc)
+    fused = reciprocal_rank_fusion([[doc.id or doc.page_content for doc, _ in results] for results in rankings],
+                                   limit=request.max_results)
+    timings["fusion_ms"] = elapsed_ms(start)
+    return [(documents[key], score) for key, score in fused]
+
+def cache_records(request, results, cache_key, index_version):
+    """按相似度阈值过滤检索结果，转换为 ChatRecord 列表并写入结果缓存"""
+    # 过滤相似度阈值
+    filtered_results = [
+        (doc, score) for doc, score in results
+        if score >= request.similarity_threshold
+    ]
+
+    # 格式化结果
+    chat_records = []
+    for doc, score in filtered_results:
+        chat_record = ChatRecord(
+            content=doc.page_content,
+            metadata=doc.metadata,
+            similarity_score=float(score)
         )
+        chat_records.append(chat_record)
 
-        # 过滤相似度阈值
-        filtered_results = [
-            (doc, score) for doc, score in results
-            if score >= request.similarity_threshold
-        ]
-
-        # 格式化结果
-        chat_records = []
-        for doc, score in filtered_results:
-            chat_record = ChatRecord(
-                content=doc.page_content,
-                metadata=doc.metadata,
-                similarity_score=float(score)
-            )
-            chat_records.append(chat_record)
-
-        return QueryResponse(
-            question=request.question,
-            related_records=chat_records,
-            total_found=len(chat_records),
-            status="success",
-            message=f"找到 {len(chat_records)} 条相关记录"
+    size = len(json.dumps(jsonable_encoder(chat_records), ensure_ascii=False).encode("utf-8"))
+    result_cache.put(cache_key, chat_records, index_version, size)
+    return chat_records
+
+@app.post("/query_batch", response_model=QueryBatchResponse)
+async def query_batch(batch: QueryBatchRequest, response: Response):
+    """一次查询多个问题：未命中缓存的问题合并为一次embedding调用，检索并行执行，结果按提交顺序返回"""
+
+    if vectorstore is None:
+        raise HTTPException(status_code=503, detail="向量数据库未加载")
+
+    if not batch.questions:
+        raise HTTPException(status_code=400, detail="问题列表不能为空")
+    if len(batch.questions) > MAX_BATCH_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"单次最多 {MAX_BATCH_QUESTIONS} 个问题")
+    if any(not request.question.strip() for request in batch.questions):
+        raise HTTPException(status_code=400, detail="问题不能为空")
+    for request in batch.questions:
+        check_filters(request.filters)
+
+    response.headers["X-Index-Generation"] = str(result_cache.generation)
+    cached = []
+    misses = []
+    for i, request in enumerate(batch.questions):
+        cache_key = result_cache.key(request.question, request.max_results,
+                                     request.similarity_threshold, request.filters, request.mode)
+        chat_records, index_version = result_cache.get(cache_key)
+        cached.append(chat_records)
+        if chat_records is None:
+            misses.append((i, request, cache_key, index_version))
+
+    try:
+        if misses:
+            # 关键词检索不需要问题向量，其余问题合并为一次embedding调用
+            embedded = [miss for miss in misses if miss[1].mode != "lexical"]
+            vectors = {}
+            if embedded:
+                vectors = dict(zip((i for i, _, _, _ in embedded), await run_query(
+                    query_embeddings.embed_queries, [request.question for _, request, _, _ in embedded])))
+            searched = {}
+            if SEARCH_BACKEND == "numpy":
+                grouped = [miss for miss in embedded if miss[1].mode == "vector"]
+                results = await search_records_numpy(grouped, [vectors[i] for i, _, _, _ in grouped])
+                searched.update(zip((i for i, _, _, _ in grouped), results))
+            others = [miss for miss in misses if miss[0] not in searched]
+            results = await asyncio.gather(*(
+                search_records(request, cache_key, index_version, query_vector=vectors.get(i))
+                for i, request, cache_key, index_version in others
+            ))
+            searched.update(zip((i for i, _, _, _ in others), results))
+            for i, chat_records in searched.items():
+                cached[i] = chat_records
+
+        response.headers["X-Cache-Hits"] = str(len(batch.questions) - len(misses))
+        return QueryBatchResponse(
+            results=[build_query_response(request.question, chat_records, request.mode)
+                     for request, chat_records in zip(batch.questions, cached)],
+            total_questions=len(batch.questions),
+            status="success"
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"查询失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"批量查询失败: {str(e)}")
+
+async def search_records_numpy(misses, vectors):
+    """NumPy后端：过滤条件相同的问题一起检索（一次矩阵乘法），再按各自的 max_results 截取"""
+    groups = {}
+    for miss, vector in zip(misses, vectors):
+        filters_key = json.dumps(miss[1].filters, sort_keys=True, ensure_ascii=False) if miss[1].filters else ""
+        groups.setdefault(filters_key, []).append((miss, vector))
+
+    searched = {}
+    for group in groups.values():
+        requests = [miss[1] for miss, _ in group]
+        versions = [current_store_version(miss[3]) for miss, _ in group]
+        results = await run_query(
+            vectorstore.similarity_search_by_vectors_with_scores,
+            [vector for _, vector in group],
+            k=max(request.max_results for request in requests),
+            filter=requests[0].filters
+        )
+        for ((i, request, cache_key, _), _), version, request_results in zip(group, versions, results):
+            searched[i] = cache_records(request, request_results[:request.max_results], cache_key, version)
+    return [searched[i] for i, _, _, _ in misses]
+
+def build_query_response(question, chat_records, mode="vector", timings=None):
+    return QueryResponse(
+        question=question,
+        related_records=chat_records,
+        total_found=len(chat_records),
+        status="success",
+        message=f"找到 {len(chat_records)} 条相关记录",
+        mode=mode,
+        timings=timings
+    )
 
 @app.post("/query_simple")
-async def query_simple(question: str, max_results: int = 5):
+async def query_simple(question: str, max_results: int = 5, mode: Literal["vector", "lexical", "hybrid"] = "vector"):
     """简化的查询接口，直接接受字符串参数"""
 
     if vectorstore is None:
@@ -269,7 +772,9 @@ async def query_simple(question: str, max_results: int = 5):
 
     try:
         # 搜索相关内容
-        results = vectorstore.similarity_search_with_score(question, k=max_results)
+        timings = {}
+        results = await run_query(run_search, QueryRequest(question=question, max_results=max_results, mode=mode),
+                                  None, timings)
 
         # 简化的返回格式
         records = []
@@ -284,31 +789,48 @@ async def query_simple(question: str, max_results: int = 5):
         return {
             "question": question,
             "records": records,
-            "count": len(records)
+            "count": len(records),
+            "mode": mode,
+            "timings": timings
         }
 
+    except HTTPException as e:
+        return {"error": e.detail}
     except Exception as e:
         return {"error": f"查询失败: {str(e)}"}
 
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="微信聊天记录向量数据库API服务")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("RAG_API_WORKERS", "1")),
+                        help="uvicorn工作进程数，每个进程各自加载向量数据库（只读）")
+    return parser.parse_args()
+
 if __name__ == "__main__":
+    args = parse_args()
     local_ip = get_local_ip()
 
     print("🚀 启动微信聊天记录API服务器...")
     print("=" * 60)
-    print(f"🏠 本地访问: http://localhost:8000")
-    print(f"🌐 局域网访问: http://{local_ip}:8000")
-    print(f"📖 API文档: http://{local_ip}:8000/docs")
+    print(f"🏠 本地访问: http://localhost:{args.port}")
+    print(f"🌐 局域网访问: http://{local_ip}:{args.port}")
+    print(f"📖 API文档: http://{local_ip}:{args.port}/docs")
+    print(f"⚙️ 工作进程: {args.workers} 个，每个进程 {QUERY_WORKERS} 个查询线程")
     print("=" * 60)
     print("📋 其他设备访问步骤:")
     print(f"1. 确保设备在同一局域网")
-    print(f"2. 访问地址: http://{local_ip}:8000")
+    print(f"2. 访问地址: http://{local_ip}:{args.port}")
     print(f"3. 如连接失败，请检查防火墙设置")
     print("=" * 60)
 
+    # 多进程模式需要以导入字符串的形式传入应用
     uvicorn.run(
         "api_service:app",
-        host="0.0.0.0",
-        port=8000,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
         reload=False,
         log_level="info"
     )
\ No newline at end of file
@@ -0,0 +1,124 @@
+"""
+问题向量微批处理
+并发请求的问题在很短的时间窗口内（默认5ms，或凑满 max_items 条）合并成一次embedding调用，
+每个等待中的请求拿回自己的向量；高并发时把N次往返合并为一次
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+_STOP = object()  # close() 放入队列的结束标记
+
+
+class MicroBatchEmbeddings:
+    """embedding包装器：embed_query 进入队列，由后台线程按时间窗口攒批后一次性嵌入
+
+    - embed_batch: 批量嵌入问题的函数 texts -> vectors（须与 embed_query 的结果一致，
+      例如DashScope需使用 text_type="query"），默认使用 embeddings.embed_documents
+    - window_ms: 第一条问题到达后最多再等待多久凑批
+    - max_items: 每批最多的问题数（text-embedding-v3 单次最多10条）
+    - max_in_flight: 同时进行的embedding请求数，前一批未返回时下一批照常发出
+    """
+
+    def __init__(self, embeddings, embed_batch=None, window_ms=5, max_items=10, max_in_flight=8):
+        self.embeddings = embeddings
+        self.embed_batch = embed_batch or embeddings.embed_documents
+        self.window = window_ms / 1000
+        self.max_items = max_items
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="embed-batch")
+        self._lock = threading.Lock()
+        self._closed = False
+
+        self.calls = 0
+        self.items = 0
+        self.largest_batch = 0
+        self.errors = 0
+        self.started_at = time.monotonic()
+
+        self._thread = threading.Thread(target=self._collect, name="embed-batcher", daemon=True)
+        self._thread.start()
+
+    def embed_query(self, text):
+        if self._closed:
+            raise RuntimeError("问题向量微批处理已关闭")
+        future = Future()
+        self._queue.put((text, future))
+        return future.result()
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    def close(self, timeout=5):
+        """停止攒批线程和请求线程池：已入队的问题发完最后一批，之后的调用抛出 RuntimeError"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._executor.shutdown(wait=False)
+        # close() 之后才入队的问题没有线程处理，直接失败
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                item[1].set_exception(RuntimeError("问题向量微批处理已关闭"))
+
+    def _collect(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_items:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._executor.submit(self._embed, batch)
+
+    def _embed(self, batch):
+        texts = [text for text, _ in batch]
+        try:
+            vectors = list(self.embed_batch(texts))
+            if len(vectors) != len(batch):
+                # 少返回的向量无法对应到问题，整批失败，不让任何请求一直等待
+                raise RuntimeError(f"embedding接口返回 {len(vectors)} 个向量，期望 {len(batch)} 个")
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        with self._lock:
+            self.calls += 1
+            self.items += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
+        for (_, future), vector in zip(batch, vectors):
+            future.set_result(vector)
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started_at
+        return {
+            "window_ms": self.window * 1000,
+            "max_items": self.max_items,
+            "calls": self.calls,
+            "questions": self.items,
+            "errors": self.errors,
+            "avg_batch": round(self.items / self.calls, 2) if self.calls else 0.0,
+            "largest_batch": self.largest_batch,
+            "calls_per_second": round(self.calls / elapsed, 2) if elapsed else 0.0,
+        }
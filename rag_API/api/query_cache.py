@@ -0,0 +1,291 @@
+"""
+API服务的查询缓存
+- TTLCache: 线程安全的LRU缓存，条目超过存活时间后失效，可限制总字节数，统计命中率
+- CachedQueryEmbeddings: 问题向量缓存，相同（规范化后的）问题不再重复调用embedding接口
+- ResultCache: /query 结果缓存，绑定索引代数，数据库重建或更新后自动失效
+- SingleFlight: 相同键的并发请求合并为一次计算
+- SearchLatency: 按检索方式统计各阶段的耗时分位数
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from message_dedup import normalize_message
+from incremental_index import GENERATION_NAME, read_generation
+
+
+class TTLCache:
+    """LRU + TTL 缓存
+
+    - max_entries: 最多缓存的条目数，超出后淘汰最久未使用的条目
+    - ttl_seconds: 条目存活时间，None 表示不过期
+    - max_bytes: 缓存总字节数上限（按 put 时传入的大小累计），None 表示只限制条目数
+    """
+
+    def __init__(self, max_entries=10000, ttl_seconds=None, max_bytes=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()  # key -> (写入时间, 值, 字节数)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def get(self, key):
+        """命中时返回值，否则返回None"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, value, size = entry
+            if self.ttl_seconds is not None and time.monotonic() - stored_at > self.ttl_seconds:
+                del self._data[key]
+                self._bytes -= size
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, size=0):
+        if self.max_bytes is not None and size > self.max_bytes:
+            return  # 单个条目超过整个缓存预算，不缓存
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._data[key] = (time.monotonic(), value, size)
+            self._bytes += size
+            while len(self._data) > self.max_entries or \
+                    (self.max_bytes is not None and self._bytes > self.max_bytes):
+                _, (_, _, evicted_size) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evicted += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
+
+
+class CachedQueryEmbeddings:
+    """embedding包装器：问题向量按 (模型名, 规范化后的问题) 缓存
+
+    规范化与构建时相同（全角半角统一、合并空白），实际嵌入的也是规范化后的文本，
+    因此 "张三  说了什么" 和 "张三 说了什么" 共用同一个向量。文档embedding直接透传。
+    embed_batch 为一次嵌入多个问题的函数（texts -> vectors），供 embed_queries 使用。
+    """
+
+    def __init__(self, embeddings, model_name, max_entries=10000, ttl_seconds=3600, embed_batch=None):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.embed_batch = embed_batch
+        self.cache = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+
+    def embed_query(self, text):
+        normalized = normalize_message(text) or text
+        key = (self.model_name, normalized)
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = self.embeddings.embed_query(normalized)
+            self.cache.put(key, vector)
+        return vector
+
+    def embed_queries(self, texts):
+        """嵌入多个问题：缓存未命中的问题去重后合并为一次 embed_batch 调用"""
+        normalized = [normalize_message(text) or text for text in texts]
+        vectors = {text: self.cache.get((self.model_name, text)) for text in set(normalized)}
+        missing = [text for text, vector in vectors.items() if vector is None]
+        if missing:
+            if self.embed_batch is not None:
+                new_vectors = self.embed_batch(missing)
+            else:
+                new_vectors = [self.embeddings.embed_query(text) for text in missing]
+            for text, vector in zip(missing, new_vectors):
+                vectors[text] = vector
+                self.cache.put((self.model_name, text), vector)
+        return [vectors[text] for text in normalized]
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    def stats(self):
+        return {"model": self.model_name, **self.cache.stats()}
+
+
+class IndexGeneration:
+    """跟踪向量数据库目录中的索引代数文件
+
+    构建脚本每次改变数据库内容后把代数加一；这里最多每 check_interval 秒检查一次文件的修改时间，
+    变化时重新读取，查询路径上几乎没有额外开销。全量重建会删除数据库目录、代数从头计数，
+    因此以观察到的文件变化次数 version 判断缓存是否失效，而不是只比较代数大小。
+    """
+
+    def __init__(self, db_path, check_interval=1.0):
+        self.db_path = db_path
+        self.path = os.path.join(db_path, GENERATION_NAME)
+        self.check_interval = check_interval
+        self.generation = read_generation(db_path)
+        self.version = 0
+        self._mtime = self._stat()
+        self._checked_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _stat(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def current(self):
+        """返回当前 version（文件每变化一次加一）"""
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return self.version
+        with self._lock:
+            self._checked_at = now
+            mtime = self._stat()
+            if mtime != self._mtime:
+                self._mtime = mtime
+                self.generation = read_generation(self.db_path)
+                self.version += 1
+        return self.version
+
+
+class ResultCache:
+    """/query 结果缓存
+
+    键为 (规范化后的问题, max_results, similarity_threshold, 过滤条件)，每个条目绑定写入时的索引版本：
+    索引变化（重建、增量更新）时整个缓存清空；查询开始后索引发生变化的结果不写入缓存。
+    总大小按响应JSON的字节数限制在 max_bytes 以内。
+    """
+
+    def __init__(self, index, max_bytes=64 * 1024 * 1024, ttl_seconds=600, max_entries=100000):
+        self.index = index
+        self.cache = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds, max_bytes=max_bytes)
+        self.invalidations = 0
+        self._version = index.current()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(question, max_results, similarity_threshold, filters=None, mode="vector"):
+        filters_key = json.dumps(filters, sort_keys=True, ensure_ascii=False) if filters else ""
+        return (normalize_message(question), int(max_results), float(similarity_threshold), filters_key, mode)
+
+    @property
+    def generation(self):
+        return self.index.generation
+
+    def _sync(self):
+        version = self.index.current()
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self.cache.clear()
+                    self.invalidations += 1
+                    self._version = version
+        return version
+
+    def get(self, key):
+        """返回 (缓存的结果或None, 当前索引版本)"""
+        version = self._sync()
+        return self.cache.get(key), version
+
+    def put(self, key, value, version, size):
+        """version 为查询开始时的索引版本，期间数据库发生变化时不缓存"""
+        if self._sync() == version:
+            self.cache.put(key, value, size)
+
+    def stats(self):
+        return {"generation": self.generation, "invalidations": self.invalidations, **self.cache.stats()}
+
+
+class SingleFlight:
+    """合并进行中的相同请求（在事件循环中使用）
+
+    第一个请求执行计算，计算完成前到达的相同键的请求直接等待同一个结果（包括异常）。
+    计算用 asyncio.shield 保护，发起请求的客户端断开也不会取消其他请求正在等待的计算。
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def run(self, key, func):
+        """返回 (结果, 是否复用了其他请求的计算)；func 为返回协程的无参函数"""
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future), True
+
+        self.leaders += 1
+        future = asyncio.ensure_future(func())
+        self._inflight[key] = future
+        future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(future), False
+
+    def stats(self):
+        total = self.leaders + self.coalesced
+        return {
+            "in_flight": len(self._inflight),
+            "executed": self.leaders,
+            "coalesced": self.coalesced,
+            "coalesced_rate": round(self.coalesced / total, 4) if total else 0.0,
+        }
+
+
+class SearchLatency:
+    """按检索方式（vector/lexical/hybrid）统计各阶段耗时，保留每个阶段最近 window 次的样本计算分位数"""
+
+    def __init__(self, window=1000):
+        self.window = window
+        self._requests = {}
+        self._samples = {}  # (检索方式, 阶段) -> 最近的耗时（毫秒）
+        self._lock = threading.Lock()
+
+    def record(self, mode, timings):
+        with self._lock:
+            self._requests[mode] = self._requests.get(mode, 0) + 1
+            for stage, ms in timings.items():
+                self._samples.setdefault((mode, stage), deque(maxlen=self.window)).append(ms)
+
+    def stats(self):
+        with self._lock:
+            requests = dict(self._requests)
+            samples = {key: sorted(values) for key, values in self._samples.items()}
+        result = {mode: {"requests": count} for mode, count in requests.items()}
+        for (mode, stage), values in samples.items():
+            result[mode][stage] = {
+                "p50": round(values[len(values) // 2], 3),
+                "p99": round(values[min(len(values) - 1, int(len(values) * 0.99))], 3),
+            }
+        return result
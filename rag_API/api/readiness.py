@@ -0,0 +1,74 @@
+"""
+就绪状态
+启动时的检查结果缓存在内存中，后台任务按固定间隔自检并更新；
+/readyz、/health 只读取缓存的状态，探针本身不做任何检索，也不调用embedding接口
+"""
+
+import asyncio
+import time
+
+
+class ReadinessMonitor:
+    """缓存就绪状态，后台定期执行自检
+
+    - check: 阻塞的自检函数，成功时返回附加信息（dict），失败时抛出异常
+    - interval: 自检间隔（秒）
+    """
+
+    def __init__(self, check, interval=30.0):
+        self.check = check
+        self.interval = interval
+        self.ready = False
+        self.reason = "启动中"
+        self.detail = {}
+        self.checked_at = None
+        self.check_seconds = None
+        self.checks = 0
+        self.failures = 0
+        self.info = {}  # 其他需要随状态返回的信息，如启动各阶段耗时
+        self._task = None
+
+    def record(self, ready, reason, detail=None, seconds=None):
+        self.ready = ready
+        self.reason = reason
+        self.detail = detail or {}
+        self.checked_at = time.strftime("%Y-%m-%d %H:%M:%S")
+        self.check_seconds = seconds
+
+    async def check_now(self, executor=None):
+        """在线程池中执行一次自检并更新状态"""
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        self.checks += 1
+        try:
+            detail = await loop.run_in_executor(executor, self.check)
+            self.record(True, "正常", detail, time.perf_counter() - start)
+        except Exception as e:
+            self.failures += 1
+            self.record(False, f"自检失败: {e}", seconds=time.perf_counter() - start)
+
+    def start(self, executor=None):
+        """启动后台自检任务"""
+        async def loop():
+            while True:
+                await asyncio.sleep(self.interval)
+                await self.check_now(executor)
+
+        self._task = asyncio.ensure_future(loop())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    def status(self):
+        return {
+            "ready": self.ready,
+            "reason": self.reason,
+            "checked_at": self.checked_at,
+            "check_ms": round(self.check_seconds * 1000, 2) if self.check_seconds is not None else None,
+            "interval_seconds": self.interval,
+            "checks": self.checks,
+            "failures": self.failures,
+            **self.detail,
+            **self.info,
+        }
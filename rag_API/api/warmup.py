@@ -0,0 +1,81 @@
+"""
+API启动预热
+- 预读向量数据库目录中的HNSW索引文件（data_level0.bin、link_lists.bin 等）、chroma.sqlite3 和NumPy索引的 vectors.npy，
+  让它们进入操作系统页缓存，第一批真实查询不再承担冷启动的磁盘读取
+- 执行一组有代表性的查询，问题向量进入缓存，索引加载到内存
+- 记录每个启动阶段的耗时
+"""
+
+import os
+import time
+from contextlib import contextmanager
+
+# 预热问题：覆盖常见的问候、时间、安排类问题；可用 RAG_WARMUP_QUERIES 指向每行一个问题的文件替换
+DEFAULT_WARMUP_QUERIES = [
+    "你好",
+    "今天晚上吃什么",
+    "明天几点开会",
+    "周末有什么安排",
+    "谢谢",
+    "作业什么时候交",
+    "这个文件发我一下",
+    "好的收到",
+]
+
+INDEX_SUFFIXES = (".bin", ".pickle", ".sqlite3", ".npy")
+
+
+def load_warmup_queries(path=None):
+    """读取预热问题文件（每行一个，忽略空行和#开头的行），未指定时使用默认问题"""
+    if not path:
+        return list(DEFAULT_WARMUP_QUERIES)
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def touch_index_files(db_path, chunk_size=8 << 20, skip=()):
+    """顺序读取索引文件使其进入页缓存，返回 (文件数, 字节数)；skip 为不读取的文件名"""
+    files = 0
+    total = 0
+    for root, _, names in os.walk(db_path):
+        for name in names:
+            if not name.endswith(INDEX_SUFFIXES) or name in skip:
+                continue
+            path = os.path.join(root, name)
+            try:
+                with open(path, "rb") as f:
+                    if hasattr(os, "posix_fadvise"):
+                        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+                    while True:
+                        chunk = f.read(chunk_size)
+                        if not chunk:
+                            break
+                        total += len(chunk)
+            except OSError:
+                continue
+            files += 1
+    return files, total
+
+
+class StageTimer:
+    """记录启动各阶段的耗时"""
+
+    def __init__(self):
+        self.stages = []  # [(阶段名, 耗时秒, 说明)]
+
+    @contextmanager
+    def stage(self, name):
+        info = {}
+        start = time.perf_counter()
+        try:
+            yield info
+        finally:
+            seconds = time.perf_counter() - start
+            self.stages.append((name, seconds, info.get("detail", "")))
+            print(f"⏱️ {name}: {seconds * 1000:.0f} ms {info.get('detail', '')}".rstrip())
+
+    def summary(self):
+        return {name: round(seconds * 1000, 1) for name, seconds, _ in self.stages}
+
+    def total(self):
+        return sum(seconds for _, seconds, _ in self.stages)
@@ -0,0 +1,211 @@
+"""
+API服务压力测试
+对 /query 发起固定并发的闭环请求，统计QPS和延迟分位数。
+
+两种用法（在 rag_API 目录下运行）:
+    # 压测已经在运行的服务
+    python benchmarks/bench_api_load.py --url http://localhost:8000 --concurrency 32 --requests 1000
+
+    # 自动启动本地模拟embedding服务和不同配置的API服务，逐一压测并对比
+    python benchmarks/bench_api_load.py --compare --db ./chroma_wechat_db --embed-latency-ms 80
+
+对比模式下 "1线程" 配置每个进程同时只执行一个检索，等价于旧版在事件循环里直接调用阻塞检索的行为。
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from urllib import request as urllib_request
+from urllib.error import URLError
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RAG_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, os.path.join(RAG_DIR, "core"))
+sys.path.insert(0, BENCH_DIR)
+
+from wechat_loader import WeChatCSVLoader
+from fake_embedding_server import FakeEmbeddingServer
+
+
+def load_questions(csv_folder, limit=500, seed=0):
+    """从聊天记录中取一些消息作为查询问题"""
+    messages = []
+    for record in WeChatCSVLoader(csv_folder, verbose=False).lazy_records():
+        if 4 <= len(record['msg']) <= 60:
+            messages.append(record['msg'])
+    random.Random(seed).shuffle(messages)
+    return messages[:limit] or ["测试"]
+
+
+def post_json(url, payload, timeout=60):
+    data = json.dumps(payload).encode("utf-8")
+    req = urllib_request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    with urllib_request.urlopen(req, timeout=timeout) as resp:
+        return resp.status, dict(resp.headers), json.loads(resp.read())
+
+
+def run_load(base_url, questions, concurrency=16, total_requests=500, path="/query", make_payload=None):
+    """闭环压测：concurrency 个线程各自连续发送请求，直到总数达到 total_requests"""
+    make_payload = make_payload or (lambda question: {"question": question, "max_results": 5})
+    latencies = []
+    errors = []
+    counter = iter(range(total_requests))
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            question = questions[index % len(questions)]
+            start = time.perf_counter()
+            try:
+                post_json(base_url + path, make_payload(question))
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies.append(elapsed)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+    return summarize(latencies, errors, wall)
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(q / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def summarize(latencies, errors, wall):
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "wall": wall,
+        "qps": len(latencies) / wall if wall else 0.0,
+        "p50": percentile(latencies, 50),
+        "p99": percentile(latencies, 99),
+        "mean": statistics.mean(latencies) if latencies else 0.0,
+    }
+
+
+def print_result(name, result):
+    print(f"{name:<22}{result['requests']:>8}{result['errors']:>6}{result['qps']:>10.1f}"
+          f"{result['p50'] * 1000:>10.0f}{result['p99'] * 1000:>10.0f}")
+    if result["first_error"]:
+        print(f"  ⚠️ 错误示例: {result['first_error']}")
+
+
+def print_header():
+    print(f"{'配置':<22}{'成功':>8}{'失败':>6}{'QPS':>10}{'p50(ms)':>10}{'p99(ms)':>10}")
+
+
+def wait_ready(base_url, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib_request.urlopen(base_url + "/health", timeout=5) as resp:
+                if resp.status == 200:
+                    return True
+        except (URLError, OSError):
+            pass
+        time.sleep(0.5)
+    return False
+
+
+def start_service(port, db_path, embed_url, workers=1, query_workers=16, extra_env=None):
+    """以子进程方式启动API服务"""
+    env = dict(os.environ)
+    env.update({
+        "RAG_DB_PATH": os.path.abspath(db_path),
+        "DASHSCOPE_HTTP_BASE_URL": embed_url,
+        "RAG_QUERY_WORKERS": str(query_workers),
+    })
+    env.update(extra_env or {})
+    return subprocess.Popen(
+        [sys.executable, os.path.join(RAG_DIR, "api", "api_service.py"), "--host", "127.0.0.1",
+         "--port", str(port), "--workers", str(workers)],
+        cwd=RAG_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+def compare(args, questions):
+    server = FakeEmbeddingServer(dim=args.dim, latency_ms=args.embed_latency_ms, jitter_ms=0).start()
+    configs = [
+        ("1进程 × 1线程", 1, 1),
+        (f"1进程 × {args.query_workers}线程", 1, args.query_workers),
+        (f"{args.workers}进程 × {args.query_workers}线程", args.workers, args.query_workers),
+    ]
+
+    print(f"🧪 模拟embedding延迟 {args.embed_latency_ms:.0f} ms，并发 {args.concurrency}，每组 {args.requests} 次请求")
+    print("=" * 66)
+    print_header()
+    results = {}
+    for name, workers, query_workers in configs:
+        port = args.port
+        process = start_service(port, args.db, server.base_url, workers, query_workers)
+        try:
+            base_url = f"http://127.0.0.1:{port}"
+            if not wait_ready(base_url):
+                print(f"{name:<22}服务启动失败")
+                continue
+            run_load(base_url, questions, args.concurrency, min(50, args.requests))  # 预热
+            results[name] = run_load(base_url, questions, args.concurrency, args.requests)
+            print_result(name, results[name])
+        finally:
+            process.terminate()
+            process.wait()
+    server.stop()
+
+    baseline = results.get(configs[0][0])
+    if baseline and baseline["qps"]:
+        print("-" * 66)
+        for name, result in results.items():
+            if name != configs[0][0]:
+                print(f"⚡ {name}: QPS 提升 {result['qps'] / baseline['qps']:.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API服务压力测试")
+    parser.add_argument("--url", default=None, help="压测已经运行的服务")
+    parser.add_argument("--compare", action="store_true", help="自动启动不同配置的服务并对比")
+    parser.add_argument("--csv", default="csv")
+    parser.add_argument("--db", default="./chroma_wechat_db")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--embed-latency-ms", type=float, default=80)
+    parser.add_argument("--dim", type=int, default=1024, help="模拟embedding维度，需与数据库一致")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--query-workers", type=int, default=16)
+    args = parser.parse_args()
+
+    questions = load_questions(args.csv)
+    if args.compare:
+        compare(args, questions)
+    elif args.url:
+        print_header()
+        print_result(args.url, run_load(args.url.rstrip("/"), questions, args.concurrency, args.requests))
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+CSV加载性能对比脚本
+对比旧的 CSVLoader 往返解析路径与新的流式按列解析路径（耗时、峰值内存、被破坏的消息数）
+
+用法（在 rag_API 目录下运行）:
+    python benchmarks/bench_csv_loader.py [csv目录]
+"""
+
+import csv
+import os
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "core"))
+
+from wechat_loader import (
+    WeChatCSVLoader,
+    format_chat_record,
+    is_valid_message,
+    record_metadata,
+)
+
+
+def legacy_page_contents(csv_file, encoding="utf-8"):
+    """复现 CSVLoader 的输出：每行拼接成 "key: value" 文本"""
+    try:
+        from langchain_community.document_loaders.csv_loader import CSVLoader
+    except ImportError:
+        # 未安装 langchain_community 时按 CSVLoader 的拼接规则自行生成
+        with open(csv_file, "r", encoding=encoding, newline="") as f:
+            return [
+                "\n".join(f"{k.strip()}: {(v or '').strip()}" for k, v in row.items())
+                for row in csv.DictReader(f)
+            ]
+
+    loader = CSVLoader(file_path=str(csv_file), encoding=encoding, csv_args={'delimiter': ','})
+    return [doc.page_content for doc in loader.load()]
+
+
+def legacy_load(csv_folder):
+    """旧路径：CSVLoader 拼接文本 → 按换行和冒号拆回字典，全部结果保存在列表中"""
+    results = []
+    for csv_file in sorted(Path(csv_folder).glob("**/*.csv")):
+        for page_content in legacy_page_contents(csv_file):
+            chat_data = {}
+            for part in page_content.split('\n'):
+                if ':' in part:
+                    key, value = part.split(':', 1)
+                    chat_data[key.strip()] = value.strip()
+
+            msg_content = chat_data.get('msg', '').strip()
+            if not is_valid_message(msg_content, chat_data.get('type_name', '')):
+                continue
+
+            record = {
+                "source": csv_file.name,
+                "msg_id": chat_data.get('MsgSvrID', ''),
+                "chat_time": chat_data.get('CreateTime', ''),
+                "sender": chat_data.get('talker', ''),
+                "msg_type": chat_data.get('type_name', ''),
+                "room": chat_data.get('room_name', ''),
+                "is_sender": chat_data.get('is_sender', '0'),
+                "msg": msg_content,
+            }
+            results.append((format_chat_record(record), record_metadata(record)))
+    return results
+
+
+def streaming_load(csv_folder):
+    """新路径：按列直接读取，逐条处理，不保留中间结果"""
+    loader = WeChatCSVLoader(csv_folder, verbose=False)
+    count = 0
+    for record in loader.lazy_records():
+        format_chat_record(record)
+        record_metadata(record)
+        count += 1
+    return count
+
+
+def count_corrupted(csv_folder, legacy_results):
+    """统计旧路径中内容被截断或错拆的消息数（以流式解析结果为准）"""
+    loader = WeChatCSVLoader(csv_folder, verbose=False)
+    messages = {record['msg_id']: record['msg'][:200] for record in loader.lazy_records()}
+    return sum(
+        1 for _, metadata in legacy_results
+        if messages.get(metadata['msg_id'], metadata['msg_content']) != metadata['msg_content']
+    )
+
+
+def measure(func, *args):
+    """返回 (结果, 耗时秒, 峰值内存MB)"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak / 1024 / 1024
+
+
+def main():
+    csv_folder = sys.argv[1] if len(sys.argv) > 1 else "csv"
+    if not os.path.exists(csv_folder):
+        print(f"❌ 未找到csv文件夹: {csv_folder}")
+        return
+
+    print("📊 CSV加载性能对比")
+    print("=" * 60)
+
+    legacy_results, legacy_time, legacy_peak = measure(legacy_load, csv_folder)
+    stream_count, stream_time, stream_peak = measure(streaming_load, csv_folder)
+    corrupted = count_corrupted(csv_folder, legacy_results)
+
+    print(f"{'路径':<20}{'记录数':>10}{'耗时(秒)':>12}{'记录/秒':>12}{'峰值内存(MB)':>16}")
+    print(f"{'CSVLoader往返解析':<20}{len(legacy_results):>10}{legacy_time:>12.3f}"
+          f"{len(legacy_results) / legacy_time:>12.0f}{legacy_peak:>16.1f}")
+    print(f"{'流式按列解析':<20}{stream_count:>10}{stream_time:>12.3f}"
+          f"{stream_count / stream_time:>12.0f}{stream_peak:>16.1f}")
+    print("-" * 60)
+    print(f"⚡ 加速比: {legacy_time / stream_time:.2f}x")
+    print(f"⚠️ 旧路径中被截断或错拆的多行消息: {corrupted} 条")
+
+
+if __name__ == "__main__":
+    main()
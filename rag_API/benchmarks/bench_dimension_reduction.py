@@ -0,0 +1,93 @@
+"""
+NumPy索引降维的延迟、内存与召回率报告
+在导出的矩阵上离线拟合不同维度的降维投影（PCA 和直接截取前几维），用与 bench_numpy_search.py 相同的问题向量检索：
+- 内存：粗排用的矩阵（加投影矩阵）大小
+- 延迟：单个问题的 p50 和每批问题的平均耗时（k 取最大值）
+- 召回率：与 float32 精确结果对比的 recall@5、recall@10，分别统计不重排（只用降维后的向量）和重排候选的情况
+
+不重排时返回的是近似距离，召回率按返回记录的真实距离计算。
+
+用法（在 rag_API 目录下运行）:
+    python benchmarks/bench_dimension_reduction.py --db ./chroma_wechat_db --dims 64 128 256 512
+"""
+
+import argparse
+import os
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "core"))
+
+from bench_numpy_search import percentile, recall, sample_queries, time_each
+from numpy_index import REDUCE_METHODS, NumpyVectorStore, fit_reduction, load_numpy_index
+
+
+def true_distances(exact_store, queries, found):
+    """把返回结果的距离换成 float32 矩阵上的真实距离"""
+    import numpy as np
+
+    rows = np.array([[row for row, _ in hits] for hits in found])
+    distances = exact_store.rescore(queries, rows)
+    return [list(zip(row_ids.tolist(), row_distances.tolist())) for row_ids, row_distances in zip(rows, distances)]
+
+
+def measure(store, exact_store, queries, exact, args):
+    """返回 (单个问题p50毫秒, 每批每问题毫秒, {k: recall})"""
+    store.search_batch(queries[:1], k=max(args.k))  # 预热
+    latencies, _ = time_each(lambda q: store.search_batch(q[None, :], k=max(args.k)), queries)
+    batches = [queries[i:i + args.batch_size] for i in range(0, len(queries), args.batch_size)]
+    batch_latencies, _ = time_each(lambda batch: store.search_batch(batch, k=max(args.k)), batches)
+    recalls = {}
+    for k in args.k:
+        found = true_distances(exact_store, queries, store.search_batch(queries, k=k))
+        recalls[k] = recall(found, exact[k])
+    return percentile(latencies, 50), sum(batch_latencies) / len(queries) * 1000, recalls
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NumPy索引降维的延迟、内存与召回率报告")
+    parser.add_argument("--db", default="./chroma_wechat_db")
+    parser.add_argument("--dims", type=int, nargs="+", default=[64, 128, 256, 512])
+    parser.add_argument("--methods", nargs="+", choices=REDUCE_METHODS, default=list(REDUCE_METHODS))
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, nargs="+", default=[5, 10])
+    parser.add_argument("--rescore-factors", type=int, nargs="+", default=[0, 4],
+                        help="重排候选数为 k 的多少倍（0 表示不重排）")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--noise", type=float, default=0.1, help="噪声相对向量长度的比例")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    exact_store = load_numpy_index(args.db)  # 没有导出或已过期时先导出
+    full_dim = exact_store.vectors.shape[1]
+    queries = sample_queries(exact_store, args.queries, args.noise, args.seed)
+    exact = {k: exact_store.search_batch(queries, k=k) for k in args.k}
+    print(f"🧪 {exact_store.count():,} 条向量（{full_dim} 维，{exact_store.space}），{len(queries)} 个问题")
+
+    recall_headers = "".join(f"{f'recall@{k}':>11}" for k in args.k)
+    print("=" * 90)
+    print(f"{'方法':<10}{'维度':>6}{'保留方差':>10}{'拟合(秒)':>10}{'向量数据(MB)':>14}{'重排倍数':>10}"
+          f"{'p50(ms)':>10}{'每批(ms/问题)':>15}{recall_headers}")
+
+    def print_row(method, dim, explained, fit_seconds, store, factor):
+        p50, batch, recalls = measure(store, exact_store, queries, exact, args)
+        recall_values = "".join(f"{recalls[k]:>11.3f}" for k in args.k)
+        print(f"{method:<10}{dim:>6}{explained:>10}{fit_seconds:>10}{store.memory_bytes() / 1024 / 1024:>14.1f}"
+              f"{factor:>10}{p50:>10.2f}{batch:>15.3f}{recall_values}")
+
+    print_row("float32", full_dim, "100%", "-", exact_store, "-")
+    for method in args.methods:
+        for dim in args.dims:
+            if not 0 < dim < full_dim:
+                continue
+            fit = fit_reduction(args.db, dim, method)
+            for factor in args.rescore_factors:
+                store = NumpyVectorStore(args.db, rescore_factor=factor, reduce_dim=dim, reduce_method=method)
+                print_row(method, dim, f"{fit['explained_variance'] * 100:.1f}%", f"{fit['fit_seconds']:.2f}",
+                          store, factor)
+    print("=" * 90)
+
+
+if __name__ == "__main__":
+    main()
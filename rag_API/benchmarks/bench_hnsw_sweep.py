@@ -0,0 +1,148 @@
+"""
+HNSW参数扫描：召回率与延迟
+以NumPy精确检索的结果为准，在参数网格上统计 Chroma HNSW 的 recall@k 和单个问题的 p50/p99 延迟：
+- 对每组 (M, ef_construction) 用数据库中的向量在临时目录重建一个集合，记录构建耗时
+- 对每个 ef_search 在独立的子进程中打开集合检索（ef_search 在进程第一次检索时生效，同一进程内修改无效）
+
+--reopen 时不重建，只在现有数据库上扫描 ef_search，结束后恢复原来的 ef_search（扫描期间不要同时运行API服务）。
+问题向量与 bench_numpy_search.py 相同：库中随机向量加少量高斯噪声。
+
+用法（在 rag_API 目录下运行）:
+    python benchmarks/bench_hnsw_sweep.py --db ./chroma_wechat_db --m 8 16 32 --ef-construction 100 200 --ef-search 10 50 100 200
+    python benchmarks/bench_hnsw_sweep.py --db ./chroma_wechat_db --reopen --ef-search 10 50 100 200
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "core"))
+
+from bench_numpy_search import percentile, recall, sample_queries, time_each
+from hnsw_params import apply_hnsw_params, describe_hnsw, hnsw_configuration
+from numpy_index import DEFAULT_COLLECTION, load_numpy_index, open_collection
+
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def build_collection(store, path, m, ef_construction):
+    """用NumPy索引中的向量在 path 新建集合，返回构建耗时（秒）"""
+    import chromadb
+    import numpy as np
+
+    shutil.rmtree(path, ignore_errors=True)
+    client = chromadb.PersistentClient(path=path)
+    collection = client.create_collection(
+        DEFAULT_COLLECTION,
+        configuration=hnsw_configuration({"M": m, "ef_construction": ef_construction}, space=store.space))
+    batch_size = client.get_max_batch_size()
+    start = time.perf_counter()
+    for offset in range(0, store.count(), batch_size):
+        collection.add(ids=store.ids[offset:offset + batch_size],
+                       embeddings=np.asarray(store.vectors[offset:offset + batch_size]))
+    return time.perf_counter() - start
+
+
+def run_worker(args):
+    """子进程：设置 ef_search 后检索，输出JSON结果"""
+    store = load_numpy_index(args.db)
+    queries = sample_queries(store, args.queries, args.noise, args.seed)
+    exact = store.search_batch(queries, k=args.k)
+    rows = {doc_id: row for row, doc_id in enumerate(store.ids)}
+
+    collection = open_collection(args.worker)
+    apply_hnsw_params(collection, {"ef_search": args.worker_ef})
+    collection.query(query_embeddings=queries[:1], n_results=args.k)  # 预热：加载索引
+    latencies, results = time_each(lambda q: collection.query(query_embeddings=q[None, :], n_results=args.k,
+                                                              include=["distances"]), queries)
+    found = [[(rows[doc_id], distance) for doc_id, distance in zip(result["ids"][0], result["distances"][0])]
+             for result in results]
+    print(json.dumps({"p50_ms": percentile(latencies, 50), "p99_ms": percentile(latencies, 99),
+                      "recall": recall(found, exact)}))
+
+
+def sweep_ef(args, path, ef_values):
+    """对每个 ef_search 启动一个子进程检索，返回结果列表"""
+    results = []
+    for ef_search in ef_values:
+        command = [sys.executable, os.path.abspath(__file__), "--db", args.db, "--worker", path,
+                   "--worker-ef", str(ef_search), "--queries", str(args.queries), "--k", str(args.k),
+                   "--noise", str(args.noise), "--seed", str(args.seed)]
+        output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        result["ef_search"] = ef_search
+        results.append(result)
+    return results
+
+
+def print_rows(m, ef_construction, build, size_mb, results):
+    for result in results:
+        print(f"{m:>6}{ef_construction:>17}{build:>12}{size_mb:>12}{result['ef_search']:>11}"
+              f"{result['p50_ms']:>10.2f}{result['p99_ms']:>10.2f}{result['recall']:>11.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HNSW参数扫描：召回率与延迟")
+    parser.add_argument("--db", default="./chroma_wechat_db")
+    parser.add_argument("--m", type=int, nargs="+", default=[8, 16, 32])
+    parser.add_argument("--ef-construction", type=int, nargs="+", default=[100, 200])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[10, 50, 100, 200])
+    parser.add_argument("--reopen", action="store_true", help="不重建，只在现有数据库上扫描 ef_search")
+    parser.add_argument("--work-dir", default=None, help="重建集合的临时目录，默认使用系统临时目录")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--noise", type=float, default=0.1, help="噪声相对向量长度的比例")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--worker-ef", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    store = load_numpy_index(args.db)  # 没有导出或已过期时先导出，精确结果以它为准
+    print(f"🧪 {store.count():,} 条向量（{store.vectors.shape[1]} 维，{store.space}），{args.queries} 个问题，k={args.k}")
+    queries = sample_queries(store, args.queries, args.noise, args.seed)
+    exact_latencies, _ = time_each(lambda q: store.search_batch(q[None, :], k=args.k), queries)
+
+    print("=" * 89)
+    print(f"{'M':>6}{'ef_construction':>17}{'构建(秒)':>12}{'索引(MB)':>12}{'ef_search':>11}"
+          f"{'p50(ms)':>10}{'p99(ms)':>10}{f'recall@{args.k}':>11}")
+    if args.reopen:
+        collection = open_collection(args.db)
+        original = describe_hnsw(collection)
+        try:
+            results = sweep_ef(args, args.db, args.ef_search)
+        finally:
+            apply_hnsw_params(collection, {"ef_search": original["ef_search"]})
+        print_rows(original["M"], original["ef_construction"], "-", "-", results)
+    else:
+        work_dir = args.work_dir or tempfile.mkdtemp(prefix="hnsw_sweep_")
+        try:
+            for m in args.m:
+                for ef_construction in args.ef_construction:
+                    path = os.path.join(work_dir, f"m{m}_efc{ef_construction}")
+                    build = build_collection(store, path, m, ef_construction)
+                    results = sweep_ef(args, path, args.ef_search)
+                    print_rows(m, ef_construction, f"{build:.1f}", f"{directory_size(path) / 1024 / 1024:.1f}",
+                               results)
+                    shutil.rmtree(path, ignore_errors=True)
+        finally:
+            if not args.work_dir:
+                shutil.rmtree(work_dir, ignore_errors=True)
+    print("=" * 89)
+    print(f"📏 NumPy精确检索: p50 {percentile(exact_latencies, 50):.2f} ms，p99 {percentile(exact_latencies, 99):.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
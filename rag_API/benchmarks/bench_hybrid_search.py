@@ -0,0 +1,89 @@
+"""
+向量、关键词、混合三种检索方式的延迟对比
+启动本地模拟embedding服务和API服务（关闭缓存，每个请求都实际检索），用同一组问题依次以三种 mode 调用 /query，
+统计客户端看到的 p50/p99 和服务端返回的各阶段耗时（timings）的 p50。
+
+模拟embedding返回的向量没有语义，这里只比较延迟；检索质量需要在真实数据库上用 clients/api_client_test.py 对比。
+
+用法（在 rag_API 目录下运行）:
+    python benchmarks/bench_hybrid_search.py --db ./chroma_wechat_db --backends chroma numpy
+"""
+
+import argparse
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_api_load import load_questions, percentile, post_json, start_service, wait_ready
+from fake_embedding_server import FakeEmbeddingServer
+
+MODES = ["vector", "lexical", "hybrid"]
+STAGES = ["embed_ms", "vector_ms", "lexical_ms", "fetch_ms", "fusion_ms"]
+NAME_QUESTIONS = ["雷蕾", "张宏哲", "毕业晚会"]
+
+
+def run_mode(base_url, questions, mode, max_results):
+    """依次查询，返回 (客户端延迟列表[秒], {阶段: 服务端耗时列表[毫秒]})"""
+    latencies = []
+    stages = {}
+    for question in questions:
+        start = time.perf_counter()
+        _, _, body = post_json(base_url + "/query", {"question": question, "max_results": max_results, "mode": mode})
+        latencies.append(time.perf_counter() - start)
+        for stage, ms in (body.get("timings") or {}).items():
+            stages.setdefault(stage, []).append(ms)
+    return latencies, stages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="向量、关键词、混合三种检索方式的延迟对比")
+    parser.add_argument("--csv", default="csv")
+    parser.add_argument("--db", default="./chroma_wechat_db")
+    parser.add_argument("--backends", nargs="+", choices=["chroma", "numpy"], default=["chroma", "numpy"])
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--max-results", type=int, default=5)
+    parser.add_argument("--hybrid-depth", type=int, default=50, help="混合检索每一路取的候选数（RAG_HYBRID_DEPTH）")
+    parser.add_argument("--embed-latency-ms", type=float, default=80)
+    parser.add_argument("--dim", type=int, default=1024, help="模拟embedding维度，需与数据库一致")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    questions = NAME_QUESTIONS + load_questions(args.csv, limit=args.questions)
+    server = FakeEmbeddingServer(dim=args.dim, latency_ms=args.embed_latency_ms, jitter_ms=0).start()
+    print(f"🧪 {len(questions)} 个问题，max_results={args.max_results}，混合检索每路 {args.hybrid_depth} 条，"
+          f"模拟embedding延迟 {args.embed_latency_ms:.0f} ms")
+    print("=" * 104)
+    print(f"{'后端':<8}{'检索方式':<10}{'p50(ms)':>10}{'p99(ms)':>10}"
+          + "".join(f"{stage:>13}" for stage in STAGES) + f"{'服务端total':>14}")
+    try:
+        for backend in args.backends:
+            process = start_service(args.port, args.db, server.base_url, extra_env={
+                "RAG_EMBED_CACHE_SIZE": "0", "RAG_RESULT_CACHE_MB": "0",
+                "RAG_SEARCH_BACKEND": backend, "RAG_HYBRID_DEPTH": str(args.hybrid_depth)})
+            base_url = f"http://127.0.0.1:{args.port}"
+            try:
+                if not wait_ready(base_url):
+                    print(f"❌ 服务启动失败（{backend}）")
+                    continue
+                for mode in MODES:
+                    run_mode(base_url, questions[:10], mode, args.max_results)  # 预热
+                    latencies, stages = run_mode(base_url, questions, mode, args.max_results)
+                    stage_values = "".join(f"{percentile(stages[stage], 50):>13.2f}" if stage in stages
+                                           else f"{'-':>13}" for stage in STAGES)
+                    print(f"{backend:<8}{mode:<10}{percentile(latencies, 50) * 1000:>10.1f}"
+                          f"{percentile(latencies, 99) * 1000:>10.1f}{stage_values}"
+                          f"{percentile(stages.get('total_ms', []), 50):>14.2f}")
+            finally:
+                process.terminate()
+                process.wait()
+    finally:
+        server.stop()
+    print("=" * 104)
+    print("各阶段为服务端耗时的 p50（毫秒）；混合检索的向量和关键词两路各取候选后按倒数排名融合")
+
+
+if __name__ == "__main__":
+    main()
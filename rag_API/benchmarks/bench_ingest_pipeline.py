@@ -0,0 +1,103 @@
+"""
+入库流水线性能对比
+用模拟的embedding延迟和写入延迟，对比旧的分阶段串行构建（全部加载 → 全部分割 → 逐批嵌入写入）
+与分阶段流水线（解析、嵌入、写入同时进行）的总耗时和峰值内存，并打印流水线各阶段的统计
+
+用法（在 rag_API 目录下运行）:
+    python benchmarks/bench_ingest_pipeline.py [--embed-ms 40] [--write-ms-per-1k 30]
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "core"))
+
+from wechat_loader import WeChatCSVLoader
+from incremental_index import iter_documents_with_ids
+from vector_writer import BulkVectorWriter, embed_and_write
+from ingest_pipeline import print_pipeline_report, run_ingest_pipeline
+
+
+class SimulatedEmbeddings:
+    """每批固定延迟的embedding（模拟网络请求，等待期间释放GIL）"""
+
+    def __init__(self, latency_ms, dim=64):
+        self.latency = latency_ms / 1000
+        self.dim = dim
+
+    def embed_documents(self, texts):
+        time.sleep(self.latency)
+        return [[0.0] * self.dim for _ in texts]
+
+
+class SimulatedCollection:
+    """按写入条数计算延迟的集合（模拟磁盘写入）"""
+
+    def __init__(self, ms_per_1k):
+        self.seconds_per_row = ms_per_1k / 1000 / 1000
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        time.sleep(len(ids) * self.seconds_per_row)
+
+
+def run_phased(loader, embeddings, collection, batch_size):
+    """旧方式：先加载全部文档，再生成ID，最后逐批嵌入写入"""
+    docs = loader.load()
+    id_documents = list(iter_documents_with_ids(docs))
+    return embed_and_write(id_documents, embeddings, BulkVectorWriter(collection), batch_size=batch_size)
+
+
+def run_pipelined(loader, embeddings, collection, batch_size):
+    return run_ingest_pipeline(loader.lazy_rows(), embeddings, BulkVectorWriter(collection),
+                               batch_size=batch_size, progress_every=0)
+
+
+def measure(func, *args):
+    """返回 (结果, 耗时秒, 峰值内存MB)"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="入库流水线性能对比")
+    parser.add_argument("--csv", default="csv")
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--embed-ms", type=float, default=40, help="每批embedding的模拟延迟")
+    parser.add_argument("--write-ms-per-1k", type=float, default=30, help="每写入1000条的模拟延迟")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.csv):
+        print(f"❌ 未找到csv文件夹: {args.csv}")
+        return
+
+    loader = WeChatCSVLoader(args.csv, verbose=False)
+    embeddings = SimulatedEmbeddings(args.embed_ms)
+    collection = SimulatedCollection(args.write_ms_per_1k)
+
+    print("🏭 入库流水线对比")
+    print(f"模拟延迟: embedding {args.embed_ms:.0f} ms/批，写入 {args.write_ms_per_1k:.0f} ms/千条，"
+          f"批次大小 {args.batch_size}")
+    print("=" * 60)
+
+    phased, phased_time, phased_peak = measure(run_phased, loader, embeddings, collection, args.batch_size)
+    piped, piped_time, piped_peak = measure(run_pipelined, loader, embeddings, collection, args.batch_size)
+
+    print(f"{'方式':<16}{'写入条数':>10}{'耗时(秒)':>12}{'峰值内存(MB)':>16}")
+    print(f"{'分阶段串行':<16}{phased['written']:>10}{phased_time:>12.2f}{phased_peak:>16.1f}")
+    print(f"{'流水线':<16}{piped['written']:>10}{piped_time:>12.2f}{piped_peak:>16.1f}")
+    print("-" * 60)
+    print(f"⚡ 加速比: {phased_time / piped_time:.2f}x，峰值内存降低 {1 - piped_peak / phased_peak:.0%}")
+    print_pipeline_report(piped)
+
+
+if __name__ == "__main__":
+    main()
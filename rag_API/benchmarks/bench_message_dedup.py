@@ -0,0 +1,40 @@
+"""
+消息正文去重统计
+统计导出数据中重复正文的比例，即构建时按正文去重可以节省的embedding调用次数
+
+用法（在 rag_API 目录下运行）:
+    python benchmarks/bench_message_dedup.py [csv目录]
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "core"))
+
+from wechat_loader import WeChatCSVLoader
+from message_dedup import dedup_report
+
+
+def main():
+    csv_folder = sys.argv[1] if len(sys.argv) > 1 else "csv"
+    if not os.path.exists(csv_folder):
+        print(f"❌ 未找到csv文件夹: {csv_folder}")
+        return
+
+    loader = WeChatCSVLoader(csv_folder, verbose=False)
+    total, distinct, top = dedup_report(loader.lazy_records())
+
+    print("♻️ 消息正文去重统计")
+    print("=" * 60)
+    print(f"有效聊天记录: {total:,} 条")
+    print(f"不同正文:     {distinct:,} 条")
+    print(f"节省embedding: {total - distinct:,} 次 ({(total - distinct) / max(total, 1):.1%})")
+    print("-" * 60)
+    print("出现最多的正文:")
+    for body, count in top:
+        preview = body if len(body) <= 30 else body[:30] + "..."
+        print(f"  {count:>5} 次  {preview}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+NumPy精确检索与Chroma HNSW检索的对比
+直接在已构建的数据库上检索（不经过API、不调用embedding）：问题向量取自库中随机抽取的向量加少量高斯噪声，
+分别统计单个问题和成批问题的检索延迟，并以NumPy的精确结果为准计算Chroma的召回率（recall@k）。
+
+用法（在 rag_API 目录下运行）:
+    python benchmarks/bench_numpy_search.py --db ./chroma_wechat_db --queries 200
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "core"))
+
+from numpy_index import load_numpy_index
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) * 1000 if values else 0.0
+
+
+def time_each(func, items):
+    latencies = []
+    outputs = []
+    for item in items:
+        start = time.perf_counter()
+        outputs.append(func(item))
+        latencies.append(time.perf_counter() - start)
+    return latencies, outputs
+
+
+def sample_queries(store, count, noise, seed):
+    """库中随机向量加噪声：最近邻通常是原向量，但仍需在全库中比较"""
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(store.count(), size=min(count, store.count()), replace=False)
+    vectors = np.asarray(store.vectors[rows], dtype=np.float32)
+    scale = noise * float(np.mean(np.linalg.norm(vectors, axis=1))) / np.sqrt(vectors.shape[1])
+    return vectors + rng.normal(0, scale, vectors.shape).astype(np.float32)
+
+
+def recall(found, exact, tolerance=1e-4):
+    """found、exact 为每个问题的 [(ID, 距离)]
+
+    内容相同的消息向量完全相同，距离并列的记录返回哪一条都是正确的：
+    距离不超过精确结果第k个距离的记录都算命中，而不是按ID比较。
+    """
+    ratios = []
+    for found_hits, exact_hits in zip(found, exact):
+        if not exact_hits:
+            continue
+        threshold = exact_hits[-1][1] + tolerance * max(1.0, abs(exact_hits[-1][1]))
+        ratios.append(min(sum(1 for _, distance in found_hits if distance <= threshold), len(exact_hits))
+                      / len(exact_hits))
+    return float(np.mean(ratios))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NumPy精确检索与Chroma HNSW检索的对比")
+    parser.add_argument("--db", default="./chroma_wechat_db")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, nargs="+", default=[5, 10])
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--noise", type=float, default=0.1, help="噪声相对向量长度的比例")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    from langchain_chroma import Chroma
+
+    start = time.perf_counter()
+    store = load_numpy_index(args.db)
+    load_seconds = time.perf_counter() - start
+    chroma = Chroma(persist_directory=args.db)
+    queries = sample_queries(store, args.queries, args.noise, args.seed)
+    print(f"🧪 {store.count():,} 条向量（{store.vectors.shape[1]} 维，{store.space}），"
+          f"矩阵 {store.vectors.nbytes / 1024 / 1024:.1f} MB，NumPy索引加载 {load_seconds:.2f} 秒；"
+          f"{len(queries)} 个问题")
+
+    # 预热：两边各检索一次，文件进入页缓存
+    chroma.similarity_search_by_vector_with_relevance_scores(queries[0].tolist(), k=max(args.k))
+    store.similarity_search_by_vector_with_relevance_scores(queries[0], k=max(args.k))
+
+    print("=" * 78)
+    print(f"{'检索方式':<26}{'k':>4}{'p50(ms)':>10}{'p99(ms)':>10}{'每问题(ms)':>12}{'recall@k':>11}")
+    for k in args.k:
+        exact_latencies, exact = time_each(
+            lambda q: store.similarity_search_by_vector_with_relevance_scores(q, k=k), queries)
+        chroma_latencies, approximate = time_each(
+            lambda q: chroma.similarity_search_by_vector_with_relevance_scores(q.tolist(), k=k), queries)
+        exact_hits = [[(doc.id, distance) for doc, distance in results] for results in exact]
+        chroma_hits = [[(doc.id, distance) for doc, distance in results] for results in approximate]
+
+        batches = [queries[i:i + args.batch_size] for i in range(0, len(queries), args.batch_size)]
+        numpy_batch_latencies, _ = time_each(
+            lambda batch: store.similarity_search_by_vectors_with_scores(batch, k=k), batches)
+        chroma_batch_latencies, _ = time_each(
+            lambda batch: chroma._collection.query(query_embeddings=batch.tolist(), n_results=k,
+                                                   include=["documents", "metadatas", "distances"]), batches)
+
+        rows = [
+            ("Chroma HNSW 单个问题", chroma_latencies, recall(chroma_hits, exact_hits)),
+            ("NumPy 精确 单个问题", exact_latencies, 1.0),
+            (f"Chroma HNSW 每批{args.batch_size}个", chroma_batch_latencies, None),
+            (f"NumPy 精确 每批{args.batch_size}个", numpy_batch_latencies, None),
+        ]
+        for name, latencies, row_recall in rows:
+            per_query = sum(latencies) / len(queries) * 1000
+            recall_text = f"{row_recall:>11.3f}" if row_recall is not None else f"{'':>11}"
+            print(f"{name:<26}{k:>4}{percentile(latencies, 50):>10.2f}{percentile(latencies, 99):>10.2f}"
+                  f"{per_query:>12.3f}{recall_text}")
+        print("-" * 78)
+        print(f"⚡ k={k}: 单个问题p50 {percentile(chroma_latencies, 50):.2f} → {percentile(exact_latencies, 50):.2f} ms，"
+              f"每批 {sum(chroma_batch_latencies) / len(queries) * 1000:.3f} → "
+              f"{sum(numpy_batch_latencies) / len(queries) * 1000:.3f} ms/问题，"
+              f"Chroma recall@{k} {recall(chroma_hits, exact_hits):.3f}")
+        print("=" * 78)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+NumPy索引量化模式的内存与召回率报告
+分别以 float32（精确）、float16、int8 模式打开NumPy索引，用与 bench_numpy_search.py 相同的问题向量检索：
+- 内存：常驻的向量数据大小，以及检索后各个映射文件实际常驻的页（/proc/self/smaps）；
+  量化模式下 float32 文件只有被重排读到的候选行常驻
+- 召回率：与 float32 精确结果对比的 recall@k，按不同的重排候选倍数（rescore_factor）统计
+- 延迟：单个问题的 p50 和每批问题的平均耗时
+
+每种模式在独立的子进程中运行，映射文件的常驻页互不影响（Linux）。
+
+用法（在 rag_API 目录下运行）:
+    python benchmarks/bench_quantization.py --db ./chroma_wechat_db --queries 200
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "core"))
+
+from bench_numpy_search import percentile, recall, sample_queries, time_each
+from numpy_index import NUMPY_INDEX_DIR, NumpyVectorStore, load_numpy_index
+
+MODES = ["float32", "float16", "int8"]
+
+
+def resident_files_mb(directory):
+    """读取 /proc/self/smaps，返回 directory 下各映射文件常驻的页 {文件名: MB}，非Linux系统返回None"""
+    directory = os.path.realpath(directory)
+    resident = {}
+    current = None
+    try:
+        with open("/proc/self/smaps", "r") as f:
+            for line in f:
+                fields = line.split()
+                if "-" in fields[0] and len(fields) >= 5:
+                    path = fields[5] if len(fields) > 5 else ""
+                    current = os.path.basename(path) if path.startswith(directory + os.sep) else None
+                elif current and fields[0] == "Rss:":
+                    resident[current] = resident.get(current, 0) + int(fields[1]) / 1024
+    except OSError:
+        return None
+    return resident
+
+
+def run_mode(args, mode):
+    """子进程：打开一种模式的索引并检索，输出JSON结果"""
+    quantize = None if mode == "float32" else mode
+    # 问题向量单独读取，释放映射后再统计检索模式的常驻页
+    probe = NumpyVectorStore(args.db)
+    queries = sample_queries(probe, args.queries, args.noise, args.seed)
+    del probe
+
+    factors = args.rescore_factors if quantize else [1]
+    result = {"mode": mode, "runs": []}
+    found = {}
+    for factor in factors:
+        store = NumpyVectorStore(args.db, quantize=quantize, rescore_factor=factor)
+        result["memory_bytes"] = store.memory_bytes()
+        store.search_batch(queries[:1], k=max(args.k))  # 预热
+        for k in args.k:
+            latencies, hits = time_each(lambda q: store.search_batch(q[None, :], k=k)[0], queries)
+            batches = [queries[i:i + args.batch_size] for i in range(0, len(queries), args.batch_size)]
+            batch_latencies, _ = time_each(lambda batch: store.search_batch(batch, k=k), batches)
+            found[(factor, k)] = hits
+            result["runs"].append({"factor": factor, "k": k, "p50_ms": percentile(latencies, 50),
+                                   "batch_ms_per_query": sum(batch_latencies) / len(queries) * 1000})
+        # 每种重排倍数使用新的映射，只统计这一轮检索读到的页
+        resident = resident_files_mb(os.path.join(args.db, NUMPY_INDEX_DIR))
+        for run in result["runs"][-len(args.k):]:
+            run["resident_mb"] = sum(resident.values()) if resident is not None else None
+        del store
+
+    # 常驻页统计完成后再计算精确结果
+    exact_store = NumpyVectorStore(args.db)
+    for run in result["runs"]:
+        exact = exact_store.search_batch(queries, k=run["k"])
+        run["recall"] = recall(found[(run["factor"], run["k"])], exact)
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NumPy索引量化模式的内存与召回率报告")
+    parser.add_argument("--db", default="./chroma_wechat_db")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, nargs="+", default=[5, 10])
+    parser.add_argument("--rescore-factors", type=int, nargs="+", default=[1, 2, 4, 10],
+                        help="重排候选数为 k 的多少倍（1 表示只按量化距离排序）")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--noise", type=float, default=0.1, help="噪声相对向量长度的比例")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--worker", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_mode(args, args.worker)
+        return
+
+    store = load_numpy_index(args.db)  # 没有导出或已过期时先导出
+    print(f"🧪 {store.count():,} 条向量（{store.vectors.shape[1]} 维，{store.space}），{args.queries} 个问题")
+    del store
+
+    results = []
+    for mode in MODES:
+        command = [sys.executable, os.path.abspath(__file__), "--worker", mode, "--db", args.db,
+                   "--queries", str(args.queries), "--batch-size", str(args.batch_size),
+                   "--noise", str(args.noise), "--seed", str(args.seed),
+                   "--k", *map(str, args.k), "--rescore-factors", *map(str, args.rescore_factors)]
+        output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print("=" * 78)
+    print(f"{'模式':<10}{'向量数据(MB)':>14}{'映射常驻(MB)':>14}{'重排倍数':>10}{'k':>4}"
+          f"{'p50(ms)':>10}{'每批(ms/问题)':>15}{'recall@k':>11}")
+    for result in results:
+        for run in result["runs"]:
+            resident = f"{run['resident_mb']:>14.1f}" if run["resident_mb"] is not None else f"{'-':>14}"
+            factor = run["factor"] if result["mode"] != "float32" else "-"
+            print(f"{result['mode']:<10}{result['memory_bytes'] / 1024 / 1024:>14.1f}{resident}{factor:>10}"
+                  f"{run['k']:>4}{run['p50_ms']:>10.2f}{run['batch_ms_per_query']:>15.3f}{run['recall']:>11.3f}")
+    print("=" * 78)
+
+    baseline = results[0]["memory_bytes"]
+    for result in results[1:]:
+        best = {run["k"]: run for run in result["runs"] if run["factor"] == max(args.rescore_factors)}
+        summary = "，".join(f"recall@{k} {run['recall']:.3f}" for k, run in best.items())
+        print(f"⚡ {result['mode']}: 向量数据 {baseline / 1024 / 1024:.1f} → {result['memory_bytes'] / 1024 / 1024:.1f} MB"
+              f"（节省 {(1 - result['memory_bytes'] / baseline) * 100:.0f}%），"
+              f"重排 {max(args.rescore_factors)} 倍候选时 {summary}")
+
+
+if __name__ == "__main__":
+    main()
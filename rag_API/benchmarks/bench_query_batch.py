@@ -0,0 +1,120 @@
+"""
+/query_batch 与逐个 /query 的吞吐量对比
+模拟对话服务每轮对话检索多个子问题：一种方式是依次调用N次 /query（每次新建HTTP连接），
+另一种是一次 /query_batch。启动本地模拟embedding服务，关闭缓存后分别压测，
+统计每秒完成的对话轮数、每轮延迟和embedding调用次数。
+
+用法（在 rag_API 目录下运行）:
+    python benchmarks/bench_query_batch.py --db ./chroma_wechat_db --questions-per-turn 5
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_api_load import load_questions, post_json, start_service, summarize, wait_ready
+from fake_embedding_server import FakeEmbeddingServer
+
+
+def sequential_turn(base_url, questions):
+    for question in questions:
+        post_json(base_url + "/query", {"question": question, "max_results": 5})
+
+
+def batch_turn(base_url, questions):
+    payload = {"questions": [{"question": question, "max_results": 5} for question in questions]}
+    status, _, body = post_json(base_url + "/query_batch", payload)
+    if len(body["results"]) != len(questions):
+        raise RuntimeError(f"返回 {len(body['results'])} 个结果，期望 {len(questions)} 个")
+
+
+def run_turns(base_url, turn, questions, per_turn, concurrency, total_turns):
+    """concurrency 个会话并发，每个会话连续执行对话轮次，返回按"轮"统计的结果"""
+    latencies = []
+    errors = []
+    counter = iter(range(total_turns))
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            start_index = index * per_turn
+            sub_questions = [questions[(start_index + i) % len(questions)] for i in range(per_turn)]
+            start = time.perf_counter()
+            try:
+                turn(base_url, sub_questions)
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/query_batch 与逐个 /query 的吞吐量对比")
+    parser.add_argument("--csv", default="csv")
+    parser.add_argument("--db", default="./chroma_wechat_db")
+    parser.add_argument("--questions-per-turn", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=8, help="并发的对话会话数")
+    parser.add_argument("--turns", type=int, default=100)
+    parser.add_argument("--embed-latency-ms", type=float, default=80)
+    parser.add_argument("--dim", type=int, default=1024, help="模拟embedding维度，需与数据库一致")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    questions = load_questions(args.csv)
+    server = FakeEmbeddingServer(dim=args.dim, latency_ms=args.embed_latency_ms, jitter_ms=0).start()
+    process = start_service(args.port, args.db, server.base_url,
+                            extra_env={"RAG_EMBED_CACHE_SIZE": "0", "RAG_RESULT_CACHE_MB": "0"})
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        if not wait_ready(base_url):
+            print("❌ 服务启动失败")
+            return
+        print(f"🧪 每轮 {args.questions_per_turn} 个子问题，{args.concurrency} 个并发会话，每组 {args.turns} 轮，"
+              f"模拟embedding延迟 {args.embed_latency_ms:.0f} ms")
+        print("=" * 78)
+        print(f"{'方式':<18}{'成功轮数':>8}{'失败':>6}{'轮/秒':>9}{'问题/秒':>10}"
+              f"{'p50(ms)':>10}{'p99(ms)':>10}{'embedding调用':>14}")
+        results = {}
+        for name, turn in [(f"{args.questions_per_turn}次 /query", sequential_turn), ("1次 /query_batch", batch_turn)]:
+            run_turns(base_url, turn, questions, args.questions_per_turn, args.concurrency, 10)  # 预热
+            calls_before = server.requests
+            result = run_turns(base_url, turn, questions, args.questions_per_turn, args.concurrency, args.turns)
+            result["embed_calls"] = server.requests - calls_before
+            results[name] = result
+            print(f"{name:<18}{result['requests']:>8}{result['errors']:>6}{result['qps']:>9.1f}"
+                  f"{result['qps'] * args.questions_per_turn:>10.1f}{result['p50'] * 1000:>10.0f}"
+                  f"{result['p99'] * 1000:>10.0f}{result['embed_calls']:>14}")
+            if result["first_error"]:
+                print(f"  ⚠️ 错误示例: {result['first_error']}")
+    finally:
+        process.terminate()
+        process.wait()
+        server.stop()
+
+    sequential, batch = results.values() if len(results) == 2 else (None, None)
+    if sequential and batch and sequential["qps"]:
+        print("-" * 78)
+        print(f"⚡ /query_batch 吞吐量 {batch['qps'] / sequential['qps']:.1f}x，"
+              f"每轮p50 {sequential['p50'] * 1000:.0f} → {batch['p50'] * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+问题向量微批处理对比
+启动本地模拟embedding服务，分别在关闭和开启微批处理（RAG_EMBED_BATCH_MS）时压测 /query，
+对比 p50/p99 延迟、QPS 以及每秒实际发出的embedding请求数。
+为了让每个请求都真正调用embedding，测试时关闭问题向量缓存和结果缓存。
+
+用法（在 rag_API 目录下运行）:
+    python benchmarks/bench_query_batching.py --db ./chroma_wechat_db --window-ms 5 --concurrency 32
+"""
+
+import argparse
+import os
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_api_load import load_questions, run_load, start_service, wait_ready
+from fake_embedding_server import FakeEmbeddingServer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="问题向量微批处理对比")
+    parser.add_argument("--csv", default="csv")
+    parser.add_argument("--db", default="./chroma_wechat_db")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--embed-latency-ms", type=float, default=80)
+    parser.add_argument("--dim", type=int, default=1024, help="模拟embedding维度，需与数据库一致")
+    parser.add_argument("--window-ms", type=float, default=5)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    questions = load_questions(args.csv)
+    server = FakeEmbeddingServer(dim=args.dim, latency_ms=args.embed_latency_ms, jitter_ms=0).start()
+    no_cache = {"RAG_EMBED_CACHE_SIZE": "0", "RAG_RESULT_CACHE_MB": "0"}
+    configs = [
+        ("微批处理关闭", {**no_cache, "RAG_EMBED_BATCH_MS": "0"}),
+        (f"微批处理 {args.window_ms:g}ms", {**no_cache, "RAG_EMBED_BATCH_MS": str(args.window_ms),
+                                             "RAG_EMBED_BATCH_SIZE": str(args.batch_size)}),
+    ]
+
+    print(f"🧪 模拟embedding延迟 {args.embed_latency_ms:.0f} ms，并发 {args.concurrency}，每组 {args.requests} 次请求")
+    print("=" * 78)
+    print(f"{'配置':<18}{'成功':>6}{'失败':>6}{'QPS':>9}{'p50(ms)':>10}{'p99(ms)':>10}"
+          f"{'embedding调用/秒':>16}{'条/调用':>8}")
+    results = {}
+    for name, env in configs:
+        process = start_service(args.port, args.db, server.base_url, extra_env=env)
+        try:
+            base_url = f"http://127.0.0.1:{args.port}"
+            if not wait_ready(base_url):
+                print(f"{name:<18}服务启动失败")
+                continue
+            run_load(base_url, questions, args.concurrency, min(50, args.requests))  # 预热
+            calls_before = server.requests
+            result = run_load(base_url, questions, args.concurrency, args.requests)
+            calls = server.requests - calls_before
+            result["calls_per_second"] = calls / result["wall"] if result["wall"] else 0.0
+            result["texts_per_call"] = result["requests"] / calls if calls else 0.0
+            results[name] = result
+            print(f"{name:<18}{result['requests']:>6}{result['errors']:>6}{result['qps']:>9.1f}"
+                  f"{result['p50'] * 1000:>10.0f}{result['p99'] * 1000:>10.0f}"
+                  f"{result['calls_per_second']:>16.1f}{result['texts_per_call']:>8.1f}")
+            if result["first_error"]:
+                print(f"  ⚠️ 错误示例: {result['first_error']}")
+        finally:
+            process.terminate()
+            process.wait()
+    server.stop()
+
+    off, on = (results.get(name) for name, _ in configs)
+    if off and on and on["calls_per_second"]:
+        print("-" * 78)
+        print(f"⚡ 每个请求的embedding调用从 {off['calls_per_second'] / off['qps']:.2f} 次减少到 "
+              f"{on['calls_per_second'] / on['qps']:.2f} 次，"
+              f"QPS {on['qps'] / off['qps']:.2f}x，p50 {on['p50'] * 1000:.0f} ms（关闭时 {off['p50'] * 1000:.0f} ms）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+入口脚本冷启动耗时
+在独立的子进程中导入各入口模块（不执行 main），用 python -X importtime 统计入口模块直接导入的依赖中耗时最多的几个，
+检查启动时是否又引入了重量级依赖或网络请求。每个模块重复多次取中位数。
+
+用法（在 rag_API 目录下运行）:
+    python benchmarks/bench_startup.py --repeat 5
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+
+# (显示名称, 所在目录, 模块名)
+ENTRY_MODULES = [
+    ("core/test_csv_final.py", "core", "test_csv_final"),
+    ("core/test_csv_small.py", "core", "test_csv_small"),
+    ("core/rebuild_full_database.py", "core", "rebuild_full_database"),
+    ("api/api_service.py", "api", "api_service"),
+    ("legacy/test.py", "legacy", "test"),
+    ("legacy/test_csv.py", "legacy", "test_csv"),
+    ("legacy/test_csv_optimized.py", "legacy", "test_csv_optimized"),
+]
+
+
+def import_once(directory, module):
+    """在子进程中导入模块，返回 (耗时秒, 是否成功, -X importtime 输出)"""
+    code = (f"import sys; sys.path[:0] = [{os.path.join(ROOT_DIR, directory)!r}, "
+            f"{os.path.join(ROOT_DIR, 'core')!r}]; import {module}")
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                             cwd=ROOT_DIR, capture_output=True, text=True)
+    return time.perf_counter() - start, process.returncode == 0, process.stderr
+
+
+def top_imports(importtime_output, module, limit):
+    """解析 -X importtime 输出，返回入口模块直接导入的依赖中累计耗时最多的 [(模块名, 毫秒)]
+
+    输出按导入完成的顺序排列，子模块在父模块之前，名称前每深一层多缩进两个空格。
+    """
+    children = []
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 0:
+            if name.strip() == module:
+                return sorted(children, key=lambda item: -item[1])[:limit]
+            children = []
+        elif depth == 1:
+            children.append((name.strip(), int(fields[1]) / 1000))
+    return []
+
+
+def last_error(importtime_output):
+    lines = [line for line in importtime_output.splitlines() if not line.startswith("import time:")]
+    return lines[-1] if lines else ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="入口脚本冷启动耗时")
+    parser.add_argument("--repeat", type=int, default=3, help="每个模块导入的次数，取中位数")
+    parser.add_argument("--top", type=int, default=5, help="显示累计耗时最多的直接依赖数量")
+    args = parser.parse_args()
+
+    print(f"🧪 每个入口模块在子进程中导入 {args.repeat} 次（不执行 main）")
+    print("=" * 78)
+    for name, directory, module in ENTRY_MODULES:
+        seconds = []
+        ok = True
+        output = ""
+        for _ in range(args.repeat):
+            elapsed, ok, output = import_once(directory, module)
+            seconds.append(elapsed)
+        status = "✅" if ok else "❌"
+        print(f"{status} {name:<34}{statistics.median(seconds) * 1000:>8.0f} ms")
+        if not ok:
+            print(f"    ⚠️ 导入失败: {last_error(output)}")
+        for dependency, ms in top_imports(output, module, args.top):
+            print(f"    {dependency:<40}{ms:>8.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+本地模拟embedding服务
+兼容 DashScope 文本向量接口（/api/v1/services/embeddings/text-embedding/text-embedding），
+可注入延迟和限流（HTTP 429），用于在不产生费用的情况下测试构建脚本的调度与重试逻辑
+
+独立运行:
+    python benchmarks/fake_embedding_server.py --port 8765 --latency-ms 80 --qps-limit 20
+
+让 DashScopeEmbeddings 指向本服务:
+    import dashscope
+    dashscope.base_http_api_url = "http://127.0.0.1:8765/api/v1"
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import struct
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib import request as urllib_request
+from urllib.error import HTTPError
+
+EMBEDDING_PATH = "/api/v1/services/embeddings/text-embedding/text-embedding"
+
+
+def fake_vector(text, dim):
+    """由文本哈希生成确定性的伪向量"""
+    values = []
+    seed = hashlib.sha256(text.encode("utf-8")).digest()
+    while len(values) < dim:
+        seed = hashlib.sha256(seed).digest()
+        values.extend(v / 2 ** 31 for v in struct.unpack("<8i", seed))
+    return values[:dim]
+
+
+class FakeEmbeddingServer:
+    """模拟embedding服务
+
+    - latency_ms / jitter_ms: 每次请求的处理延迟
+    - qps_limit: 最近1秒内的请求数超过该值时返回429
+    - error_rate: 随机返回429的概率
+    - max_batch: 单次请求最多的文本数，超过返回400
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, dim=1024, latency_ms=50, jitter_ms=20,
+                 qps_limit=None, error_rate=0.0, max_batch=10):
+        self.dim = dim
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.qps_limit = qps_limit
+        self.error_rate = error_rate
+        self.max_batch = max_batch
+
+        self.requests = 0
+        self.throttled = 0
+        self._recent = deque()
+        self._lock = threading.Lock()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                server.handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.host, self.port = self.httpd.server_address[:2]
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/api/v1"
+
+    def _should_throttle(self):
+        now = time.monotonic()
+        with self._lock:
+            self.requests += 1
+            while self._recent and now - self._recent[0] > 1.0:
+                self._recent.popleft()
+            over_limit = self.qps_limit is not None and len(self._recent) >= self.qps_limit
+            if not over_limit:
+                self._recent.append(now)
+            throttled = over_limit or random.random() < self.error_rate
+            if throttled:
+                self.throttled += 1
+            return throttled
+
+    def handle(self, handler):
+        if handler.path.rstrip("/") != EMBEDDING_PATH:
+            self._reply(handler, 404, {"code": "NotFound", "message": handler.path})
+            return
+
+        length = int(handler.headers.get("Content-Length", 0))
+        body = json.loads(handler.rfile.read(length) or b"{}")
+        texts = body.get("input", {}).get("texts", [])
+
+        if self._should_throttle():
+            self._reply(handler, 429, {"code": "Throttling.RateQuota",
+                                       "message": "Requests rate limit exceeded, please try again later."})
+            return
+        if len(texts) > self.max_batch:
+            self._reply(handler, 400, {"code": "InvalidParameter",
+                                       "message": f"batch size is invalid, it should not be larger than {self.max_batch}."})
+            return
+
+        time.sleep(max(0.0, self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000)
+        self._reply(handler, 200, {
+            "output": {"embeddings": [
+                {"text_index": i, "embedding": fake_vector(text, self.dim)} for i, text in enumerate(texts)
+            ]},
+            "usage": {"total_tokens": sum(len(text) for text in texts)},
+            "request_id": hashlib.md5(str(time.time()).encode()).hexdigest(),
+        })
+
+    @staticmethod
+    def _reply(handler, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class FakeServerError(Exception):
+    """模拟服务返回的错误，消息格式与 DashScopeEmbeddings 抛出的 HTTPError 一致"""
+
+    def __init__(self, status_code, code, message):
+        super().__init__(f"HTTP error occurred: status_code: {status_code} \n "
+                         f"code: {code} \n message: {message}")
+        self.status_code = status_code
+
+
+class FakeServerEmbeddings:
+    """只依赖标准库的客户端，协议与 DashScope 文本向量接口相同"""
+
+    def __init__(self, base_url, model="text-embedding-v3", timeout=30):
+        self.url = base_url.rstrip("/") + EMBEDDING_PATH[len("/api/v1"):]
+        self.model = model
+        self.timeout = timeout
+
+    def _post(self, texts, text_type):
+        payload = json.dumps({"model": self.model, "input": {"texts": texts},
+                              "parameters": {"text_type": text_type}}).encode("utf-8")
+        req = urllib_request.Request(self.url, data=payload, headers={"Content-Type": "application/json"})
+        try:
+            with urllib_request.urlopen(req, timeout=self.timeout) as resp:
+                data = json.loads(resp.read())
+        except HTTPError as e:
+            error = json.loads(e.read() or b"{}")
+            raise FakeServerError(e.code, error.get("code"), error.get("message")) from None
+        embeddings = sorted(data["output"]["embeddings"], key=lambda item: item["text_index"])
+        return [item["embedding"] for item in embeddings]
+
+    def embed_documents(self, texts):
+        return self._post(list(texts), "document")
+
+    def embed_query(self, text):
+        return self._post([text], "query")[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟embedding服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--qps-limit", type=int, default=None)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--max-batch", type=int, default=10)
+    args = parser.parse_args()
+
+    server = FakeEmbeddingServer(args.host, args.port, dim=args.dim, latency_ms=args.latency_ms,
+                                 jitter_ms=args.jitter_ms, qps_limit=args.qps_limit,
+                                 error_rate=args.error_rate, max_batch=args.max_batch)
+    print(f"🧪 模拟embedding服务已启动: {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n共处理 {server.requests} 次请求，其中限流 {server.throttled} 次")
+
+
+if __name__ == "__main__":
+    main()
@@ -82,6 +82,26 @@ def test_api():
 
         time.sleep(0.5)  # 避免请求过快
 
+    # 5. 对比检索方式：人名、专有名词用关键词或混合检索更准
+    print("\n5️⃣ 对比检索方式...")
+    for question in ["雷蕾", "张宏哲", "毕业晚会"]:
+        for search_mode in ["vector", "lexical", "hybrid"]:
+            try:
+                response = requests.post(
+                    f"{API_BASE_URL}/query_simple",
+                    params={"question": question, "max_results": 3, "mode": search_mode}
+                )
+                data = response.json()
+                if "error" in data:
+                    print(f"🔍 {question} [{search_mode}] 查询失败: {data['error']}")
+                    continue
+                timings = ", ".join(f"{stage} {ms:.1f}ms" for stage, ms in data.get('timings', {}).items())
+                print(f"🔍 {question} [{search_mode}] 找到 {data.get('count', 0)} 条 ({timings})")
+                for record in data.get('records', []):
+                    print(f"  {record.get('sender', '未知')}: {record.get('content', '')[:60]}...")
+            except Exception as e:
+                print(f"❌ 查询失败: {e}")
+
 def interactive_test():
     """交互式测试"""
     print("\n🎮 进入交互式测试模式...")
@@ -0,0 +1,146 @@
+"""
+按token数自适应的embedding批次大小
+批次不再固定条数，而是按估计的token总数和条数上限切分：几百条"好的"可以放进一批，
+几篇粘贴的长文章单独成批。每批完成后根据实际延迟和错误情况调整目标token数，
+选用的批次大小记录在构建报告中
+"""
+
+import statistics
+import threading
+
+from embedding_scheduler import estimate_tokens
+from message_dedup import embedding_text
+
+
+def document_tokens(doc):
+    """文档实际用于嵌入的文本的估计token数"""
+    return estimate_tokens(embedding_text(doc.page_content))
+
+
+class AdaptiveBatchSizer:
+    """根据观察到的延迟和错误率调整每批的目标token数
+
+    - target_tokens: 初始目标token数
+    - min_tokens / max_tokens: 目标token数的调整范围
+    - max_items: 每批最多的条数（受写入缓冲和服务端单批限制）
+    - target_latency: 单批embedding期望耗时（秒），超过时按比例缩小批次，明显低于时逐步放大
+    - 某批出错时目标减半；近期错误率较高时不再放大
+    """
+
+    def __init__(self, target_tokens=4000, min_tokens=200, max_tokens=40000, max_items=500,
+                 target_latency=5.0, growth=1.25, error_threshold=0.1):
+        self.target_tokens = target_tokens
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+        self.max_items = max_items
+        self.target_latency = target_latency
+        self.growth = growth
+        self.error_threshold = error_threshold
+
+        self.error_rate = 0.0  # 指数移动平均
+        self.grows = 0
+        self.shrinks = 0
+        self.history = []      # [(条数, token数, 耗时秒, 是否成功)]
+        self._lock = threading.Lock()
+
+    def _set_target(self, target):
+        target = int(min(self.max_tokens, max(self.min_tokens, target)))
+        if target > self.target_tokens:
+            self.grows += 1
+        elif target < self.target_tokens:
+            self.shrinks += 1
+        self.target_tokens = target
+
+    def observe(self, items, tokens, seconds):
+        """一批embedding成功"""
+        with self._lock:
+            self.history.append((items, tokens, seconds, True))
+            self.error_rate *= 0.8
+            if seconds > self.target_latency:
+                self._set_target(self.target_tokens * self.target_latency / seconds)
+            elif seconds < self.target_latency / 2 and self.error_rate < self.error_threshold \
+                    and tokens >= self.target_tokens * 0.8:
+                # 只有批次确实接近目标大小时才放大，数据尾部的小批次不算
+                self._set_target(self.target_tokens * self.growth)
+
+    def observe_failure(self, items, tokens):
+        """一次embedding请求失败（含之后会重试的失败）"""
+        with self._lock:
+            self.history.append((items, tokens, 0.0, False))
+            self.error_rate = self.error_rate * 0.8 + 0.2
+            self._set_target(self.target_tokens / 2)
+
+    def summary(self):
+        """批次大小分布，写入构建报告"""
+        done = [entry for entry in self.history if entry[3]]
+        if not done:
+            return {"batches": 0, "failures": len(self.history), "target_tokens": self.target_tokens}
+        items = [entry[0] for entry in done]
+        tokens = [entry[1] for entry in done]
+        return {
+            "batches": len(done),
+            "failures": len(self.history) - len(done),
+            "items": (min(items), statistics.median(items), max(items)),
+            "tokens": (min(tokens), statistics.median(tokens), max(tokens)),
+            "target_tokens": self.target_tokens,
+            "grows": self.grows,
+            "shrinks": self.shrinks,
+        }
+
+
+class BatchBuilder:
+    """把 (文档ID, 文档) 逐条攒成批次
+
+    传入 sizer 时按目标token数和条数上限切分，否则按固定条数 batch_size 切分。
+    """
+
+    def __init__(self, sizer=None, batch_size=200):
+        self.sizer = sizer
+        self.batch_size = batch_size
+        self.items = []
+        self.tokens = 0
+
+    def add(self, item):
+        """加入一条，返回因此凑满的批次列表（通常为空或一个）"""
+        ready = []
+        if self.sizer is None:
+            self.items.append(item)
+            if len(self.items) >= self.batch_size:
+                ready.append(self.cut())
+            return ready
+
+        tokens = document_tokens(item[1])
+        if self.items and self.tokens + tokens > self.sizer.target_tokens:
+            ready.append(self.cut())
+        self.items.append(item)
+        self.tokens += tokens
+        if len(self.items) >= self.sizer.max_items or self.tokens >= self.sizer.target_tokens:
+            ready.append(self.cut())
+        return ready
+
+    def cut(self):
+        """取出当前批次（可能为空列表）"""
+        batch, self.items, self.tokens = self.items, [], 0
+        return batch
+
+
+def iter_sized_batches(id_documents, sizer=None, batch_size=200):
+    """按 BatchBuilder 的规则切分 (文档ID, 文档) 流"""
+    builder = BatchBuilder(sizer, batch_size)
+    for item in id_documents:
+        yield from builder.add(item)
+    batch = builder.cut()
+    if batch:
+        yield batch
+
+
+def print_batch_sizes(summary):
+    """打印自适应批次大小的分布"""
+    if not summary or not summary.get("batches"):
+        return
+    items_min, items_median, items_max = summary["items"]
+    tokens_min, tokens_median, tokens_max = summary["tokens"]
+    print(f"📐 自适应批次: {summary['batches']} 批，每批 {items_min}/{items_median:.0f}/{items_max} 条、"
+          f"约 {tokens_min:,}/{tokens_median:,.0f}/{tokens_max:,} tokens（最小/中位/最大），"
+          f"放大 {summary['grows']} 次，缩小 {summary['shrinks']} 次，"
+          f"失败请求 {summary['failures']} 次，最终目标 {summary['target_tokens']:,} tokens/批")
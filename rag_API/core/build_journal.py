@@ -0,0 +1,177 @@
+"""
+构建日志（可断点续建）
+以JSON Lines追加记录每个已提交的批次区间和失败批次及其错误；
+构建中断后可用 --resume 从最后的检查点继续，用 --retry-failed 只重试失败的批次
+
+区间是文档流（去重、分割之后）中的位置 [start, end)。批次大小按token数自适应，
+每次构建的批次边界可能不同，因此续建时按位置而不是按批次号判断哪些文档已经处理过。
+"""
+
+import bisect
+import hashlib
+import json
+import os
+import time
+
+from incremental_index import file_sha256
+
+JOURNAL_NAME = "build_journal.jsonl"
+
+
+def input_fingerprint(loader, extra=""):
+    """输入指纹：CSV文件内容 + 其他影响文档流的参数（如分割参数）。指纹不同时不能续建"""
+    digest = hashlib.sha256(extra.encode("utf-8"))
+    for csv_file in loader.csv_files():
+        key = csv_file.relative_to(loader.csv_folder_path).as_posix()
+        digest.update(f"{key}:{file_sha256(csv_file)}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class RangeSet:
+    """合并后的有序区间集合，用于判断文档位置是否已经处理"""
+
+    def __init__(self, ranges=()):
+        self.starts = []
+        self.ends = []
+        for start, end in sorted(ranges):
+            if self.ends and start <= self.ends[-1]:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    def __contains__(self, position):
+        i = bisect.bisect_right(self.starts, position) - 1
+        return i >= 0 and position < self.ends[i]
+
+    def __len__(self):
+        return sum(end - start for start, end in zip(self.starts, self.ends))
+
+
+class BuildJournal:
+    """构建日志，每个事件一行，写入后立即落盘，进程崩溃也不会丢失已记录的检查点"""
+
+    def __init__(self, path, events):
+        self.path = path
+        self.events = events
+
+    @classmethod
+    def start(cls, path, fingerprint, settings=None):
+        """开始一次新的全量构建，清空旧日志"""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8"):
+            pass
+        journal = cls(path, [])
+        journal._append({"event": "start", "fingerprint": fingerprint, "settings": settings or {}})
+        return journal
+
+    @classmethod
+    def open(cls, path):
+        """读取已有日志，文件不存在时返回None；忽略崩溃时写了一半的最后一行"""
+        if not os.path.exists(path):
+            return None
+        events = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    events.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        if not events or events[0].get("event") != "start":
+            return None
+        return cls(path, events)
+
+    @property
+    def fingerprint(self):
+        return self.events[0]["fingerprint"]
+
+    def _append(self, event):
+        event["time"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(event, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.events.append(event)
+
+    def record_commit(self, start, end):
+        """区间内的文档已写入向量数据库"""
+        self._append({"event": "commit", "start": start, "end": end})
+
+    def record_failure(self, start, end, ids, error):
+        """批次最终失败，按顺序记录每个位置的消息ID和错误，供 --retry-failed 重试"""
+        self._append({"event": "failed", "start": start, "end": end,
+                      "ids": list(ids), "error": str(error)[:500]})
+
+    def on_commit(self, tag):
+        """BulkVectorWriter 的提交回调，tag 为批次区间 (start, end)"""
+        self.record_commit(*tag)
+
+    def on_failure(self, tag, ids, error):
+        """embedding或写入最终失败的回调"""
+        self.record_failure(*tag, ids, error)
+
+    def record_finish(self):
+        self._append({"event": "finish"})
+
+    def committed(self):
+        return RangeSet((event["start"], event["end"]) for event in self.events if event["event"] == "commit")
+
+    def failed_batches(self):
+        """仍有未写入位置的失败事件，返回 [(失败事件, 未写入的位置列表)]（之后重试成功的位置不计入）"""
+        committed = self.committed()
+        failed = {}
+        for event in self.events:
+            if event["event"] != "failed":
+                continue
+            positions = [p for p in range(event["start"], event["end"]) if p not in committed]
+            for p in positions:
+                failed[p] = event  # 同一位置多次失败时以最后一次为准
+        by_event = {}
+        for position, event in failed.items():
+            by_event.setdefault(id(event), (event, []))[1].append(position)
+        return sorted(by_event.values(), key=lambda item: item[0]["start"])
+
+    def failed(self):
+        return RangeSet((p, p + 1) for _, positions in self.failed_batches() for p in positions)
+
+    def failed_ids(self):
+        return {event["ids"][p - event["start"]] for event, positions in self.failed_batches() for p in positions}
+
+    def print_summary(self):
+        committed = self.committed()
+        failed = self.failed_batches()
+        print(f"📒 构建日志: 已提交 {len(committed):,} 个文档，{len(failed)} 个批次仍有失败 ({self.path})")
+        for event, positions in failed:
+            print(f"  - [{event['start']}, {event['end']}) 未写入 {len(positions)} 个: {event['error']}")
+        if failed:
+            print("💡 使用 --retry-failed 只重试失败的批次")
+
+
+def begin_build(loader, db_path, resume=False, retry_failed=False, extra="", settings=None):
+    """按构建模式打开构建日志，返回 (日志, 文档位置选择函数)；无法续建时返回 (None, None)
+
+    - 全量构建: 新建日志，所有文档都处理
+    - resume: 跳过已提交和已记录失败的位置，从中断处继续
+    - retry_failed: 只处理日志中仍处于失败状态的位置
+    """
+    path = os.path.join(db_path, JOURNAL_NAME)
+    fingerprint = input_fingerprint(loader, extra)
+    if not (resume or retry_failed):
+        return BuildJournal.start(path, fingerprint, settings), None
+
+    journal = BuildJournal.open(path)
+    if journal is None:
+        print(f"未找到构建日志 {path}，无法续建，请先执行一次全量构建")
+        return None, None
+    if journal.fingerprint != fingerprint:
+        print("CSV文件或分割参数与上次构建不一致，日志中的位置已失效，请重新全量构建")
+        return None, None
+
+    failed = journal.failed()
+    if retry_failed:
+        print(f"只重试 {len(failed):,} 个失败的文档")
+        return journal, failed.__contains__
+
+    committed = journal.committed()
+    print(f"从检查点继续：跳过 {len(committed) + len(failed):,} 个已处理的文档")
+    return journal, lambda position: position not in committed and position not in failed
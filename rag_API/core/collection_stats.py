@@ -0,0 +1,192 @@
+"""
+向量数据库的精确统计
+消息总数、各发送者/消息类型/房间的消息数、最早和最晚的消息时间，在入库时随每次成功写入增量维护，
+保存在数据库目录的 collection_stats.json 中；API的 /stats 直接读取，不再调用embedding抽样检索
+"""
+
+import json
+import os
+import time
+
+STATS_NAME = "collection_stats.json"
+STATS_VERSION = 1
+
+
+def is_primary_chunk(doc_id):
+    """一条消息分割成多个片段时只统计第一个片段（ID为 文档ID#0）"""
+    return "#" not in doc_id or doc_id.endswith("#0")
+
+
+def _increment(counts, key, delta):
+    counts[key] = counts.get(key, 0) + delta
+    if counts[key] <= 0:
+        del counts[key]
+
+
+class CollectionStats:
+    """按消息（而不是片段）统计，写入前后的元数据都已知时可精确增减
+
+    删除了最早或最晚的消息后，时间范围无法增量得出，标记为 time_range_stale，
+    由调用方在更新结束时调用 rescan 从集合元数据重新统计。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._reset()
+
+    def _reset(self):
+        self.total = 0
+        self.senders = {}
+        self.msg_types = {}
+        self.rooms = {}
+        self.earliest = None
+        self.latest = None
+        self.updated_at = None
+        self.time_range_stale = False
+
+    @classmethod
+    def load(cls, db_path):
+        """读取数据库目录中的统计文件，不存在时返回空统计"""
+        stats = cls(os.path.join(db_path, STATS_NAME))
+        if os.path.exists(stats.path):
+            with open(stats.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == STATS_VERSION:
+                stats.total = data["total_records"]
+                stats.senders = data["senders"]
+                stats.msg_types = data["message_types"]
+                stats.rooms = data["rooms"]
+                stats.earliest = data["time_range"]["earliest"]
+                stats.latest = data["time_range"]["latest"]
+                stats.updated_at = data.get("updated_at")
+        return stats
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def add(self, metadata):
+        self.total += 1
+        _increment(self.senders, metadata.get("sender", ""), 1)
+        _increment(self.msg_types, metadata.get("msg_type", ""), 1)
+        _increment(self.rooms, metadata.get("room", ""), 1)
+        chat_time = metadata.get("chat_time")
+        if chat_time:
+            if self.earliest is None or chat_time < self.earliest:
+                self.earliest = chat_time
+            if self.latest is None or chat_time > self.latest:
+                self.latest = chat_time
+
+    def remove(self, metadata):
+        self.total -= 1
+        _increment(self.senders, metadata.get("sender", ""), -1)
+        _increment(self.msg_types, metadata.get("msg_type", ""), -1)
+        _increment(self.rooms, metadata.get("room", ""), -1)
+        if metadata.get("chat_time") in (self.earliest, self.latest):
+            self.time_range_stale = True
+
+    def on_written(self, ids, metadatas, previous):
+        """BulkVectorWriter 的写入回调：previous 为覆盖写入前已存在的 {ID: 元数据}"""
+        for doc_id, metadata in zip(ids, metadatas):
+            if not is_primary_chunk(doc_id):
+                continue
+            if doc_id in previous:
+                self.remove(previous[doc_id])
+            self.add(metadata)
+        self.save()
+
+    def on_deleted(self, ids, metadatas):
+        """删除向量后调用，metadatas 为删除前取得的元数据"""
+        for doc_id, metadata in zip(ids, metadatas):
+            if is_primary_chunk(doc_id):
+                self.remove(metadata)
+        self.save()
+
+    def rescan(self, collection, page_size=5000):
+        """从集合元数据重新统计（不调用embedding），用于时间范围失效或旧数据库没有统计文件时"""
+        self._reset()
+        offset = 0
+        while True:
+            page = collection.get(include=["metadatas"], limit=page_size, offset=offset)
+            for doc_id, metadata in zip(page["ids"], page["metadatas"]):
+                if is_primary_chunk(doc_id):
+                    self.add(metadata or {})
+            if len(page["ids"]) < page_size:
+                break
+            offset += page_size
+        return self
+
+    def to_dict(self):
+        return {
+            "version": STATS_VERSION,
+            "total_records": self.total,
+            "senders": self.senders,
+            "message_types": self.msg_types,
+            "rooms": self.rooms,
+            "time_range": {"earliest": self.earliest, "latest": self.latest},
+            "updated_at": self.updated_at,
+        }
+
+    def save(self):
+        """原子写入，API服务读到的总是完整的文件"""
+        self.updated_at = time.strftime("%Y-%m-%d %H:%M:%S")
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+def open_collection_stats(db_path, collection):
+    """读取统计文件；已有数据但没有统计文件（旧版构建）时先从集合元数据统计一次"""
+    stats = CollectionStats.load(db_path)
+    if not stats.exists() and collection.count() > 0:
+        print("数据库中没有统计文件，从集合元数据重新统计...")
+        stats.rescan(collection).save()
+    return stats
+
+
+def finish_collection_stats(stats, collection):
+    """构建或更新结束时保存统计，时间范围失效时重新统计"""
+    if stats.time_range_stale:
+        stats.rescan(collection)
+    stats.save()
+    print(f"📊 统计已更新: {stats.total:,} 条消息，{len(stats.senders)} 个发送者，"
+          f"{len(stats.msg_types)} 种消息类型，{len(stats.rooms)} 个房间 ({stats.path})")
+
+
+class CollectionStatsReader:
+    """API服务读取统计文件：文件修改时间变化时才重新读取，平时直接返回已准备好的结果"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.path = os.path.join(db_path, STATS_NAME)
+        self._mtime = None
+        self._summary = None
+
+    def current(self):
+        """返回统计摘要，没有统计文件时返回None"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+        if mtime != self._mtime:
+            self._summary = summarize_stats(CollectionStats.load(self.db_path))
+            self._mtime = mtime
+        return self._summary
+
+
+def summarize_stats(stats):
+    """/stats 的返回内容，各项计数按消息数从多到少排列"""
+    def by_count(counts):
+        return dict(sorted(counts.items(), key=lambda item: -item[1]))
+
+    return {
+        "total_records": stats.total,
+        "unique_senders": list(by_count(stats.senders)),
+        "message_types": list(by_count(stats.msg_types)),
+        "time_range": {"earliest": stats.earliest, "latest": stats.latest},
+        "sender_counts": by_count(stats.senders),
+        "message_type_counts": by_count(stats.msg_types),
+        "room_counts": by_count(stats.rooms),
+        "updated_at": stats.updated_at,
+    }
@@ -0,0 +1,219 @@
+"""
+持久化embedding缓存
+按 (模型名, 文本类型, 文本SHA-256) 把向量保存在本地SQLite中，重建数据库时相同文本不再重复调用embedding接口
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+# 所有构建脚本共用同一个缓存文件
+EMBEDDING_CACHE_PATH = "./embedding_cache.sqlite3"
+
+# SQLite 单条语句的参数个数有上限，批量查询时分块
+_QUERY_CHUNK = 500
+
+
+def text_key(text):
+    """文本内容的哈希键"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def model_name_of(embeddings):
+    """从embedding对象上推断模型名"""
+    for attr in ("model", "model_name"):
+        name = getattr(embeddings, attr, None)
+        if isinstance(name, str) and name:
+            return f"{type(embeddings).__name__}/{name}"
+    return type(embeddings).__name__
+
+
+class CachedEmbeddings:
+    """带磁盘缓存的embedding包装器，可包装任意实现了 embed_documents/embed_query 的后端
+
+    缓存超过 max_size_mb 时按最近使用时间淘汰最旧的条目。
+    """
+
+    def __init__(self, embeddings, model_name=None, cache_path=EMBEDDING_CACHE_PATH, max_size_mb=1024):
+        self.embeddings = embeddings
+        self.model_name = model_name or model_name_of(embeddings)
+        self.cache_path = cache_path
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.backend_calls = 0
+
+        self._lock = threading.Lock()
+        cache_dir = os.path.dirname(os.path.abspath(cache_path))
+        os.makedirs(cache_dir, exist_ok=True)
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, kind, text_hash)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+        self._size_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()[0]
+
+    # ---- LangChain Embeddings 接口 ----
+
+    def embed_documents(self, texts):
+        """批量获取文档向量，只把缓存未命中的不同文本发给后端"""
+        return self._embed(list(texts), "document", self.embeddings.embed_documents)
+
+    def embed_query(self, text):
+        """获取查询向量（部分模型对查询和文档使用不同的编码方式，分开缓存）"""
+        return self._embed([text], "query", lambda texts: [self.embeddings.embed_query(texts[0])])[0]
+
+    # ---- 缓存实现 ----
+
+    def _embed(self, texts, kind, backend):
+        keys = [text_key(text) for text in texts]
+        cached = self._lookup(kind, set(keys))
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+
+        # 未命中按实际发给后端的不同文本计数，同一批内的重复文本算作命中
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            # 后端调用在锁外进行，多个线程可以同时请求
+            vectors = backend(list(missing.values()))
+            with self._lock:
+                self.backend_calls += 1
+            fresh = dict(zip(missing.keys(), vectors))
+            self._store(kind, fresh)
+            cached.update(fresh)
+
+        return [list(cached[key]) for key in keys]
+
+    def _lookup(self, kind, keys):
+        found = {}
+        keys = list(keys)
+        now = time.time()
+        with self._lock:
+            for i in range(0, len(keys), _QUERY_CHUNK):
+                chunk = keys[i:i + _QUERY_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings "
+                    f"WHERE model = ? AND kind = ? AND text_hash IN ({placeholders})",
+                    [self.model_name, kind, *chunk]
+                ).fetchall()
+                for text_hash, blob in rows:
+                    found[text_hash] = array("f", blob).tolist()
+
+                if rows:
+                    self._conn.execute(
+                        f"UPDATE embeddings SET last_used = ? "
+                        f"WHERE model = ? AND kind = ? AND text_hash IN ({placeholders})",
+                        [now, self.model_name, kind, *chunk]
+                    )
+            self._conn.commit()
+        return found
+
+    def _store(self, kind, vectors):
+        now = time.time()
+        rows = [
+            (self.model_name, kind, key, array("f", vector).tobytes(), now)
+            for key, vector in vectors.items()
+        ]
+        with self._lock:
+            # 其他线程或进程可能已经写入了相同的键，REPLACE 时减去被替换条目的大小
+            replaced = self._stored_bytes(kind, list(vectors))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, kind, text_hash, vector, last_used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            self._size_bytes += sum(len(row[3]) for row in rows) - replaced
+            if self._size_bytes > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _stored_bytes(self, kind, keys):
+        """已缓存的这些键的向量总大小"""
+        total = 0
+        for i in range(0, len(keys), _QUERY_CHUNK):
+            chunk = keys[i:i + _QUERY_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            total += self._conn.execute(
+                f"SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings "
+                f"WHERE model = ? AND kind = ? AND text_hash IN ({placeholders})",
+                [self.model_name, kind, *chunk]
+            ).fetchone()[0]
+        return total
+
+    def _evict(self):
+        """淘汰最久未使用的条目，直到缓存大小降到上限的90%"""
+        # 多个进程共用缓存文件时计数可能不准，淘汰前按实际大小重新统计
+        self._size_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()[0]
+        target = self.max_bytes * 0.9
+        while self._size_bytes > target:
+            rows = self._conn.execute(
+                "SELECT rowid, LENGTH(vector) FROM embeddings ORDER BY last_used LIMIT 1000"
+            ).fetchall()
+            if not rows:
+                self._size_bytes = 0
+                break
+
+            freed = 0
+            deleted = []
+            for rowid, size in rows:
+                deleted.append((rowid,))
+                freed += size
+                if self._size_bytes - freed <= target:
+                    break
+            self._conn.executemany("DELETE FROM embeddings WHERE rowid = ?", deleted)
+            self._size_bytes -= freed
+            self.evicted += len(deleted)
+
+    # ---- 统计 ----
+
+    def stats(self):
+        """返回命中率等统计信息"""
+        total = self.hits + self.misses
+        return {
+            "model": self.model_name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "backend_calls": self.backend_calls,
+            "evicted": self.evicted,
+            "cache_size_mb": self._size_bytes / 1024 / 1024,
+        }
+
+    def print_stats(self):
+        """构建结束时打印缓存统计"""
+        stats = self.stats()
+        print(f"📦 Embedding缓存 [{stats['model']}]: 命中 {stats['hits']:,} 次，未命中 {stats['misses']:,} 次，"
+              f"命中率 {stats['hit_rate']:.1%}，后端调用 {stats['backend_calls']:,} 次，"
+              f"淘汰 {stats['evicted']:,} 条，缓存大小 {stats['cache_size_mb']:.1f} MB")
+        if hasattr(self.embeddings, "print_stats"):
+            self.embeddings.print_stats()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
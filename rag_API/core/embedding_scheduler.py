@@ -0,0 +1,208 @@
+"""
+限流感知的并发embedding调度器
+在令牌桶（每秒请求数 + 每分钟token数）的约束下保持多个embedding请求同时进行，
+遇到限流错误（HTTP 429 / Throttling）时自适应降低并发并指数退避
+"""
+
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def estimate_tokens(text):
+    """粗略估计文本的token数：中日韩字符约1字1个token，其他字符约4个字符1个token"""
+    cjk = sum(1 for ch in text if ch >= '⺀')
+    return cjk + (len(text) - cjk + 3) // 4 + 1
+
+
+def is_throttling_error(exc):
+    """判断异常是否为服务端限流"""
+    status = getattr(exc, "status_code", None) or getattr(getattr(exc, "response", None), "status_code", None)
+    if status == 429:
+        return True
+    message = str(exc).lower()
+    return "429" in message or "throttl" in message or "rate limit" in message
+
+
+class TokenBucket:
+    """线程安全的令牌桶，acquire 在令牌不足时阻塞等待"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)                     # 每秒补充的令牌数
+        self.capacity = float(capacity or max(rate, 1))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount=1.0):
+        # 单次请求超过桶容量时按容量计，避免永远等不到
+        amount = min(float(amount), self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                wait = (amount - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class EmbeddingScheduler:
+    """embedding包装器：把 embed_documents 拆成接口允许的请求大小，在限流约束下并发发送
+
+    - request_batch_size: 单次请求的文本数（text-embedding-v3 每次最多10条）
+    - max_in_flight: 最大并发请求数；遇到限流时减半，连续成功后逐步恢复
+    - requests_per_second / tokens_per_minute: 服务商的QPS和TPM配额
+    """
+
+    def __init__(self, embeddings, request_batch_size=10, max_in_flight=8,
+                 requests_per_second=20.0, tokens_per_minute=None,
+                 max_retries=6, base_backoff=0.5, max_backoff=30.0):
+        self.embeddings = embeddings
+        self.request_batch_size = request_batch_size
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        # 请求桶容量为1，请求均匀发出，任意1秒窗口内都不会超过QPS配额
+        self.request_bucket = TokenBucket(requests_per_second, capacity=1)
+        self.token_bucket = TokenBucket(tokens_per_minute / 60.0, tokens_per_minute) if tokens_per_minute else None
+
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="embed")
+        self._cond = threading.Condition()
+        self._limit = max_in_flight
+        self._in_flight = 0
+        self._success_streak = 0
+
+        self.requests = 0
+        self.texts = 0
+        self.tokens = 0
+        self.throttled = 0
+        self.latency_total = 0.0
+        self.min_limit_seen = max_in_flight
+        self._first_start = None
+        self._last_end = None
+
+    # ---- LangChain Embeddings 接口 ----
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        chunks = [texts[i:i + self.request_batch_size]
+                  for i in range(0, len(texts), self.request_batch_size)]
+        futures = [self._executor.submit(self._run_request, chunk) for chunk in chunks]
+
+        vectors = []
+        for future in futures:
+            vectors.extend(future.result())
+        return vectors
+
+    def embed_query(self, text):
+        return self._run_request([text], query=True)[0]
+
+    # ---- 并发与限流 ----
+
+    def _acquire_slot(self):
+        with self._cond:
+            while self._in_flight >= self._limit:
+                self._cond.wait()
+            self._in_flight += 1
+
+    def _release_slot(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def _on_success(self):
+        with self._cond:
+            self._success_streak += 1
+            # 加性增：连续成功一轮后恢复一个并发
+            if self._limit < self.max_in_flight and self._success_streak >= self._limit * 2:
+                self._limit += 1
+                self._success_streak = 0
+                self._cond.notify_all()
+
+    def _on_throttle(self):
+        with self._cond:
+            # 乘性减：遇到限流并发减半
+            self.throttled += 1
+            self._success_streak = 0
+            self._limit = max(1, self._limit // 2)
+            self.min_limit_seen = min(self.min_limit_seen, self._limit)
+
+    def _backoff(self, attempt):
+        delay = min(self.max_backoff, self.base_backoff * (2 ** attempt))
+        return delay * (0.5 + random.random() / 2)  # 加入抖动，避免所有线程同时重试
+
+    def _run_request(self, chunk, query=False):
+        tokens = sum(estimate_tokens(text) for text in chunk)
+
+        for attempt in range(self.max_retries + 1):
+            # 先等配额再占并发名额：只在等配额的请求不占名额，实际并发和AIMD的信号不受TPM限制影响
+            self.request_bucket.acquire(1)
+            if self.token_bucket:
+                self.token_bucket.acquire(tokens)
+            self._acquire_slot()
+            try:
+                start = time.perf_counter()
+                if self._first_start is None:
+                    self._first_start = start
+                if query:
+                    vectors = [self.embeddings.embed_query(chunk[0])]
+                else:
+                    vectors = self.embeddings.embed_documents(chunk)
+                end = time.perf_counter()
+            except Exception as e:
+                if not is_throttling_error(e) or attempt >= self.max_retries:
+                    raise
+                self._on_throttle()
+                delay = self._backoff(attempt)
+            else:
+                with self._cond:
+                    self.requests += 1
+                    self.texts += len(chunk)
+                    self.tokens += tokens
+                    self.latency_total += end - start
+                    self._last_end = end
+                self._on_success()
+                return vectors
+            finally:
+                self._release_slot()
+
+            time.sleep(delay)
+
+    # ---- 统计 ----
+
+    def stats(self):
+        """实际达到的吞吐量"""
+        elapsed = (self._last_end - self._first_start) if self.requests else 0.0
+        elapsed = max(elapsed, 1e-9)
+        return {
+            "requests": self.requests,
+            "texts": self.texts,
+            "tokens": self.tokens,
+            "throttled": self.throttled,
+            "elapsed": elapsed,
+            "requests_per_second": self.requests / elapsed,
+            "texts_per_second": self.texts / elapsed,
+            "tokens_per_minute": self.tokens / elapsed * 60,
+            "avg_latency": self.latency_total / self.requests if self.requests else 0.0,
+            "concurrency": self._limit,
+            "min_concurrency": self.min_limit_seen,
+        }
+
+    def print_stats(self):
+        stats = self.stats()
+        if stats["requests"]:
+            print(f"🚦 Embedding调度: {stats['requests']:,} 次请求，{stats['texts']:,} 条文本，"
+                  f"{stats['requests_per_second']:.1f} 请求/秒，{stats['texts_per_second']:.0f} 条/秒，"
+                  f"约 {stats['tokens_per_minute']:,.0f} tokens/分钟，平均延迟 {stats['avg_latency'] * 1000:.0f} ms，"
+                  f"限流 {stats['throttled']} 次，当前并发 {stats['concurrency']}（最低 {stats['min_concurrency']}）")
+        if hasattr(self.embeddings, "print_stats"):
+            self.embeddings.print_stats()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
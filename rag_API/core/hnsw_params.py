@@ -0,0 +1,96 @@
+"""
+HNSW索引参数
+- M（Chroma 中叫 max_neighbors）：每个节点的邻居数，越大召回率越高，索引越大、构建越慢
+- ef_construction：构建时的候选列表长度，越大图的质量越高、构建越慢
+- ef_search：检索时的候选列表长度，越大召回率越高、检索越慢
+
+M 和 ef_construction 只在创建集合时生效，修改需要重建数据库；ef_search 保存在集合配置中，可以随时修改，
+进程第一次检索该集合时按当时的配置加载索引（Chroma 不支持按查询指定 ef_search）。
+未指定的参数使用 Chroma 的默认值（M=16，ef_construction=100，ef_search=100）。
+
+构建脚本用 --hnsw-m / --hnsw-ef-construction / --hnsw-ef-search 指定，未指定时读取
+环境变量 RAG_HNSW_M / RAG_HNSW_EF_CONSTRUCTION / RAG_HNSW_EF_SEARCH。
+API服务只读取数据库中的参数，设置 RAG_HNSW_APPLY=1 时才在启动时写入 ef_search。
+"""
+
+import os
+
+# 参数名 -> (Chroma配置中的名称, 环境变量)
+HNSW_PARAMS = {
+    "M": ("max_neighbors", "RAG_HNSW_M"),
+    "ef_construction": ("ef_construction", "RAG_HNSW_EF_CONSTRUCTION"),
+    "ef_search": ("ef_search", "RAG_HNSW_EF_SEARCH"),
+}
+BUILD_ONLY_PARAMS = ("M", "ef_construction")
+
+
+def _positive(name, value):
+    value = int(value)
+    if value <= 0:
+        raise ValueError(f"HNSW参数 {name} 必须是正整数: {value}")
+    return value
+
+
+def hnsw_params_from_env(environ=None):
+    """读取环境变量中指定的HNSW参数，只返回设置了的参数"""
+    environ = os.environ if environ is None else environ
+    return {name: _positive(name, environ[env]) for name, (_, env) in HNSW_PARAMS.items() if environ.get(env)}
+
+
+def add_hnsw_arguments(parser):
+    """给构建脚本添加HNSW参数，默认取环境变量"""
+    group = parser.add_argument_group("HNSW索引参数（未指定时读取 RAG_HNSW_* 环境变量，都没有设置时使用Chroma的默认值）")
+    group.add_argument("--hnsw-m", type=int, default=None, help="每个节点的邻居数 M（只在新建数据库时生效）")
+    group.add_argument("--hnsw-ef-construction", type=int, default=None,
+                       help="构建时的候选列表长度（只在新建数据库时生效）")
+    group.add_argument("--hnsw-ef-search", type=int, default=None, help="检索时的候选列表长度")
+
+
+def hnsw_params_from_args(args):
+    """命令行参数优先，未指定的参数取环境变量"""
+    params = hnsw_params_from_env()
+    for name, value in (("M", args.hnsw_m), ("ef_construction", args.hnsw_ef_construction),
+                        ("ef_search", args.hnsw_ef_search)):
+        if value is not None:
+            params[name] = _positive(name, value)
+    return params
+
+
+def hnsw_configuration(params, space=None):
+    """新建集合时的 collection_configuration，没有指定任何参数时返回None（使用默认配置）"""
+    hnsw = {HNSW_PARAMS[name][0]: value for name, value in params.items()}
+    if space:
+        hnsw["space"] = space
+    return {"hnsw": hnsw} if hnsw else None
+
+
+def describe_hnsw(collection):
+    """集合当前的HNSW参数 {M, ef_construction, ef_search}"""
+    configuration = (collection.configuration or {}).get("hnsw") or {}
+    return {name: configuration.get(key) for name, (key, _) in HNSW_PARAMS.items()}
+
+
+def collection_space(collection):
+    """集合的距离空间（l2、cosine、ip）
+
+    chromadb 1.x 和用 hnsw_configuration 创建的集合保存在集合配置中；旧版本创建的集合只有 metadata 中的 hnsw:space。
+    """
+    space = ((collection.configuration or {}).get("hnsw") or {}).get("space")
+    return space or (collection.metadata or {}).get("hnsw:space", "l2")
+
+
+def apply_hnsw_params(collection, params):
+    """把参数应用到已存在的集合，返回生效的参数
+
+    ef_search 与当前配置不同时修改集合配置；M、ef_construction 与现有集合不同时只打印提示（需要重建）。
+    在本进程第一次检索该集合之前调用，修改的 ef_search 才会生效。
+    """
+    current = describe_hnsw(collection)
+    for name in BUILD_ONLY_PARAMS:
+        if name in params and current[name] is not None and params[name] != current[name]:
+            print(f"⚠️ 现有集合的HNSW参数 {name}={current[name]}，指定的 {params[name]} 需要重建数据库才能生效")
+    ef_search = params.get("ef_search")
+    if ef_search is not None and ef_search != current["ef_search"]:
+        collection.modify(configuration={"hnsw": {"ef_search": ef_search}})
+        current["ef_search"] = ef_search
+    return current
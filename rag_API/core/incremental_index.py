@@ -0,0 +1,262 @@
+"""
+向量数据库增量构建
+基于构建清单（CSV文件哈希 + 每条消息的 MsgSvrID 与内容哈希）只写入新增或变化的消息，
+删除CSV中已消失的消息，重复运行结果不变
+"""
+
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+from wechat_loader import (
+    content_hash,
+    iter_batches,
+    iter_chat_records,
+    record_id,
+    record_to_document,
+)
+from vector_writer import BulkVectorWriter, embed_and_write, open_vectorstore, print_build_report
+from collection_stats import finish_collection_stats, open_collection_stats
+
+# 构建清单保存在向量数据库目录中
+MANIFEST_NAME = "build_manifest.json"
+MANIFEST_VERSION = 1
+# 索引代数：每次构建或增量更新改变了数据库内容后加一，API服务据此让结果缓存失效
+GENERATION_NAME = "index_generation.json"
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """计算文件的SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def chunk_ids(doc_id, chunk_count):
+    """一条消息被分割成多个片段时，每个片段的ID为 文档ID#序号"""
+    if chunk_count == 1:
+        return [doc_id]
+    return [f"{doc_id}#{i}" for i in range(chunk_count)]
+
+
+def split_document(doc, text_splitter=None):
+    """按需分割文档，返回 (ID列表, 片段列表)"""
+    doc_id = record_id(doc.metadata)
+    chunks = text_splitter.split_documents([doc]) if text_splitter else [doc]
+    return chunk_ids(doc_id, len(chunks)), chunks
+
+
+def iter_documents_with_ids(documents, text_splitter=None):
+    """为文档流生成确定性ID，重复的消息只保留第一条"""
+    seen = set()
+    for doc in documents:
+        ids, chunks = split_document(doc, text_splitter)
+        if ids[0] in seen:
+            continue
+        seen.update(ids)
+        yield from zip(ids, chunks)
+
+
+class BuildManifest:
+    """构建清单：记录每个CSV文件的哈希，以及其中每条消息的 [内容哈希, 片段数]"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.files = {}
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == MANIFEST_VERSION:
+                self.files = data.get("files", {})
+
+    def exists(self):
+        return self.path.exists()
+
+    def all_messages(self):
+        """合并所有文件中的消息 {文档ID: [内容哈希, 片段数]}"""
+        messages = {}
+        for entry in self.files.values():
+            for doc_id, info in entry["messages"].items():
+                messages.setdefault(doc_id, info)
+        return messages
+
+    def save(self):
+        """原子写入，避免中途崩溃留下损坏的清单"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "version": MANIFEST_VERSION,
+                "updated_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "files": self.files,
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+def read_generation(db_path):
+    """读取索引代数，文件不存在（从未构建或正在全量重建）时返回0"""
+    try:
+        with open(os.path.join(db_path, GENERATION_NAME), "r", encoding="utf-8") as f:
+            return json.load(f).get("generation", 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def bump_generation(db_path):
+    """数据库内容变化后把索引代数加一（原子写入）"""
+    generation = read_generation(db_path) + 1
+    path = os.path.join(db_path, GENERATION_NAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"generation": generation, "updated_at": time.strftime("%Y-%m-%d %H:%M:%S")}, f)
+    os.replace(tmp_path, path)
+    return generation
+
+
+def plan_update(loader, manifest, text_splitter=None):
+    """对比CSV文件与构建清单
+
+    返回 (待写入列表[(ID列表, 片段列表)], 待删除ID列表, 新的清单文件表)。
+    哈希未变的文件直接沿用清单记录，不再解析。
+    """
+    old_messages = manifest.all_messages()
+    new_messages = {}
+    new_files = {}
+    pending = []
+    stale_ids = []
+
+    for csv_file in loader.csv_files():
+        key = csv_file.relative_to(loader.csv_folder_path).as_posix()
+        digest = file_sha256(csv_file)
+        old_entry = manifest.files.get(key)
+
+        if old_entry and old_entry.get("sha256") == digest:
+            for doc_id, info in old_entry["messages"].items():
+                new_messages.setdefault(doc_id, info)
+            new_files[key] = old_entry
+            continue
+
+        messages = {}
+        for record in iter_chat_records(csv_file, encoding=loader.encoding):
+            doc = record_to_document(record)
+            ids, chunks = split_document(doc, text_splitter)
+            doc_id = record_id(doc.metadata)
+            if doc_id in new_messages:
+                continue  # 重复消息只保留第一条
+
+            info = [content_hash(doc.page_content), len(chunks)]
+            messages[doc_id] = info
+            new_messages[doc_id] = info
+
+            old_info = old_messages.get(doc_id)
+            if old_info != info:
+                pending.append((ids, chunks))
+                if old_info is not None:
+                    # 片段数变少时，多出来的旧片段需要删除
+                    stale_ids.extend(set(chunk_ids(doc_id, old_info[1])) - set(ids))
+
+        new_files[key] = {"sha256": digest, "messages": messages}
+
+    for doc_id, info in old_messages.items():
+        if doc_id not in new_messages:
+            stale_ids.extend(chunk_ids(doc_id, info[1]))
+
+    return pending, stale_ids, new_files
+
+
+def forget_failed(new_files, failed_ids, old_messages=None):
+    """写入失败的消息在清单中恢复为旧状态（新消息直接移除），并让所在文件下次重新解析"""
+    old_messages = old_messages or {}
+    for entry in new_files.values():
+        failed_here = failed_ids.intersection(entry["messages"])
+        if not failed_here:
+            continue
+        entry["sha256"] = None
+        for doc_id in failed_here:
+            if doc_id in old_messages:
+                entry["messages"][doc_id] = old_messages[doc_id]
+            else:
+                del entry["messages"][doc_id]
+
+
+def write_manifest(loader, db_path, text_splitter=None, failed_ids=None):
+    """全量构建后记录构建清单，之后即可增量更新；失败批次的消息不记入清单"""
+    manifest = BuildManifest(os.path.join(db_path, MANIFEST_NAME))
+    manifest.files = {}
+    _, _, new_files = plan_update(loader, manifest, text_splitter)
+    if failed_ids:
+        forget_failed(new_files, set(failed_ids))
+    manifest.files = new_files
+    manifest.save()
+    bump_generation(db_path)
+    return manifest
+
+
+def update_vectorstore_incremental(loader, embeddings, db_path, batch_size=100,
+                                   text_splitter=None, max_retries=3, sizer=None, hnsw=None):
+    """增量更新向量数据库：只嵌入并写入新增或变化的消息，删除已消失的消息
+
+    传入 sizer（AdaptiveBatchSizer）时按token数自适应切分批次，否则每批 batch_size 条。
+    """
+    manifest = BuildManifest(os.path.join(db_path, MANIFEST_NAME))
+    vectorstore = open_vectorstore(db_path, embeddings, hnsw)
+
+    if not manifest.exists() and vectorstore._collection.count() > 0:
+        print("⚠️ 现有数据库没有构建清单（旧版随机ID构建），无法增量更新，请先执行一次全量重建")
+        return None
+
+    print("正在对比CSV文件与构建清单...")
+    pending, stale_ids, new_files = plan_update(loader, manifest, text_splitter)
+    changed_files = sum(1 for key, entry in new_files.items() if manifest.files.get(key) is not entry)
+    removed_files = sum(1 for key in manifest.files if key not in new_files)
+    print(f"变化的文件 {changed_files} 个，移除的文件 {removed_files} 个")
+    print(f"待写入 {len(pending)} 条消息，待删除 {len(stale_ids)} 个向量")
+
+    if not pending and not stale_ids:
+        manifest.files = new_files
+        manifest.save()
+        print("✅ 向量数据库已是最新，无需更新")
+        return vectorstore
+
+    # 先删除已消失的消息；删除失败时不更新清单，下次运行会重新尝试
+    collection = vectorstore._collection
+    stats = open_collection_stats(db_path, collection)
+    try:
+        for batch in iter_batches(stale_ids, 500):
+            existing = collection.get(ids=batch, include=["metadatas"])
+            vectorstore.delete(ids=batch)
+            stats.on_deleted(existing["ids"], existing["metadatas"])
+    except Exception as e:
+        print(f"❌ 删除旧消息失败: {e}")
+        bump_generation(db_path)  # 部分批次可能已经删除
+        return None
+
+    # 写入新增或变化的消息：先计算向量再批量upsert，确定性ID保证重试不会产生重复向量
+    old_messages = manifest.all_messages()
+    id_documents = [(doc_id, chunk) for ids, chunks in pending for doc_id, chunk in zip(ids, chunks)]
+    writer = BulkVectorWriter.for_vectorstore(vectorstore, on_written=stats.on_written)
+    report = embed_and_write(id_documents, embeddings, writer, batch_size=batch_size,
+                             max_retries=max_retries, sizer=sizer,
+                             total_batches=(len(id_documents) + batch_size - 1) // batch_size)
+    print_build_report(report)
+    finish_collection_stats(stats, collection)
+    failed_ids = report["failed_ids"]
+
+    # 写入失败的消息在清单中保留旧状态，下次运行会重新写入
+    if failed_ids:
+        print(f"⚠️ {len(failed_ids)} 条消息写入失败，将在下次增量更新时重试")
+        forget_failed(new_files, failed_ids, old_messages)
+
+    manifest.files = new_files
+    manifest.save()
+    bump_generation(db_path)
+    # lexical_index 从本模块读取索引代数，在这里才导入
+    from lexical_index import build_lexical_index
+
+    build_lexical_index(db_path, collection)
+    print(f"✅ 增量更新完成，写入 {len(pending) - len(failed_ids)} 条，删除 {len(stale_ids)} 个向量")
+    return vectorstore
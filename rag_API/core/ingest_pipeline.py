@@ -0,0 +1,384 @@
+"""
+分阶段的入库流水线
+解析 → 过滤 → 去重 → 嵌入 → 写入，每个阶段一个线程，阶段之间用有界队列连接：
+下游处理不过来时上游阻塞等待（背压），CSV解析、网络embedding和磁盘写入同时进行，
+内存中最多只有几个队列长度的数据，而不是整个语料。
+每个阶段统计自己的吞吐量、空闲时间（等上游）和阻塞时间（等下游），用于定位瓶颈。
+"""
+
+import queue
+import threading
+import time
+
+from wechat_loader import iter_batches, record_id, record_to_document, row_to_record
+from incremental_index import split_document, write_manifest
+from vector_writer import BulkVectorWriter, embed_batch, open_vectorstore, print_build_report
+from adaptive_batching import BatchBuilder
+from build_journal import begin_build
+from collection_stats import finish_collection_stats, open_collection_stats
+from lexical_index import build_lexical_index
+
+_DONE = object()  # 上游结束标记
+
+
+class _Stopped(Exception):
+    """其他阶段出错，流水线停止"""
+
+
+class StageStats:
+    """单个阶段的计数和耗时"""
+
+    def __init__(self, name, unit):
+        self.name = name
+        self.unit = unit          # 吞吐量的计数单位
+        self.items_in = 0
+        self.items_out = 0
+        self.busy = 0.0           # 处理耗时
+        self.idle = 0.0           # 等待上游的时间
+        self.blocked = 0.0        # 队列已满、等待下游的时间
+        self.wall = 0.0
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "unit": self.unit,
+            "items_in": self.items_in,
+            "items_out": self.items_out,
+            "busy": self.busy,
+            "idle": self.idle,
+            "blocked": self.blocked,
+            "wall": self.wall,
+            "rate": self.items_in / self.busy if self.busy else 0.0,
+        }
+
+
+class IngestPipeline:
+    """把聊天记录流写入向量数据库的分阶段流水线
+
+    source 可以是 WeChatCSVLoader.lazy_rows() 产出的 (文件名, CSV行)，
+    也可以是 lazy_records() / lazy_load_parallel(as_documents=False) 产出的记录字典（已过滤）。
+    传入 sizer（AdaptiveBatchSizer）时按token数自适应切分批次，否则每批 batch_size 条。
+    文档在去重后的流中的位置决定批次区间 (start, end)，写入器的提交/失败回调收到的标签就是这个区间；
+    select_item(位置) 返回False的文档直接跳过（用于断点续建），on_embed_failure(区间, 消息ID列表, 异常)
+    在批次嵌入最终失败时调用。
+    """
+
+    def __init__(self, embeddings, writer, batch_size=200, text_splitter=None, queue_size=8,
+                 parse_chunk=256, max_retries=3, sizer=None, select_item=None, on_embed_failure=None,
+                 progress_every=10):
+        self.embeddings = embeddings
+        self.writer = writer
+        self.batch_size = batch_size
+        self.sizer = sizer
+        self.text_splitter = text_splitter
+        self.queue_size = queue_size
+        self.parse_chunk = parse_chunk  # 解析阶段每次入队的行数，减少队列操作开销
+        self.max_retries = max_retries
+        self.select_item = select_item
+        self.on_embed_failure = on_embed_failure
+        self.progress_every = progress_every
+
+        self._stop = threading.Event()
+        self._errors = []
+        self.report = {
+            "embedded": 0,
+            "skipped": 0,
+            "duplicates": 0,
+            "embed_seconds": 0.0,
+            "failed_batches": 0,
+            "failed_ids": set(),
+        }
+
+    # ---- 队列操作（统计等待时间，其他阶段出错时退出） ----
+
+    def _get(self, inbox, stats):
+        start = time.perf_counter()
+        while True:
+            try:
+                item = inbox.get(timeout=0.1)
+                break
+            except queue.Empty:
+                if self._stop.is_set():
+                    raise _Stopped()
+        stats.idle += time.perf_counter() - start
+        return item
+
+    def _put(self, outbox, item, stats):
+        start = time.perf_counter()
+        while True:
+            try:
+                outbox.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                if self._stop.is_set():
+                    raise _Stopped()
+        stats.blocked += time.perf_counter() - start
+        if item is not _DONE:
+            stats.items_out += 1
+
+    def _run_stage(self, stats, body):
+        start = time.perf_counter()
+        try:
+            body(stats)
+        except _Stopped:
+            pass
+        except BaseException as e:
+            self._errors.append(e)
+            self._stop.set()
+        finally:
+            stats.wall = time.perf_counter() - start
+
+    # ---- 各阶段 ----
+
+    def _parse(self, source, outbox):
+        """读取CSV行（或并行加载器产出的记录）"""
+        def body(stats):
+            iterator = iter(iter_batches(source, self.parse_chunk))
+            while True:
+                start = time.perf_counter()
+                chunk = next(iterator, None)
+                stats.busy += time.perf_counter() - start
+                if chunk is None:
+                    break
+                stats.items_in += len(chunk)
+                self._put(outbox, chunk, stats)
+            self._put(outbox, _DONE, stats)
+        return body
+
+    def _filter(self, inbox, outbox):
+        """过滤无效消息，转换为文档并按需分割"""
+        def body(stats):
+            while True:
+                chunk = self._get(inbox, stats)
+                if chunk is _DONE:
+                    break
+                start = time.perf_counter()
+                id_chunks = []
+                for item in chunk:
+                    stats.items_in += 1
+                    record = row_to_record(item[1], item[0]) if isinstance(item, tuple) else item
+                    if record is None:
+                        continue
+                    ids, chunks = split_document(record_to_document(record), self.text_splitter)
+                    id_chunks.append((ids, chunks))
+                stats.busy += time.perf_counter() - start
+                if id_chunks:
+                    self._put(outbox, id_chunks, stats)
+            self._put(outbox, _DONE, stats)
+        return body
+
+    def _dedupe(self, inbox, outbox):
+        """同一条消息（相同MsgSvrID）只保留第一次出现，并切分为embedding批次
+
+        批次内的文档位置总是连续的：遇到被跳过的位置时先把已攒的文档切成一批。
+        """
+        def body(stats):
+            seen = set()
+            builder = BatchBuilder(self.sizer, self.batch_size)
+            position = 0        # 下一个文档在去重后文档流中的位置
+            batch_start = 0     # builder 中第一个文档的位置
+            batch_index = 0
+
+            def ready_batch(id_batch, ready):
+                nonlocal batch_start, batch_index
+                ready.append((batch_index, (batch_start, batch_start + len(id_batch)), id_batch))
+                batch_start += len(id_batch)
+                batch_index += 1
+
+            while True:
+                id_chunks = self._get(inbox, stats)
+                if id_chunks is _DONE:
+                    break
+                start = time.perf_counter()
+                ready = []
+                for ids, chunks in id_chunks:
+                    stats.items_in += 1
+                    if ids[0] in seen:
+                        self.report["duplicates"] += 1
+                        continue
+                    seen.update(ids)
+                    for pair in zip(ids, chunks):
+                        if self.select_item is not None and not self.select_item(position):
+                            self.report["skipped"] += 1
+                            if builder.items:
+                                ready_batch(builder.cut(), ready)
+                        else:
+                            if not builder.items:
+                                batch_start = position
+                            for id_batch in builder.add(pair):
+                                ready_batch(id_batch, ready)
+                        position += 1
+                stats.busy += time.perf_counter() - start
+                for item in ready:
+                    self._put(outbox, item, stats)
+            if builder.items:
+                ready = []
+                ready_batch(builder.cut(), ready)
+                self._put(outbox, ready[0], stats)
+            self._put(outbox, _DONE, stats)
+        return body
+
+    def _embed(self, inbox, outbox):
+        """计算向量（并发和限流由内层的 EmbeddingScheduler 负责）"""
+        def body(stats):
+            while True:
+                item = self._get(inbox, stats)
+                if item is _DONE:
+                    break
+                batch_index, batch_range, id_batch = item
+                stats.items_in += len(id_batch)
+                start = time.perf_counter()
+                vectors, error, seconds = embed_batch(self.embeddings, [doc for _, doc in id_batch], batch_index,
+                                                      self.max_retries, self.sizer)
+                stats.busy += time.perf_counter() - start
+                self.report["embed_seconds"] += seconds
+
+                if vectors is None:
+                    failed_ids = [record_id(doc.metadata) for _, doc in id_batch]
+                    self.report["failed_batches"] += 1
+                    self.report["failed_ids"].update(failed_ids)
+                    if self.on_embed_failure:
+                        self.on_embed_failure(batch_range, failed_ids, error)
+                    print(f"批次 {batch_index + 1} 最终失败，跳过")
+                    continue
+
+                self.report["embedded"] += len(id_batch)
+                self._put(outbox, (batch_range, id_batch, vectors), stats)
+            self._put(outbox, _DONE, stats)
+        return body
+
+    def _write(self, inbox):
+        """交给 BulkVectorWriter 攒批upsert"""
+        def body(stats):
+            batches = 0
+            while True:
+                item = self._get(inbox, stats)
+                if item is _DONE:
+                    break
+                batch_range, id_batch, vectors = item
+                stats.items_in += len(id_batch)
+                start = time.perf_counter()
+                self.writer.add([doc_id for doc_id, _ in id_batch], vectors,
+                                [doc.page_content for _, doc in id_batch],
+                                [doc.metadata for _, doc in id_batch], tag=batch_range)
+                stats.busy += time.perf_counter() - start
+                stats.items_out += len(id_batch)
+
+                batches += 1
+                if self.progress_every and batches % self.progress_every == 0:
+                    print(f"  已处理 {batches} 个批次，累计写入 {self.writer.written:,} 条")
+            start = time.perf_counter()
+            self.writer.flush()
+            stats.busy += time.perf_counter() - start
+        return body
+
+    # ---- 运行 ----
+
+    def run(self, source):
+        """运行流水线直到数据全部写入，返回构建报告（格式与 embed_and_write 相同，另含各阶段统计）"""
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(4)]
+        stages = [
+            (StageStats("解析", "行"), self._parse(source, queues[0])),
+            (StageStats("过滤", "行"), self._filter(queues[0], queues[1])),
+            (StageStats("去重", "条消息"), self._dedupe(queues[1], queues[2])),
+            (StageStats("嵌入", "条"), self._embed(queues[2], queues[3])),
+            (StageStats("写入", "条"), self._write(queues[3])),
+        ]
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=self._run_stage, args=stage, name=f"ingest-{stage[0].name}", daemon=True)
+                   for stage in stages]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(timeout=0.5)
+        except KeyboardInterrupt:
+            self._stop.set()
+            raise
+
+        if self._errors:
+            raise self._errors[0]
+
+        report = self.report
+        report["failed_ids"] |= self.writer.failed_ids
+        report["written"] = self.writer.written
+        report["write_seconds"] = self.writer.write_seconds
+        report["lookup_seconds"] = self.writer.lookup_seconds
+        report["transactions"] = self.writer.transactions
+        report["wall_seconds"] = time.perf_counter() - start
+        report["stages"] = [stats.as_dict() for stats, _ in stages]
+        if self.sizer:
+            report["batch_sizes"] = self.sizer.summary()
+        return report
+
+
+def run_ingest_pipeline(source, embeddings, writer, batch_size=200, text_splitter=None, queue_size=8, **kwargs):
+    """便捷函数：创建流水线并运行"""
+    pipeline = IngestPipeline(embeddings, writer, batch_size=batch_size, text_splitter=text_splitter,
+                              queue_size=queue_size, **kwargs)
+    return pipeline.run(source)
+
+
+def print_pipeline_report(report):
+    """打印各阶段的吞吐量和等待时间，处理耗时最长的阶段就是瓶颈"""
+    stages = report.get("stages")
+    if not stages:
+        return
+    bottleneck = max(stages, key=lambda stage: stage["busy"])
+    print(f"🏭 流水线总耗时 {report['wall_seconds']:.1f} 秒"
+          + (f"，跳过重复消息 {report['duplicates']:,} 条" if report.get("duplicates") else ""))
+    for stage in stages:
+        mark = " ⬅ 瓶颈" if stage is bottleneck else ""
+        print(f"  - {stage['name']}: 输入 {stage['items_in']:,} {stage['unit']}，"
+              f"处理 {stage['busy']:.1f} 秒（{stage['rate']:,.0f} {stage['unit']}/秒），"
+              f"空闲 {stage['idle']:.1f} 秒，阻塞 {stage['blocked']:.1f} 秒{mark}")
+
+
+def build_vectorstore(source, embeddings, db_path, batch_size=100, manifest_loader=None, text_splitter=None,
+                      resume=False, retry_failed=False, sizer=None, hnsw=None):
+    """全量构建（或续建）向量数据库，构建脚本共用；没有写入任何记录或无法续建时返回None
+
+    source 为加载器产出的CSV行或聊天记录流，经流水线解析、分割、嵌入和写入；
+    传入 sizer 时按token数自适应切分批次，否则每批 batch_size 条。
+    传入 manifest_loader 时记录构建日志（中断后可 --resume 续建、--retry-failed 重试失败批次），
+    完成后写入构建清单，之后可用 --incremental 增量更新。
+    """
+    # 先计算向量再批量upsert；文档ID由MsgSvrID确定，重试时覆盖写入，不会产生重复向量
+    # 限速由 EmbeddingScheduler 按QPS/TPM配额控制，批次之间无需固定等待
+    journal, select_item = None, None
+    if manifest_loader is not None:
+        # 分割参数影响片段数量和文档位置，一并计入输入指纹
+        splitter_key = f"{text_splitter._chunk_size}/{text_splitter._chunk_overlap}" if text_splitter else ""
+        journal, select_item = begin_build(manifest_loader, db_path, resume=resume,
+                                           retry_failed=retry_failed, extra=splitter_key)
+        if journal is None:
+            return None
+    callbacks = {"on_commit": journal.on_commit, "on_failure": journal.on_failure} if journal else {}
+
+    vectorstore = open_vectorstore(db_path, embeddings, hnsw)
+    # 统计随写入增量维护，API的 /stats 直接读取
+    stats = open_collection_stats(db_path, vectorstore._collection)
+    writer = BulkVectorWriter.for_vectorstore(vectorstore, on_written=stats.on_written, **callbacks)
+    report = run_ingest_pipeline(source, embeddings, writer, batch_size=batch_size, text_splitter=text_splitter,
+                                 sizer=sizer, select_item=select_item, on_embed_failure=callbacks.get("on_failure"))
+    print_build_report(report)
+    print_pipeline_report(report)
+    finish_collection_stats(stats, vectorstore._collection)
+    failed_ids = journal.failed_ids() if journal else report["failed_ids"]
+
+    if report["written"] == 0 and not failed_ids and not report["skipped"]:
+        print("❌ 未找到有效聊天记录，请检查CSV文件格式")
+        return None
+
+    if journal is not None:
+        # 失败批次不记入清单，下次增量更新或 --retry-failed 时会重新写入
+        write_manifest(manifest_loader, db_path, text_splitter=text_splitter, failed_ids=failed_ids)
+        journal.record_finish()
+        journal.print_summary()
+        print("📋 已写入构建清单，之后可使用 --incremental 增量更新")
+
+    # 关键词索引在索引代数更新之后构建，API据此判断索引是否过期
+    build_lexical_index(db_path, vectorstore._collection)
+    return vectorstore
@@ -0,0 +1,251 @@
+"""
+关键词检索（BM25）
+人名、生僻词用向量检索常常找不准，关键词索引不到1毫秒就能精确命中。
+中文按相邻两个汉字切分（单独一个汉字保留为一个词），英文和数字按连续字母数字切分并转为小写，不需要分词词典。
+只索引消息正文：写入数据库的文本中固定的"时间/发送者/房间"等标签每条记录都有，会让"时间"、"是否"这类词命中所有文档，
+也会拉长文档长度、影响BM25的长度归一化。
+
+索引按词存放倒排表（CSR格式：indptr、文档序号、BM25权重），每条倒排记录的BM25权重在构建时算好，
+检索时只需把问题中各个词的倒排权重累加到得分向量上。
+索引保存在数据库目录的 lexical_index/ 中，记录构建时的索引代数；构建脚本写入数据库后重建，也可手动重建:
+    python core/lexical_index.py --db ./chroma_wechat_db --query 雷蕾
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import time
+from collections import Counter
+
+import numpy as np
+
+from incremental_index import read_generation
+from wechat_loader import message_from_formatted
+
+LEXICAL_INDEX_DIR = "lexical_index"
+LEXICAL_INDEX_VERSION = 2  # 2: 只索引消息正文
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60  # 倒数排名融合的平滑常数：得分为 Σ 1 / (RRF_K + 名次)
+
+TOKEN_PATTERN = re.compile(r"[㐀-鿿]+|[a-z0-9]+")
+
+
+def tokenize(text):
+    """汉字两两切分，字母数字按连续片段切分"""
+    tokens = []
+    for run in TOKEN_PATTERN.findall(text.lower()):
+        if run[0] >= "㐀" and len(run) > 1:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def indexed_text(document):
+    """文档中参与关键词检索的文本：format_chat_record 格式的记录取消息正文，分割后的片段等其他文本原样使用"""
+    document = document or ""
+    body = message_from_formatted(document)
+    return document if body is None else body
+
+
+def lexical_index_dir(db_path):
+    return os.path.join(db_path, LEXICAL_INDEX_DIR)
+
+
+def read_lexical_info(db_path):
+    """读取索引信息，未构建时返回None"""
+    try:
+        with open(os.path.join(lexical_index_dir(db_path), "index.json"), "r", encoding="utf-8") as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return info if info.get("version") == LEXICAL_INDEX_VERSION else None
+
+
+def is_lexical_index_current(db_path):
+    """构建时的索引代数与数据库当前代数一致"""
+    info = read_lexical_info(db_path)
+    return info is not None and info["generation"] == read_generation(db_path)
+
+
+def build_lexical_index(db_path, collection, page_size=5000):
+    """从集合中的文档构建BM25索引，返回索引信息
+
+    先写入临时目录再替换，正在检索的进程继续使用已加载的旧索引。
+    """
+    generation = read_generation(db_path)
+    start = time.perf_counter()
+
+    ids = []
+    doc_lengths = []
+    vocabulary = {}
+    term_rows, doc_rows, tf_rows = [], [], []
+    offset = 0
+    while True:
+        page = collection.get(include=["documents"], limit=page_size, offset=offset)
+        for doc_id, document in zip(page["ids"], page["documents"]):
+            counts = Counter(tokenize(indexed_text(document)))
+            doc_index = len(ids)
+            ids.append(doc_id)
+            doc_lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                term_rows.append(vocabulary.setdefault(term, len(vocabulary)))
+                doc_rows.append(doc_index)
+                tf_rows.append(tf)
+        if len(page["ids"]) < page_size:
+            break
+        offset += page_size
+
+    # 按词排序得到倒排表，同一个词内部保持文档顺序
+    term_rows = np.asarray(term_rows, dtype=np.int64)
+    order = np.argsort(term_rows, kind="stable")
+    docs = np.asarray(doc_rows, dtype=np.int32)[order]
+    tfs = np.asarray(tf_rows, dtype=np.float32)[order]
+    indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(term_rows, minlength=len(vocabulary)), out=indptr[1:])
+
+    doc_lengths = np.asarray(doc_lengths, dtype=np.float32)
+    avgdl = float(doc_lengths.mean()) if len(ids) else 0.0
+    df = np.diff(indptr).astype(np.float32)
+    idf = np.log(1 + (len(ids) - df + 0.5) / (df + 0.5))
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths[docs] / max(avgdl, 1e-12))
+    weights = np.repeat(idf, np.diff(indptr)) * tfs * (BM25_K1 + 1) / (tfs + norm)
+
+    target = lexical_index_dir(db_path)
+    tmp_dir = f"{target}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    np.savez(os.path.join(tmp_dir, "postings.npz"), indptr=indptr, docs=docs, weights=weights.astype(np.float32))
+    with open(os.path.join(tmp_dir, "terms.json"), "w", encoding="utf-8") as f:
+        json.dump({"ids": ids, "terms": list(vocabulary)}, f, ensure_ascii=False)
+    info = {
+        "version": LEXICAL_INDEX_VERSION,
+        "generation": generation,
+        "count": len(ids),
+        "terms": len(vocabulary),
+        "postings": int(indptr[-1]),
+        "avgdl": round(avgdl, 2),
+        "k1": BM25_K1,
+        "b": BM25_B,
+        "built_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "build_seconds": round(time.perf_counter() - start, 3),
+    }
+    with open(os.path.join(tmp_dir, "index.json"), "w", encoding="utf-8") as f:
+        json.dump(info, f, ensure_ascii=False)
+
+    old_dir = f"{target}.{os.getpid()}.old"
+    if os.path.exists(target):
+        os.replace(target, old_dir)
+    os.replace(tmp_dir, target)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    print(f"🔤 关键词索引已构建: {info['count']:,} 条文档，{info['terms']:,} 个词，"
+          f"用时 {info['build_seconds']:.2f} 秒 ({target})")
+    return info
+
+
+class LexicalIndex:
+    """加载到内存的BM25倒排索引"""
+
+    def __init__(self, db_path):
+        directory = lexical_index_dir(db_path)
+        self.info = read_lexical_info(db_path)
+        if self.info is None:
+            raise FileNotFoundError(f"没有找到关键词索引，请先构建: {directory}")
+        self.generation = self.info["generation"]
+        with open(os.path.join(directory, "terms.json"), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self.ids = data["ids"]
+        self.vocabulary = {term: index for index, term in enumerate(data["terms"])}
+        with np.load(os.path.join(directory, "postings.npz")) as postings:
+            self.indptr = postings["indptr"]
+            self.docs = postings["docs"]
+            self.weights = postings["weights"]
+        self._rows = None
+
+    def rows(self, ids):
+        """文档ID对应的行号，不在索引中的ID忽略"""
+        if self._rows is None:
+            self._rows = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        return np.fromiter((row for row in map(self._rows.get, ids) if row is not None), dtype=np.int64)
+
+    def count(self):
+        return len(self.ids)
+
+    def scores(self, query):
+        """问题对全部文档的BM25得分；问题中重复出现的词按次数加权"""
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term, query_tf in Counter(tokenize(query)).items():
+            index = self.vocabulary.get(term)
+            if index is None:
+                continue
+            start, end = self.indptr[index], self.indptr[index + 1]
+            # 同一个词的倒排表中文档不重复，可以直接按下标累加
+            scores[self.docs[start:end]] += query_tf * self.weights[start:end]
+        return scores
+
+    def search(self, query, k=5, ids=None):
+        """返回得分最高的k个 [(文档ID, 得分)]，按得分从高到低排列，不含得分为0的文档；指定 ids 时只在这些文档中检索"""
+        scores = self.scores(query)
+        matched = np.flatnonzero(scores)
+        if ids is not None:
+            matched = np.intersect1d(matched, self.rows(ids), assume_unique=True)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        return [(self.ids[row], float(scores[row])) for row in matched]
+
+
+def load_lexical_index(db_path, collection=None):
+    """打开关键词索引；尚未构建或构建后数据库已更新时先从集合重建"""
+    if not is_lexical_index_current(db_path):
+        print("🔄 关键词索引不存在或已过期，正在从Chroma集合重建...")
+        if collection is None:
+            from numpy_index import open_collection
+
+            collection = open_collection(db_path)
+        build_lexical_index(db_path, collection)
+    return LexicalIndex(db_path)
+
+
+def reciprocal_rank_fusion(rankings, limit=None, k=RRF_K):
+    """倒数排名融合：rankings 为多个按相关性排好序的ID列表，返回 [(ID, 融合得分)]，按得分从高到低排列
+
+    只用名次、不用原始分数，向量距离和BM25得分的量纲不同也可以直接合并。
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            fused[item] = fused.get(item, 0.0) + 1.0 / (k + rank)
+    ordered = sorted(fused.items(), key=lambda entry: -entry[1])
+    return ordered[:limit] if limit else ordered
+
+
+def main():
+    parser = argparse.ArgumentParser(description="构建关键词检索（BM25）索引")
+    parser.add_argument("--db", default="./chroma_wechat_db")
+    parser.add_argument("--query", nargs="*", default=[], help="构建后检索这些问题并打印结果")
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    from numpy_index import open_collection
+
+    collection = open_collection(args.db)
+    build_lexical_index(args.db, collection)
+    index = LexicalIndex(args.db)
+    for query in args.query:
+        start = time.perf_counter()
+        hits = index.search(query, args.k)
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"\n🔍 {query}（{' '.join(tokenize(query))}）: {len(hits)} 条，{elapsed:.3f} ms")
+        if hits:
+            documents = collection.get(ids=[doc_id for doc_id, _ in hits], include=["documents"])
+            contents = dict(zip(documents["ids"], documents["documents"]))
+            for doc_id, score in hits:
+                print(f"   {score:6.2f}  {(contents.get(doc_id) or '').splitlines()[-3:-2]}")
+
+
+if __name__ == "__main__":
+    main()
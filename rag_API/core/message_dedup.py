@@ -0,0 +1,90 @@
+"""
+按消息正文去重的embedding
+聊天记录里大量重复的短消息（"好的"、"收到"、转发通知等）只嵌入一次，向量复用到每次出现
+"""
+
+import hashlib
+import re
+import threading
+import unicodedata
+
+from wechat_loader import message_from_formatted
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_message(text):
+    """规范化消息正文：全角半角统一（NFKC）、去掉首尾空白、连续空白合并为一个空格"""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def embedding_text(page_content):
+    """文档实际用于嵌入的文本：聊天记录取规范化后的消息正文，其他文本原样使用
+
+    时间、发送者等信息保存在元数据中，不参与嵌入，因此相同正文得到相同向量。
+    """
+    message = message_from_formatted(page_content)
+    if message is None:
+        return page_content
+    return normalize_message(message) or page_content
+
+
+class MessageBodyEmbeddings:
+    """embedding包装器：把格式化后的聊天记录换成规范化正文，同一正文只嵌入一次
+
+    同一批内的重复正文在这里合并；跨批次的重复由内层的 CachedEmbeddings 命中缓存。
+    """
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+        self.occurrences = 0   # 收到的文档数
+        self.sent = 0          # 实际交给内层的不同正文数
+        self._distinct = set()  # 全部构建过程中见过的正文哈希
+        self._lock = threading.Lock()
+
+    @property
+    def misses(self):
+        """实际调用embedding接口的文本数（供构建循环判断是否需要限速等待）"""
+        return getattr(self.embeddings, "misses", self.sent)
+
+    def embed_documents(self, texts):
+        bodies = [embedding_text(text) for text in texts]
+        unique = list(dict.fromkeys(bodies))
+
+        with self._lock:
+            self.occurrences += len(bodies)
+            self.sent += len(unique)
+            self._distinct.update(hashlib.sha1(body.encode("utf-8")).digest() for body in unique)
+
+        vectors = dict(zip(unique, self.embeddings.embed_documents(unique)))
+        return [vectors[body] for body in bodies]
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+    def stats(self):
+        distinct = len(self._distinct)
+        return {
+            "occurrences": self.occurrences,
+            "distinct": distinct,
+            "saved": self.occurrences - distinct,
+        }
+
+    def print_stats(self):
+        """打印去重节省的embedding调用数，并输出内层统计"""
+        stats = self.stats()
+        if stats["occurrences"]:
+            print(f"♻️ 正文去重: {stats['occurrences']:,} 条文档，{stats['distinct']:,} 条不同正文，"
+                  f"节省 {stats['saved']:,} 次embedding（{stats['saved'] / stats['occurrences']:.1%}）")
+        if hasattr(self.embeddings, "print_stats"):
+            self.embeddings.print_stats()
+
+
+def dedup_report(records):
+    """统计聊天记录的正文重复情况，返回 (总条数, 不同正文数, 出现最多的正文列表)"""
+    counts = {}
+    for record in records:
+        body = normalize_message(record['msg'])
+        counts[body] = counts.get(body, 0) + 1
+    top = sorted(counts.items(), key=lambda item: item[1], reverse=True)[:10]
+    return sum(counts.values()), len(counts), top
@@ -0,0 +1,601 @@
+"""
+NumPy精确检索
+把Chroma集合中的全部向量导出为一个连续的 float32 矩阵（vectors.npy，以内存映射方式打开），
+文档和元数据导出为按列存放的 records.json；检索时一次矩阵乘法加 argpartition 取前k个，结果是精确的。
+几万条向量的规模下比HNSW加SQLite元数据查询更快，并且支持一次检索多个问题向量。
+
+同时导出 float16 和 int8（按维度缩放）的量化副本：量化模式下先在量化矩阵上粗排，
+只对少量候选从 float32 矩阵中读取原始向量重新计算距离，常驻内存和页缓存占用降到 1/2 或 1/4。
+也可以离线拟合降维投影（PCA 或直接截取前几维），粗排在降维后的矩阵上进行，问题向量检索时做同样的投影。
+
+导出文件保存在数据库目录的 numpy_index/ 中，记录导出时的索引代数；数据库更新后（代数变化）需要重新导出:
+    python core/numpy_index.py --db ./chroma_wechat_db
+    python core/numpy_index.py --db ./chroma_wechat_db --reduce-dims 256 512 --reduce-method pca
+"""
+
+import argparse
+import json
+import mmap
+import os
+import shutil
+import time
+
+import numpy as np
+
+from incremental_index import read_generation
+from hnsw_params import collection_space
+
+NUMPY_INDEX_DIR = "numpy_index"
+NUMPY_INDEX_VERSION = 3  # 3: 距离空间改为从集合配置读取，旧版本导出的 cosine/ip 集合会按 l2 计算
+QUANTIZE_MODES = ("float16", "int8")
+VECTOR_FILES = ("vectors.npy", "vectors_float16.npy", "vectors_int8.npy")
+REDUCE_METHODS = ("pca", "truncate")
+EXPORT_BLOCK_ROWS = 4096  # 导出时分块计算量化副本的行数
+SCAN_BLOCK_ROWS = 256  # 粗排时量化矩阵每次转换为 float32 的行数（转换结果留在CPU缓存中）
+DEFAULT_COLLECTION = "langchain"  # langchain_chroma 的默认集合名
+
+
+def open_collection(db_path, name=DEFAULT_COLLECTION):
+    """直接用 chromadb 打开集合（导出时不需要embedding函数）"""
+    import chromadb
+
+    return chromadb.PersistentClient(path=db_path).get_collection(name)
+
+
+def index_dir(db_path):
+    return os.path.join(db_path, NUMPY_INDEX_DIR)
+
+
+def read_index_info(db_path):
+    """读取导出信息，未导出时返回None"""
+    try:
+        with open(os.path.join(index_dir(db_path), "index.json"), "r", encoding="utf-8") as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return info if info.get("version") == NUMPY_INDEX_VERSION else None
+
+
+def is_index_current(db_path):
+    """导出时的索引代数与数据库当前代数一致"""
+    info = read_index_info(db_path)
+    return info is not None and info["generation"] == read_generation(db_path)
+
+
+def reduced_file(method, dim):
+    return f"reduced_{method}_{dim}.npy"
+
+
+def projection_file(method, dim):
+    return f"projection_{method}_{dim}.npz"
+
+
+def unused_vector_files(db_path, quantize=None, reduce_dim=None, reduce_method="pca"):
+    """检索时不需要整体常驻的向量文件（量化或降维时 float32 矩阵只按候选行随机读取）"""
+    if reduce_dim:
+        scanned = reduced_file(reduce_method, reduce_dim)
+    else:
+        scanned = f"vectors_{quantize}.npy" if quantize else "vectors.npy"
+    try:
+        names = os.listdir(index_dir(db_path))
+    except OSError:
+        return ()
+    return tuple(name for name in names
+                 if name.startswith(("vectors", "reduced_")) and name.endswith(".npy") and name != scanned)
+
+
+def export_numpy_index(db_path, collection=None, page_size=5000):
+    """导出向量和元数据，返回导出信息
+
+    先写入临时目录再替换，已打开旧导出的进程继续使用旧文件（内存映射在文件删除后仍然有效）。
+    """
+    collection = collection or open_collection(db_path)
+    generation = read_generation(db_path)
+    space = collection_space(collection)
+    count = collection.count()
+    start = time.perf_counter()
+
+    target = index_dir(db_path)
+    tmp_dir = f"{target}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    ids, documents, metadatas = [], [], []
+    vectors = None
+    while len(ids) < count:
+        page = collection.get(include=["embeddings", "documents", "metadatas"], limit=page_size, offset=len(ids))
+        if not page["ids"]:
+            break
+        page_vectors = np.asarray(page["embeddings"], dtype=np.float32)
+        if vectors is None:
+            vectors = np.lib.format.open_memmap(os.path.join(tmp_dir, "vectors.npy"), mode="w+",
+                                                dtype=np.float32, shape=(count, page_vectors.shape[1]))
+        vectors[len(ids):len(ids) + len(page_vectors)] = page_vectors
+        ids.extend(page["ids"])
+        documents.extend(page["documents"])
+        metadatas.extend(metadata or {} for metadata in page["metadatas"])
+
+    dim = 0
+    if vectors is None:
+        np.save(os.path.join(tmp_dir, "vectors.npy"), np.zeros((0, 0), dtype=np.float32))
+    else:
+        dim = vectors.shape[1]
+        filled = np.array(vectors[:len(ids)]) if len(ids) < count else None
+        vectors.flush()
+        del vectors
+        if filled is not None:
+            # 导出期间集合中的记录减少了：只保留已填充的行
+            np.save(os.path.join(tmp_dir, "vectors.npy"), filled)
+
+    write_quantized(tmp_dir, np.load(os.path.join(tmp_dir, "vectors.npy"), mmap_mode="r"), space)
+
+    # 元数据按列存放，某条记录没有该字段时为None
+    keys = sorted({key for metadata in metadatas for key in metadata})
+    columns = {key: [metadata.get(key) for metadata in metadatas] for key in keys}
+
+    with open(os.path.join(tmp_dir, "records.json"), "w", encoding="utf-8") as f:
+        json.dump({"ids": ids, "documents": documents, "metadatas": columns}, f, ensure_ascii=False)
+    info = {
+        "version": NUMPY_INDEX_VERSION,
+        "generation": generation,
+        "count": len(ids),
+        "dim": dim,
+        "space": space,
+        "collection": collection.name,
+        "exported_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "export_seconds": round(time.perf_counter() - start, 3),
+    }
+    with open(os.path.join(tmp_dir, "index.json"), "w", encoding="utf-8") as f:
+        json.dump(info, f, ensure_ascii=False)
+
+    old_dir = f"{target}.{os.getpid()}.old"
+    if os.path.exists(target):
+        os.replace(target, old_dir)
+    os.replace(tmp_dir, target)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return info
+
+
+def write_quantized(directory, vectors, space):
+    """写入向量长度（norms.npy）和量化副本（vectors_float16.npy、vectors_int8.npy、int8_params.npy）
+
+    int8 按维度线性量化：x ≈ minimum + scale * (code + 128)，scale 和 minimum 保存在 int8_params.npy。
+    cosine 空间量化的是归一化后的向量。
+    """
+    count, dim = vectors.shape
+    norms = np.empty(count, dtype=np.float32)
+    minimum = np.full(dim, np.inf, dtype=np.float32)
+    maximum = np.full(dim, -np.inf, dtype=np.float32)
+    float16 = np.lib.format.open_memmap(os.path.join(directory, "vectors_float16.npy"), mode="w+",
+                                        dtype=np.float16, shape=(count, dim))
+
+    for start, block in _blocks(vectors, space):
+        norms[start:start + len(block)] = np.linalg.norm(vectors[start:start + len(block)], axis=1)
+        float16[start:start + len(block)] = block
+        np.minimum(minimum, block.min(axis=0), out=minimum)
+        np.maximum(maximum, block.max(axis=0), out=maximum)
+    float16.flush()
+    del float16
+
+    if count == 0:
+        minimum = np.zeros(dim, dtype=np.float32)
+        maximum = np.zeros(dim, dtype=np.float32)
+    scale = (maximum - minimum) / 255
+    scale[scale == 0] = 1
+    int8 = np.lib.format.open_memmap(os.path.join(directory, "vectors_int8.npy"), mode="w+",
+                                     dtype=np.int8, shape=(count, dim))
+    for start, block in _blocks(vectors, space):
+        int8[start:start + len(block)] = np.clip(np.rint((block - minimum) / scale) - 128, -128, 127)
+    int8.flush()
+    del int8
+
+    np.save(os.path.join(directory, "norms.npy"), norms)
+    np.save(os.path.join(directory, "int8_params.npy"), np.stack([scale, minimum]))
+
+
+def _blocks(vectors, space):
+    """按块读取 float32 矩阵，cosine 空间返回归一化后的向量"""
+    for start in range(0, len(vectors), EXPORT_BLOCK_ROWS):
+        block = np.asarray(vectors[start:start + EXPORT_BLOCK_ROWS], dtype=np.float32)
+        if space == "cosine":
+            block = block / np.maximum(np.linalg.norm(block, axis=1, keepdims=True), 1e-12)
+        yield start, block
+
+
+def fit_reduction(db_path, dim, method="pca"):
+    """在导出的矩阵上离线拟合降维投影，写入降维后的矩阵，返回拟合信息
+
+    投影为 reduced = (x - mean) @ components.T，components 的各行正交：pca 取协方差矩阵最大的 dim 个特征向量，
+    truncate 直接保留前 dim 维（mean 为0）。cosine 空间对归一化后的向量拟合。
+    """
+    if method not in REDUCE_METHODS:
+        raise ValueError(f"不支持的降维方法: {method}（可选 pca、truncate）")
+    directory = index_dir(db_path)
+    info = read_index_info(db_path)
+    if info is None:
+        raise FileNotFoundError(f"没有找到NumPy索引，请先导出: {directory}")
+    vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+    count, full_dim = vectors.shape
+    if not 0 < dim < full_dim:
+        raise ValueError(f"降维后的维度应在 1 到 {full_dim - 1} 之间: {dim}")
+    start = time.perf_counter()
+
+    # 协方差矩阵按块累加，不需要一次读入整个矩阵
+    total = np.zeros(full_dim)
+    gram = np.zeros((full_dim, full_dim))
+    for _, block in _blocks(vectors, info["space"]):
+        block = block.astype(np.float64)
+        total += block.sum(axis=0)
+        gram += block.T @ block
+    mean = total / max(count, 1)
+    covariance = gram / max(count, 1) - np.outer(mean, mean)
+    variances = np.diag(covariance)
+    if method == "pca":
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+        order = np.argsort(eigenvalues)[::-1][:dim]
+        components = eigenvectors[:, order].T
+        kept = eigenvalues[order].sum()
+    else:
+        mean = np.zeros(full_dim)
+        components = np.eye(full_dim)[:dim]
+        kept = variances[:dim].sum()
+    mean = mean.astype(np.float32)
+    components = np.ascontiguousarray(components, dtype=np.float32)
+    explained = float(kept / max(variances.sum(), 1e-12))
+
+    # 先写临时文件再替换，正在检索的进程不会读到写了一半的文件
+    tmp_matrix = os.path.join(directory, f"{reduced_file(method, dim)}.{os.getpid()}.tmp")
+    reduced = np.lib.format.open_memmap(tmp_matrix, mode="w+", dtype=np.float32, shape=(count, dim))
+    for row, block in _blocks(vectors, info["space"]):
+        reduced[row:row + len(block)] = (block - mean) @ components.T
+    reduced.flush()
+    del reduced
+    tmp_projection = os.path.join(directory, f"{projection_file(method, dim)}.{os.getpid()}.tmp")
+    with open(tmp_projection, "wb") as f:
+        np.savez(f, mean=mean, components=components, explained=explained)
+    os.replace(tmp_projection, os.path.join(directory, projection_file(method, dim)))
+    os.replace(tmp_matrix, os.path.join(directory, reduced_file(method, dim)))
+    return {"method": method, "dim": dim, "explained_variance": explained,
+            "fit_seconds": round(time.perf_counter() - start, 3)}
+
+
+class FilterError(ValueError):
+    """过滤条件不合法或NumPy检索不支持"""
+
+
+_COMPARISONS = {"$gt": np.greater, "$gte": np.greater_equal, "$lt": np.less, "$lte": np.less_equal}
+_LOGICAL = ("$and", "$or")
+_CONTAINS = ("$contains", "$not_contains")  # Chroma支持，NumPy检索不支持
+
+
+def _check_logical(key, condition):
+    if key not in _LOGICAL:
+        raise FilterError(f"不支持的逻辑运算符: {key}（可选 $and、$or）")
+    if not isinstance(condition, list):
+        raise FilterError(f"{key} 的值必须是过滤条件列表: {condition!r}")
+
+
+def validate_filter(where, numpy=True):
+    """检查过滤条件（不读取任何数据），不合法时抛出 FilterError
+
+    两种后端都调用：以 $ 开头的键只能是 $and、$or（值为列表），比较运算符的值必须是数字；
+    numpy 为 True 时 NumPy检索不支持的 $contains、$not_contains 也抛出 FilterError。
+    """
+    if not isinstance(where, dict):
+        raise FilterError(f"过滤条件必须是字典: {where!r}")
+    for key, condition in where.items():
+        if key.startswith("$"):
+            _check_logical(key, condition)
+            for sub in condition:
+                validate_filter(sub, numpy)
+            continue
+        if not isinstance(condition, dict):
+            continue
+        for op, value in condition.items():
+            if op in _COMPARISONS:
+                if not isinstance(value, (int, float)):
+                    raise FilterError(f"运算符 {op} 的值必须是数字: {value!r}")
+            elif op in _CONTAINS:
+                if numpy:
+                    raise FilterError(f"NumPy检索不支持的过滤运算符: {op}")
+            elif op not in ("$eq", "$ne", "$in", "$nin"):
+                raise FilterError(f"不支持的过滤运算符: {op}")
+
+
+def _filter_mask(columns, count, where):
+    """把Chroma的元数据过滤条件转换为布尔掩码
+
+    支持 {"字段": 值}、$eq、$ne、$in、$nin、$gt、$gte、$lt、$lte 以及 $and、$or 组合，其他运算符抛出 FilterError。
+    """
+    mask = np.ones(count, dtype=bool)
+    for key, condition in where.items():
+        if key.startswith("$"):
+            _check_logical(key, condition)
+        if key == "$and":
+            for sub in condition:
+                mask &= _filter_mask(columns, count, sub)
+            continue
+        if key == "$or":
+            any_mask = np.zeros(count, dtype=bool)
+            for sub in condition:
+                any_mask |= _filter_mask(columns, count, sub)
+            mask &= any_mask
+            continue
+
+        column = columns.get(key)
+        if column is None:
+            column = np.full(count, None, dtype=object)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for op, value in condition.items():
+            if op == "$eq":
+                mask &= column == value
+            elif op == "$ne":
+                mask &= column != value
+            elif op == "$in":
+                mask &= np.isin(column, list(value))
+            elif op == "$nin":
+                mask &= ~np.isin(column, list(value))
+            elif op in _COMPARISONS:
+                if not isinstance(value, (int, float)):
+                    raise FilterError(f"运算符 {op} 的值必须是数字: {value!r}")
+                # 与Chroma相同，只有数值型的元数据参与比较，字符串和缺失的字段都不满足条件
+                numbers = np.fromiter((v if isinstance(v, (int, float)) and not isinstance(v, bool) else np.nan
+                                       for v in column), dtype=np.float64, count=count)
+                mask &= _COMPARISONS[op](numbers, value)
+            else:
+                raise FilterError(f"NumPy检索不支持的过滤运算符: {op}")
+    return mask
+
+
+class NumpyVectorStore:
+    """内存映射矩阵上的精确检索，接口与 API 用到的 langchain Chroma 方法一致
+
+    返回的分数与Chroma相同，是距离（越小越相似）：l2 为欧氏距离的平方，cosine 为 1 - 余弦相似度，
+    ip 为 1 - 内积。numpy 的矩阵乘法会释放GIL，可以在查询线程池中并发执行。
+
+    quantize 为 float16 或 int8 时，先在量化矩阵上算近似距离，取 k * rescore_factor 个候选，
+    再从 float32 矩阵中只读取候选行计算精确距离，返回其中最近的k个。
+    reduce_dim 指定时粗排改在降维后的矩阵上进行（需先用 fit_reduction 拟合），问题向量做同样的投影。
+    rescore_factor 为0时不重排，直接返回粗排的近似距离，检索时完全不读取 float32 矩阵。
+    """
+
+    def __init__(self, db_path, embedding_function=None, quantize=None, rescore_factor=4,
+                 reduce_dim=None, reduce_method="pca"):
+        if quantize not in (None, "", "none") + QUANTIZE_MODES:
+            raise ValueError(f"不支持的量化模式: {quantize}（可选 none、float16、int8）")
+        if reduce_dim and reduce_method not in REDUCE_METHODS:
+            raise ValueError(f"不支持的降维方法: {reduce_method}（可选 pca、truncate）")
+        self.db_path = db_path
+        self.embedding_function = embedding_function
+        self.quantize = quantize if quantize in QUANTIZE_MODES else None
+        self.reduce_dim = int(reduce_dim) if reduce_dim else None
+        self.reduce_method = reduce_method
+        if self.quantize and self.reduce_dim:
+            raise ValueError("量化和降维不能同时使用")
+        self.rescore_factor = max(0, int(rescore_factor))
+        directory = index_dir(db_path)
+        self.info = read_index_info(db_path)
+        if self.info is None:
+            raise FileNotFoundError(f"没有找到NumPy索引，请先导出: {directory}")
+        self.generation = self.info["generation"]
+        self.space = self.info["space"]
+
+        self.vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+        # 向量长度导出时已算好：l2 距离 = |q|² - 2q·x + |x|²，cosine 距离用 q·x / |x|
+        self.norms = np.load(os.path.join(directory, "norms.npy"))
+        with open(os.path.join(directory, "records.json"), "r", encoding="utf-8") as f:
+            records = json.load(f)
+        self.ids = records["ids"]
+        self.documents = records["documents"]
+        self.metadata_keys = list(records["metadatas"])
+        self.columns = {key: np.array(values, dtype=object) for key, values in records["metadatas"].items()}
+        self._rows = None  # ID -> 行号，第一次按ID读取时建立
+
+        self.quantized = None
+        self.reduced = None
+        if self.reduce_dim:
+            self.reduced = np.load(os.path.join(directory, reduced_file(reduce_method, self.reduce_dim)), mmap_mode="r")
+            # q·x ≈ q·mean + (components q)·reduced
+            projection = np.load(os.path.join(directory, projection_file(reduce_method, self.reduce_dim)))
+            self.mean = projection["mean"]
+            self.components = projection["components"]
+            self.explained_variance = float(projection["explained"])
+        self.approximate = self.quantize is not None or self.reduced is not None
+        if self.approximate and hasattr(mmap, "MADV_RANDOM") and getattr(self.vectors, "_mmap", None) is not None:
+            # 重排只随机读取少量候选行，关闭预读，避免把整个 float32 文件读入页缓存
+            self.vectors._mmap.madvise(mmap.MADV_RANDOM)
+        if self.quantize:
+            self.quantized = np.load(os.path.join(directory, f"vectors_{self.quantize}.npy"), mmap_mode="r")
+            if self.quantize == "int8":
+                # q·x ≈ (q * scale)·code + q·(minimum + 128 * scale)
+                self.scale, minimum = np.load(os.path.join(directory, "int8_params.npy"))
+                self.offset = minimum + 128 * self.scale
+
+    def memory_bytes(self):
+        """检索时需要常驻内存的向量数据大小（精确模式为整个 float32 矩阵，量化或降维时为粗排用的矩阵）"""
+        if self.reduced is not None:
+            return self.reduced.nbytes + self.components.nbytes + self.norms.nbytes
+        matrix = self.quantized if self.quantized is not None else self.vectors
+        return matrix.nbytes + self.norms.nbytes
+
+    @property
+    def _collection(self):
+        """与 langchain Chroma 的 _collection 用法兼容（count、get）"""
+        return self
+
+    def count(self):
+        return len(self.ids)
+
+    def get(self, ids=None, where=None, include=None, limit=None, offset=0):
+        """按ID或按位置分页读取ID、文档和元数据（CollectionStats.rescan、关键词检索使用）
+
+        与Chroma相同，where 为元数据过滤条件，不存在的ID直接忽略。
+        """
+        if ids is not None:
+            if self._rows is None:
+                self._rows = {doc_id: row for row, doc_id in enumerate(self.ids)}
+            rows = [self._rows[doc_id] for doc_id in ids if doc_id in self._rows]
+        else:
+            end = len(self.ids) if limit is None else min(offset + limit, len(self.ids))
+            rows = list(range(offset, end))
+        if where and rows:
+            columns = {key: column[rows] for key, column in self.columns.items()}
+            rows = [row for row, allowed in zip(rows, _filter_mask(columns, len(rows), where)) if allowed]
+        include = ("documents", "metadatas") if include is None else include
+        return {
+            "ids": [self.ids[row] for row in rows],
+            "metadatas": [self._metadata(row) for row in rows] if "metadatas" in include else None,
+            "documents": [self.documents[row] for row in rows] if "documents" in include else None,
+        }
+
+    def _metadata(self, row):
+        return {key: self.columns[key][row] for key in self.metadata_keys if self.columns[key][row] is not None}
+
+    def _prepare(self, queries):
+        queries = np.asarray(queries, dtype=np.float32)
+        if self.space == "cosine":
+            queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        return queries
+
+    def _from_products(self, queries, products, norms):
+        """内积转换为距离；norms 为对应向量的长度（与 products 可广播）"""
+        if self.space == "l2":
+            query_norms = np.einsum("ij,ij->i", queries, queries)
+            query_norms = query_norms.reshape((-1,) + (1,) * (products.ndim - 1))
+            return np.maximum(query_norms - 2 * products + norms * norms, 0)
+        if self.space == "cosine":
+            return 1 - products / np.maximum(norms, 1e-12)
+        return 1 - products
+
+    def distances(self, queries):
+        """queries 为 (m, d) 矩阵，返回 (m, n) 精确距离矩阵"""
+        queries = self._prepare(queries)
+        return self._from_products(queries, queries @ self.vectors.T, self.norms)
+
+    def approximate_distances(self, queries):
+        """在量化矩阵上分块计算近似距离
+
+        每次把 SCAN_BLOCK_ROWS 行转换到复用的 float32 缓冲区再做矩阵乘法。numpy 的 float16 转换
+        没有硬件加速，float16 粗排比直接用 float32 矩阵慢，只节省内存；int8 的转换较快。
+        """
+        queries = self._prepare(queries)
+        norms = 1.0 if self.space == "cosine" else self.norms
+        if self.reduced is not None:
+            products = (queries @ self.components.T) @ self.reduced.T + (queries @ self.mean)[:, None]
+            return self._from_products(queries, products, norms)
+
+        weights = queries * self.scale if self.quantize == "int8" else queries
+        products = np.empty((len(queries), len(self.ids)), dtype=np.float32)
+        buffer = np.empty((SCAN_BLOCK_ROWS, self.quantized.shape[1]), dtype=np.float32)
+        for start in range(0, len(self.ids), SCAN_BLOCK_ROWS):
+            block = self.quantized[start:start + SCAN_BLOCK_ROWS]
+            converted = buffer[:len(block)]
+            converted[...] = block
+            np.matmul(weights, converted.T, out=products[:, start:start + len(block)])
+        if self.quantize == "int8":
+            products += (queries @ self.offset)[:, None]
+        # cosine 量化的是归一化后的向量
+        return self._from_products(queries, products, norms)
+
+    def rescore(self, queries, rows):
+        """从 float32 矩阵读取候选行，返回精确距离；rows 为 (m, c) 行号矩阵"""
+        queries = self._prepare(queries)
+        candidates = np.asarray(self.vectors[rows.ravel()]).reshape(rows.shape + (-1,))
+        products = np.einsum("md,mcd->mc", queries, candidates)
+        return self._from_products(queries, products, self.norms[rows])
+
+    @staticmethod
+    def _top(distances, k):
+        """每行距离最小的k个 (行号矩阵, 距离矩阵)，按距离从小到大排列"""
+        if k < distances.shape[1]:
+            top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        else:
+            top = np.tile(np.arange(distances.shape[1]), (len(distances), 1))
+        top_distances = np.take_along_axis(distances, top, axis=1)
+        order = np.argsort(top_distances, axis=1, kind="stable")
+        return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_distances, order, axis=1)
+
+    def search_batch(self, queries, k=4, filter=None):
+        """一次检索多个问题向量，返回每个问题的 [(行号, 距离)]，按距离从小到大排列"""
+        queries = self._prepare(queries)
+        distances = self.approximate_distances(queries) if self.approximate else self.distances(queries)
+        allowed = None
+        if filter:
+            allowed = _filter_mask(self.columns, len(self.ids), filter)
+            distances[:, ~allowed] = np.inf
+        available = len(self.ids) if allowed is None else int(allowed.sum())
+        k = min(k, available)
+        if k <= 0:
+            return [[] for _ in range(len(distances))]
+
+        if self.approximate and self.rescore_factor:
+            # 粗排取候选，候选按精确距离重新排序
+            candidates, _ = self._top(distances, min(k * self.rescore_factor, available))
+            order, top_distances = self._top(self.rescore(queries, candidates), k)
+            top = np.take_along_axis(candidates, order, axis=1)
+        else:
+            top, top_distances = self._top(distances, k)
+        return [list(zip(rows.tolist(), row_distances.tolist())) for rows, row_distances in zip(top, top_distances)]
+
+    def _to_documents(self, hits):
+        from langchain_core.documents import Document
+
+        return [(Document(page_content=self.documents[row], metadata=self._metadata(row), id=self.ids[row]), distance)
+                for row, distance in hits]
+
+    def similarity_search_by_vectors_with_scores(self, vectors, k=4, filter=None):
+        """批量检索：返回每个问题的 [(Document, 距离)]"""
+        return [self._to_documents(hits) for hits in self.search_batch(vectors, k=k, filter=filter)]
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k=4, filter=None, **kwargs):
+        # 与 langchain_chroma 的同名方法一致，返回的是距离
+        return self.similarity_search_by_vectors_with_scores([embedding], k=k, filter=filter)[0]
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_relevance_scores(embedding, k, filter)]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_by_vector_with_relevance_scores(
+            self.embedding_function.embed_query(query), k=k, filter=filter)
+
+
+def load_numpy_index(db_path, embedding_function=None, collection=None, quantize=None, rescore_factor=4,
+                     reduce_dim=None, reduce_method="pca"):
+    """打开NumPy索引；尚未导出或导出后数据库已更新时先重新导出，需要降维但还没有拟合时先拟合"""
+    if not is_index_current(db_path):
+        print("🔄 NumPy索引不存在或已过期，正在从Chroma集合导出...")
+        info = export_numpy_index(db_path, collection)
+        print(f"✅ 已导出 {info['count']:,} 条向量（{info['dim']} 维，{info['space']}），"
+              f"用时 {info['export_seconds']:.2f} 秒")
+    if reduce_dim and not os.path.exists(os.path.join(index_dir(db_path), reduced_file(reduce_method, reduce_dim))):
+        print(f"🔄 正在拟合降维投影（{reduce_method}，{reduce_dim} 维）...")
+        fit = fit_reduction(db_path, reduce_dim, reduce_method)
+        print(f"✅ 降维投影保留 {fit['explained_variance'] * 100:.1f}% 的方差，用时 {fit['fit_seconds']:.2f} 秒")
+    return NumpyVectorStore(db_path, embedding_function, quantize=quantize, rescore_factor=rescore_factor,
+                            reduce_dim=reduce_dim, reduce_method=reduce_method)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把Chroma集合导出为NumPy精确检索索引")
+    parser.add_argument("--db", default="./chroma_wechat_db")
+    parser.add_argument("--collection", default=DEFAULT_COLLECTION)
+    parser.add_argument("--reduce-dims", type=int, nargs="*", default=[], help="导出后拟合这些维度的降维投影")
+    parser.add_argument("--reduce-method", choices=REDUCE_METHODS, default="pca")
+    args = parser.parse_args()
+
+    info = export_numpy_index(args.db, open_collection(args.db, args.collection))
+    print(f"✅ 已导出 {info['count']:,} 条向量（{info['dim']} 维，{info['space']}），"
+          f"索引代数 {info['generation']}，用时 {info['export_seconds']:.2f} 秒 → {index_dir(args.db)}")
+    for name in VECTOR_FILES:
+        size = os.path.getsize(os.path.join(index_dir(args.db), name))
+        print(f"   {name:<22}{size / 1024 / 1024:>8.1f} MB")
+    for dim in args.reduce_dims:
+        fit = fit_reduction(args.db, dim, args.reduce_method)
+        size = os.path.getsize(os.path.join(index_dir(args.db), reduced_file(args.reduce_method, dim)))
+        print(f"   {reduced_file(args.reduce_method, dim):<22}{size / 1024 / 1024:>8.1f} MB"
+              f"（保留 {fit['explained_variance'] * 100:.1f}% 的方差，拟合 {fit['fit_seconds']:.2f} 秒）")
+
+
+if __name__ == "__main__":
+    main()
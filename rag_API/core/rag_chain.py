@@ -0,0 +1,51 @@
+"""
+RAG问答链
+- 随仓库附带 rlm/rag-prompt 提示词的本地副本，启动时不再通过 hub.pull 联网下载，离线也能构建问答链
+- 通义千问客户端在第一次提问时才创建，LangChain 相关模块在构建问答链时才导入
+"""
+
+# rlm/rag-prompt 的内容（单条 human 消息）
+RAG_PROMPT_TEMPLATE = (
+    "You are an assistant for question-answering tasks. "
+    "Use the following pieces of retrieved context to answer the question. "
+    "If you don't know the answer, just say that you don't know. "
+    "Use three sentences maximum and keep the answer concise.\n"
+    "Question: {question} \n"
+    "Context: {context} \n"
+    "Answer:"
+)
+
+_llms = {}
+
+
+def load_rag_prompt():
+    """本地的RAG提示词模板"""
+    from langchain_core.prompts import ChatPromptTemplate
+
+    return ChatPromptTemplate.from_messages([("human", RAG_PROMPT_TEMPLATE)])
+
+
+def get_llm(model="qwen-plus"):
+    """第一次调用时创建通义千问客户端，之后复用"""
+    if model not in _llms:
+        from langchain_community.chat_models.tongyi import ChatTongyi
+
+        _llms[model] = ChatTongyi(model=model)
+    return _llms[model]
+
+
+def format_docs(docs):
+    return "\n\n".join(doc.page_content for doc in docs)
+
+
+def build_rag_chain(retriever, model="qwen-plus"):
+    """检索 → 本地提示词 → 通义千问 → 文本；构建时不创建大模型客户端，也不访问网络"""
+    from langchain_core.output_parsers import StrOutputParser
+    from langchain_core.runnables import RunnableLambda, RunnablePassthrough
+
+    return (
+        {"context": retriever | format_docs, "question": RunnablePassthrough()}
+        | load_rag_prompt()
+        | RunnableLambda(lambda prompt_value: get_llm(model).invoke(prompt_value))
+        | StrOutputParser()
+    )
@@ -1,4 +1,5 @@
 # 简化版本 - 重新创建包含全部数据的向量数据库
+import argparse
 import getpass
 import os
 import glob
@@ -11,162 +12,37 @@ except ImportError:
         print(f"{desc}...")
         return iterable
 
-from langchain_chroma import Chroma
-from langchain_community.document_loaders.csv_loader import CSVLoader
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_core.documents import Document
+from wechat_loader import WeChatCSVLoader
+from incremental_index import update_vectorstore_incremental
+from embedding_cache import CachedEmbeddings
+from message_dedup import MessageBodyEmbeddings
+from adaptive_batching import AdaptiveBatchSizer
+from ingest_pipeline import build_vectorstore
+from hnsw_params import add_hnsw_arguments, hnsw_params_from_args
 
-class WeChatCSVLoader:
-    """自定义微信聊天记录CSV加载器"""
+DB_PATH = "./chroma_full_db"
 
-    def __init__(self, csv_folder_path, encoding="utf-8"):
-        self.csv_folder_path = Path(csv_folder_path)
-        self.encoding = encoding
+def create_full_vectorstore(source, embeddings, batch_size=100, manifest_loader=None,
+                            text_splitter=None, resume=False, retry_failed=False, sizer=None, hnsw=None):
+    """创建包含全部数据的向量数据库
 
-    def load(self):
-        """加载所有CSV文件并返回文档列表"""
-        documents = []
+    source 为加载器产出的CSV行流，经流水线解析、分割、嵌入和写入，不在内存中保存全部文档；
+    传入 sizer 时按token数自适应切分批次，否则每批 batch_size 条；
+    传入 manifest_loader 时构建完成后写入构建清单和构建日志。
+    """
 
-        csv_files = list(self.csv_folder_path.glob("**/*.csv"))
-        print(f"找到 {len(csv_files)} 个CSV文件")
+    db_path = DB_PATH
 
-        for csv_file in tqdm(csv_files, desc="处理CSV文件"):
-            print(f"正在处理: {csv_file.name}")
-
-            loader = CSVLoader(
-                file_path=str(csv_file),
-                encoding=self.encoding,
-                csv_args={'delimiter': ','}
-            )
-
-            try:
-                file_docs = loader.load()
-                processed_count = 0
-                valid_count = 0
-
-                for doc in file_docs:
-                    try:
-                        content_parts = doc.page_content.split('\n')
-                        chat_data = {}
-
-                        for part in content_parts:
-                            if ':' in part:
-                                key, value = part.split(':', 1)
-                                chat_data[key.strip()] = value.strip()
-
-                        msg_content = chat_data.get('msg', '').strip()
-                        if not msg_content:
-                            continue
-
-                        # 过滤无效消息
-                        if (len(msg_content) <= 2 or
-                            msg_content.startswith('[') or
-                            msg_content.startswith('表情') or
-                            '动画表情' in chat_data.get('type_name', '') or
-                            msg_content == "I've accepted your friend request. Now let's chat!" or
-                            '<msg>' in msg_content):
-                            continue
-
-                        formatted_content = f"""聊天记录:
-时间: {chat_data.get('CreateTime', '未知时间')}
-发送者: {chat_data.get('talker', '未知用户')}
-消息类型: {chat_data.get('type_name', '文本')}
-内容: {msg_content}
-房间: {chat_data.get('room_name', '私聊')}
-是否自己发送: {'是' if chat_data.get('is_sender') == '1' else '否'}"""
-
-                        new_doc = Document(
-                            page_content=formatted_content,
-                            metadata={
-                                "source": str(csv_file.name),
-                                "chat_time": chat_data.get('CreateTime', ''),
-                                "sender": chat_data.get('talker', ''),
-                                "msg_type": chat_data.get('type_name', ''),
-                                "room": chat_data.get('room_name', ''),
-                                "is_sender": chat_data.get('is_sender', '0'),
-                                "msg_content": msg_content[:200]
-                            }
-                        )
-                        documents.append(new_doc)
-                        valid_count += 1
-
-                    except Exception as e:
-                        continue
-
-                    processed_count += 1
-
-                print(f"  - 处理了 {processed_count} 条记录，有效记录 {valid_count} 条")
-
-            except Exception as e:
-                print(f"处理文件 {csv_file} 时出错: {e}")
-                continue
-
-        return documents
-
-def create_full_vectorstore(documents, embeddings, batch_size=100):
-    """创建包含全部数据的向量数据库"""
-
-    db_path = "./chroma_full_db"
-
-    # 删除旧数据库
-    if os.path.exists(db_path):
+    # 删除旧数据库（续建时保留）
+    if not (resume or retry_failed) and os.path.exists(db_path):
         import shutil
         print(f"删除旧数据库: {db_path}")
         shutil.rmtree(db_path)
 
-    print(f"开始创建完整向量数据库，总共 {len(documents)} 个文档...")
-
-    vectorstore = None
-    failed_batches = 0
-    max_retries = 3
-
-    total_batches = (len(documents) + batch_size - 1) // batch_size
-
-    for i in tqdm(range(0, len(documents), batch_size), desc="创建向量数据库", total=total_batches):
-        batch = documents[i:i + batch_size]
-
-        retry_count = 0
-        while retry_count < max_retries:
-            try:
-                if vectorstore is None:
-                    vectorstore = Chroma.from_documents(
-                        documents=batch,
-                        embedding=embeddings,
-                        persist_directory=db_path
-                    )
-                    print(f"✅ 成功创建向量数据库，第一批 {len(batch)} 个文档")
-                else:
-                    vectorstore.add_documents(batch)
-
-                vectorstore.persist()
-                break
-
-            except Exception as e:
-                retry_count += 1
-                print(f"批次 {i//batch_size + 1} 处理失败 (重试 {retry_count}/{max_retries}): {e}")
-
-                if retry_count >= max_retries:
-                    failed_batches += 1
-                    print(f"批次 {i//batch_size + 1} 最终失败，跳过")
-                    break
-
-                time.sleep(1)
-
-        # 显示进度
-        if (i // batch_size + 1) % 10 == 0:
-            completed = i + batch_size
-            progress = min(completed / len(documents) * 100, 100)
-            print(f"进度: {progress:.1f}% ({completed}/{len(documents)})")
-
-        time.sleep(0.2)  # 稍微慢一点避免过载
-
-    if failed_batches > 0:
-        print(f"⚠️ 警告: {failed_batches} 个批次处理失败")
-
-    return vectorstore
+    print("开始创建完整向量数据库，流式处理全部聊天记录...")
+    return build_vectorstore(source, embeddings, db_path, batch_size=batch_size, manifest_loader=manifest_loader,
+                             text_splitter=text_splitter, resume=resume, retry_failed=retry_failed,
+                             sizer=sizer, hnsw=hnsw)
 
 def simple_query_system(vectorstore):
     """简单的查询系统"""
@@ -217,8 +93,25 @@ def simple_query_system(vectorstore):
         except Exception as e:
             print(f"❌ 查询出错: {e}")
 
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="重新创建包含全部数据的向量数据库")
+    parser.add_argument("--incremental", action="store_true",
+                        help="增量更新：只写入新增或变化的消息，删除已消失的消息，不重建数据库")
+    parser.add_argument("--resume", action="store_true",
+                        help="从上次中断的构建继续，跳过构建日志中已提交的文档")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="只重试构建日志中失败的批次")
+    parser.add_argument("--batch-tokens", type=int, default=2000,
+                        help="每批embedding的初始目标token数，之后根据延迟和错误率自动调整")
+    parser.add_argument("--max-batch-items", type=int, default=256,
+                        help="每批embedding最多的条数")
+    add_hnsw_arguments(parser)
+    return parser.parse_args()
+
 def main():
     """主程序"""
+    args = parse_args()
     try:
         print("🚀 重新创建完整向量数据库系统")
         print("📋 本次将处理全部聊天记录数据")
@@ -237,46 +130,52 @@ def main():
             print("💡 请运行: pip install sentence-transformers")
             return
 
-        # 加载CSV数据
-        print("\n📂 正在加载所有CSV文件...")
-        csv_loader = WeChatCSVLoader("csv")
-        docs = csv_loader.load()
-
-        if not docs:
-            print("❌ 未找到有效聊天记录")
-            return
-
-        print(f"✅ 成功加载 {len(docs):,} 条有效聊天记录")
+        # 文本分割器和embedding模型只在真正重建时才导入
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
 
-        # 文本分割
-        print("\n📝 正在分割文档...")
+        csv_loader = WeChatCSVLoader("csv")
         text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=1000,
             chunk_overlap=100,
             separators=["\n聊天记录:", "\n", "。", "！", "？", "；", "，", " "]
         )
 
-        splits = text_splitter.split_documents(docs)
-        print(f"✅ 已分割为 {len(splits):,} 个文本片段")
-
         # 创建本地embedding
         print("\n🔧 正在加载本地embedding模型...")
         try:
-            embeddings = HuggingFaceEmbeddings(
+            embeddings = MessageBodyEmbeddings(CachedEmbeddings(HuggingFaceEmbeddings(
                 model_name="sentence-transformers/all-MiniLM-L6-v2",
                 model_kwargs={'device': 'cpu'},
                 encode_kwargs={'normalize_embeddings': False}
-            )
+            ), model_name="huggingface/all-MiniLM-L6-v2"))
             print("✅ 本地embedding模型加载成功")
         except Exception as e:
             print(f"❌ embedding模型加载失败: {e}")
             return
 
-        # 创建完整向量数据库
-        print(f"\n🔧 正在创建包含全部 {len(splits):,} 条记录的向量数据库...")
-        print("⚠️ 这可能需要较长时间，请耐心等待...")
+        # 本地模型按token数切分批次，并根据每批的计算耗时调整
+        sizer = AdaptiveBatchSizer(target_tokens=args.batch_tokens, max_items=args.max_batch_items,
+                                   target_latency=2.0)
+
+        if args.incremental:
+            print("\n🔄 增量更新向量数据库...")
+            vectorstore = update_vectorstore_incremental(
+                csv_loader, embeddings, DB_PATH, text_splitter=text_splitter, sizer=sizer,
+                hnsw=hnsw_params_from_args(args)
+            )
+        else:
+            # 边读取CSV边分割、嵌入和写入，片段ID由消息ID加序号确定
+            print("\n🔧 正在创建包含全部聊天记录的向量数据库...")
+            print("⚠️ 这可能需要较长时间，请耐心等待...")
+
+            vectorstore = create_full_vectorstore(
+                csv_loader.lazy_rows(), embeddings, sizer=sizer,
+                manifest_loader=csv_loader, text_splitter=text_splitter,
+                resume=args.resume, retry_failed=args.retry_failed, hnsw=hnsw_params_from_args(args)
+            )
 
-        vectorstore = create_full_vectorstore(splits, embeddings, batch_size=50)
+        embeddings.print_stats()
 
         if vectorstore is None:
             print("❌ 向量数据库创建失败")
@@ -1,4 +1,5 @@
 # 修改后的代码，成功利用全部聊天记录并创建向量数据库。
+import argparse
 import getpass
 import os
 import glob
@@ -14,123 +15,34 @@ except ImportError:
 
 # 优先使用环境变量，缺失时再交互式输入
 os.environ["DASHSCOPE_API_KEY"] = "sk-bae62c151c524da4b4ee5f04e4e19a3f"
-import dashscope
-dashscope.api_key = os.environ["DASHSCOPE_API_KEY"]
-
-from langchain_community.chat_models.tongyi import ChatTongyi
-
-llm = ChatTongyi(model="qwen-plus")
-
-import bs4
-from langchain import hub
-from langchain_chroma import Chroma
-from langchain_community.document_loaders.csv_loader import CSVLoader
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
-from langchain_community.embeddings.dashscope import DashScopeEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_core.documents import Document
-
-class WeChatCSVLoader:
-    """自定义微信聊天记录CSV加载器"""
-
-    def __init__(self, csv_folder_path, encoding="utf-8"):
-        self.csv_folder_path = Path(csv_folder_path)
-        self.encoding = encoding
-
-    def load(self):
-        """加载所有CSV文件并返回文档列表"""
-        documents = []
-
-        # 查找所有CSV文件
-        csv_files = list(self.csv_folder_path.glob("**/*.csv"))
-        print(f"找到 {len(csv_files)} 个CSV文件")
-
-        for csv_file in tqdm(csv_files, desc="处理CSV文件"):
-            print(f"正在处理: {csv_file.name}")
-
-            # 使用CSVLoader加载单个文件
-            loader = CSVLoader(
-                file_path=str(csv_file),
-                encoding=self.encoding,
-                csv_args={'delimiter': ','}
-            )
-
-            try:
-                file_docs = loader.load()
-                processed_count = 0
-                valid_count = 0
-
-                # 处理每个文档
-                for doc in file_docs:
-                    try:
-                        # 解析CSV行数据
-                        content_parts = doc.page_content.split('\n')
-                        chat_data = {}
-
-                        for part in content_parts:
-                            if ':' in part:
-                                key, value = part.split(':', 1)
-                                chat_data[key.strip()] = value.strip()
-
-                        # 检查是否有有效的消息内容
-                        msg_content = chat_data.get('msg', '').strip()
-                        if not msg_content:
-                            continue
-
-                        # 过滤无意义消息
-                        if (len(msg_content) <= 2 or
-                            msg_content.startswith('[') or
-                            msg_content.startswith('表情') or
-                            '动画表情' in chat_data.get('type_name', '') or
-                            msg_content == "I've accepted your friend request. Now let's chat!" or
-                            '<msg>' in msg_content):  # 过滤XML格式的系统消息
-                            continue
-
-                        # 格式化聊天内容
-                        formatted_content = f"""聊天记录:
-时间: {chat_data.get('CreateTime', '未知时间')}
-发送者: {chat_data.get('talker', '未知用户')}
-消息类型: {chat_data.get('type_name', '文本')}
-内容: {msg_content}
-房间: {chat_data.get('room_name', '私聊')}
-是否自己发送: {'是' if chat_data.get('is_sender') == '1' else '否'}"""
-
-                        # 创建新文档
-                        new_doc = Document(
-                            page_content=formatted_content,
-                            metadata={
-                                "source": str(csv_file.name),
-                                "chat_time": chat_data.get('CreateTime', ''),
-                                "sender": chat_data.get('talker', ''),
-                                "msg_type": chat_data.get('type_name', ''),
-                                "room": chat_data.get('room_name', ''),
-                                "is_sender": chat_data.get('is_sender', '0'),
-                                "msg_content": msg_content[:200]  # 截取前200字符用于检索
-                            }
-                        )
-                        documents.append(new_doc)
-                        valid_count += 1
-
-                    except Exception as e:
-                        continue  # 跳过有问题的记录
-
-                    processed_count += 1
-
-                print(f"  - 处理了 {processed_count} 条记录，有效记录 {valid_count} 条")
-
-            except Exception as e:
-                print(f"处理文件 {csv_file} 时出错: {e}")
-                continue
-
-        return documents
-
-def create_vectorstore_with_progress(documents, embeddings, batch_size=100):
-    """分批创建向量数据库，显示进度"""
-
-    # 检查是否已存在向量数据库，由于修改了数据处理逻辑，需要重新创建
-    db_path = "./chroma_wechat_db"
-    if os.path.exists(db_path) and os.listdir(db_path):
+# dashscope 导入时会从环境变量读取密钥；LangChain、Chroma 和大模型客户端
+# 都在用到时才导入/创建，启动时不做任何网络请求
+from wechat_loader import WeChatCSVLoader
+from incremental_index import update_vectorstore_incremental
+from embedding_cache import CachedEmbeddings
+from message_dedup import MessageBodyEmbeddings
+from embedding_scheduler import EmbeddingScheduler
+from adaptive_batching import AdaptiveBatchSizer
+from ingest_pipeline import build_vectorstore
+from rag_chain import build_rag_chain
+from hnsw_params import add_hnsw_arguments, hnsw_params_from_args
+
+DB_PATH = "./chroma_wechat_db"
+
+def create_vectorstore_with_progress(source, embeddings, batch_size=100, manifest_loader=None,
+                                     resume=False, retry_failed=False, sizer=None, hnsw=None):
+    """通过分阶段流水线创建向量数据库，显示各阶段吞吐量
+
+    source 为加载器产出的CSV行或聊天记录流（见 IngestPipeline），解析、嵌入和写入同时进行。
+    传入 sizer 时按token数自适应切分批次，否则每批 batch_size 条。
+
+    传入 manifest_loader 时，构建完成后写入构建清单，之后可用 --incremental 增量更新；
+    同时记录构建日志，中断后可用 --resume 继续，用 --retry-failed 只重试失败批次。
+    """
+
+    # 检查是否已存在向量数据库，由于修改了数据处理逻辑，需要重新创建（续建时保留）
+    db_path = DB_PATH
+    if not (resume or retry_failed) and os.path.exists(db_path) and os.listdir(db_path):
         print("检测到旧的向量数据库，由于数据处理逻辑已更新，需要重新创建...")
         try:
             import shutil
@@ -141,59 +53,9 @@ def create_vectorstore_with_progress(documents, embeddings, batch_size=100):
             print("请手动关闭相关服务后重试，或重命名数据库目录")
             return None
 
-    print(f"开始创建向量数据库，总共 {len(documents)} 个文档...")
-
-    # 分批处理
-    vectorstore = None
-    failed_batches = 0
-    max_retries = 3
-
-    total_batches = (len(documents) + batch_size - 1) // batch_size
-
-    for i in tqdm(range(0, len(documents), batch_size), desc="创建向量数据库", total=total_batches):
-        batch = documents[i:i + batch_size]
-
-        retry_count = 0
-        while retry_count < max_retries:
-            try:
-                if vectorstore is None:
-                    # 创建第一批
-                    vectorstore = Chroma.from_documents(
-                        documents=batch,
-                        embedding=embeddings,
-                        persist_directory=db_path
-                    )
-                    print(f"成功创建向量数据库，第一批 {len(batch)} 个文档")
-                else:
-                    # 添加后续批次
-                    vectorstore.add_documents(batch)
-
-                # 在新版本中，数据会自动持久化，无需手动调用persist()
-                # vectorstore.persist()  # 已移除，因为新版本不支持
-                break  # 成功处理，跳出重试循环
-
-            except Exception as e:
-                retry_count += 1
-                print(f"批次 {i//batch_size + 1} 处理失败 (重试 {retry_count}/{max_retries}): {e}")
-
-                if retry_count >= max_retries:
-                    failed_batches += 1
-                    print(f"批次 {i//batch_size + 1} 最终失败，跳过")
-                    break
-
-                # 等待后重试
-                time.sleep(2 ** retry_count)  # 指数退避
-
-        # 减少延迟以加快处理速度
-        if (i // batch_size + 1) % 20 == 0:  # 每20批休息长一点
-            time.sleep(1)  # 减少休息时间
-        else:
-            time.sleep(0.1)  # 大幅减少每批的延迟
-
-    if failed_batches > 0:
-        print(f"警告: {failed_batches} 个批次处理失败")
-
-    return vectorstore
+    print("开始创建向量数据库，流式读取文档...")
+    return build_vectorstore(source, embeddings, db_path, batch_size=batch_size, manifest_loader=manifest_loader,
+                             resume=resume, retry_failed=retry_failed, sizer=sizer, hnsw=hnsw)
 
 def interactive_chat(rag_chain):
     """交互式聊天函数"""
@@ -253,8 +115,35 @@ def interactive_chat(rag_chain):
             print(f"Error: Query failed: {e}")
             print("Tip: Please try rephrasing your question")
 
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="创建微信聊天记录向量数据库并启动RAG问答")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="并行解析CSV的进程数，0表示单进程流式加载")
+    parser.add_argument("--shard-mb", type=float, default=1.0,
+                        help="并行模式下大文件按多少MB切分为一个分片（在记录边界处切分），0表示每个文件一个分片")
+    parser.add_argument("--incremental", action="store_true",
+                        help="增量更新：只写入新增或变化的消息，删除已消失的消息，不重建数据库")
+    parser.add_argument("--resume", action="store_true",
+                        help="从上次中断的构建继续，跳过构建日志中已提交的文档")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="只重试构建日志中失败的批次")
+    parser.add_argument("--max-in-flight", type=int, default=8,
+                        help="同时进行的embedding请求数上限")
+    parser.add_argument("--qps", type=float, default=20.0,
+                        help="embedding接口每秒请求数配额")
+    parser.add_argument("--tpm", type=int, default=None,
+                        help="embedding接口每分钟token数配额，不填表示不限制")
+    parser.add_argument("--batch-tokens", type=int, default=4000,
+                        help="每批embedding的初始目标token数，之后根据延迟和错误率自动调整")
+    parser.add_argument("--max-batch-items", type=int, default=500,
+                        help="每批embedding最多的条数")
+    add_hnsw_arguments(parser)
+    return parser.parse_args()
+
 def main():
     """主程序"""
+    args = parse_args()
     try:
         print("Starting WeChat Chat RAG System...")
 
@@ -263,26 +152,36 @@ def main():
             print("Error: csv folder not found, please ensure CSV files are in csv directory")
             return
 
-        # 加载微信聊天记录CSV数据
-        print("\nLoading WeChat CSV files...")
+        # 流式加载微信聊天记录CSV数据，边读边写入向量数据库
+        # 聊天记录每条已经是独立完整的单元，跳过文本分割避免重复
+        print("\nStreaming WeChat CSV files (chat records are already atomic units)...")
         csv_loader = WeChatCSVLoader("csv")
-        docs = csv_loader.load()
-
-        if not docs:
-            print("Error: No valid chat records found, please check CSV file format")
-            return
-
-        print(f"Success: Loaded {len(docs)} valid chat records")
-
-        # 对于聊天记录，每条已经是独立完整的单元，跳过文本分割避免重复
-        print("\nSkipping document splitting (chat records are already atomic units)...")
-        splits = docs  # 直接使用原始文档，不进行分割
-        print(f"Using {len(splits)} chat records as-is")
+        if args.workers > 0:
+            source = csv_loader.lazy_load_parallel(workers=args.workers, shard_bytes=int(args.shard_mb * (1 << 20)),
+                                                   as_documents=False)
+        else:
+            source = csv_loader.lazy_rows()
 
         # 创建向量数据库
         print("\nCreating/loading vector database...")
-        embeddings = DashScopeEmbeddings(model="text-embedding-v3")
-        vectorstore = create_vectorstore_with_progress(splits, embeddings, batch_size=200)  # 增大批次大小
+        from langchain_community.embeddings.dashscope import DashScopeEmbeddings
+        # 只嵌入规范化后的消息正文，相同正文只调用一次接口；向量缓存在本地，重建时不再重复调用；
+        # 未命中缓存的文本由调度器在QPS/TPM配额内并发请求（限流重试由调度器负责，关闭SDK自身的重试）
+        scheduler = EmbeddingScheduler(DashScopeEmbeddings(model="text-embedding-v3", max_retries=1),
+                                       max_in_flight=args.max_in_flight,
+                                       requests_per_second=args.qps, tokens_per_minute=args.tpm)
+        embeddings = MessageBodyEmbeddings(CachedEmbeddings(scheduler, model_name="dashscope/text-embedding-v3"))
+        # 批次按估计token数切分（短消息多放、长文章少放），并根据每批的延迟和错误率调整
+        sizer = AdaptiveBatchSizer(target_tokens=args.batch_tokens, max_items=args.max_batch_items)
+        if args.incremental:
+            vectorstore = update_vectorstore_incremental(csv_loader, embeddings, DB_PATH, sizer=sizer,
+                                                         hnsw=hnsw_params_from_args(args))
+        else:
+            vectorstore = create_vectorstore_with_progress(source, embeddings, sizer=sizer,
+                                                           manifest_loader=csv_loader,
+                                                           resume=args.resume, retry_failed=args.retry_failed,
+                                                           hnsw=hnsw_params_from_args(args))
+        embeddings.print_stats()
 
         if vectorstore is None:
             print("Error: Vector database creation failed")
@@ -297,17 +196,8 @@ def main():
             search_kwargs={"k": 5}  # 检索5个最相关的片段
         )
 
-        prompt = hub.pull("rlm/rag-prompt")
-
-        def format_docs(docs):
-            return "\n\n".join(doc.page_content for doc in docs)
-
-        rag_chain = (
-            {"context": retriever | format_docs, "question": RunnablePassthrough()}
-            | prompt
-            | llm
-            | StrOutputParser()
-        )
+        # 使用随仓库附带的提示词，大模型客户端在第一次提问时创建
+        rag_chain = build_rag_chain(retriever)
 
         print("Success: RAG system build complete!")
 
@@ -13,120 +13,13 @@ except ImportError:
 
 # 优先使用环境变量，缺失时再交互式输入
 os.environ["DASHSCOPE_API_KEY"] = "sk-bae62c151c524da4b4ee5f04e4e19a3f"
-import dashscope
-dashscope.api_key = os.environ["DASHSCOPE_API_KEY"]
-
-from langchain_community.chat_models.tongyi import ChatTongyi
-
-llm = ChatTongyi(model="qwen-plus")
-
-import bs4
-from langchain import hub
-from langchain_chroma import Chroma
-from langchain_community.document_loaders.csv_loader import CSVLoader
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
-from langchain_community.embeddings.dashscope import DashScopeEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_core.documents import Document
-
-class WeChatCSVLoader:
-    """自定义微信聊天记录CSV加载器 - 小规模测试版"""
-
-    def __init__(self, csv_folder_path, encoding="utf-8", max_records=100):
-        self.csv_folder_path = Path(csv_folder_path)
-        self.encoding = encoding
-        self.max_records = max_records  # 限制记录数量
-
-    def load(self):
-        """加载CSV文件并返回有限数量的文档列表"""
-        documents = []
-        total_processed = 0
-
-        csv_files = list(self.csv_folder_path.glob("**/*.csv"))
-        print(f"找到 {len(csv_files)} 个CSV文件，将加载前 {self.max_records} 条有效记录")
-
-        for csv_file in csv_files:
-            if total_processed >= self.max_records:
-                break
-
-            print(f"正在处理: {csv_file.name}")
-
-            loader = CSVLoader(
-                file_path=str(csv_file),
-                encoding=self.encoding,
-                csv_args={'delimiter': ','}
-            )
-
-            try:
-                file_docs = loader.load()
-                processed_count = 0
-                valid_count = 0
-
-                for doc in file_docs:
-                    if total_processed >= self.max_records:
-                        break
-
-                    try:
-                        content_parts = doc.page_content.split('\n')
-                        chat_data = {}
-
-                        for part in content_parts:
-                            if ':' in part:
-                                key, value = part.split(':', 1)
-                                chat_data[key.strip()] = value.strip()
-
-                        msg_content = chat_data.get('msg', '').strip()
-                        if not msg_content:
-                            continue
-
-                        # 过滤无意义消息
-                        if (len(msg_content) <= 2 or
-                            msg_content.startswith('[') or
-                            msg_content.startswith('表情') or
-                            '动画表情' in chat_data.get('type_name', '') or
-                            msg_content == "I've accepted your friend request. Now let's chat!" or
-                            '<msg>' in msg_content):
-                            continue
-
-                        # 格式化聊天内容
-                        formatted_content = f"""聊天记录:
-时间: {chat_data.get('CreateTime', '未知时间')}
-发送者: {chat_data.get('talker', '未知用户')}
-消息类型: {chat_data.get('type_name', '文本')}
-内容: {msg_content}
-房间: {chat_data.get('room_name', '私聊')}
-是否自己发送: {'是' if chat_data.get('is_sender') == '1' else '否'}"""
-
-                        new_doc = Document(
-                            page_content=formatted_content,
-                            metadata={
-                                "source": str(csv_file.name),
-                                "chat_time": chat_data.get('CreateTime', ''),
-                                "sender": chat_data.get('talker', ''),
-                                "msg_type": chat_data.get('type_name', ''),
-                                "room": chat_data.get('room_name', ''),
-                                "is_sender": chat_data.get('is_sender', '0'),
-                                "msg_content": msg_content[:200]
-                            }
-                        )
-                        documents.append(new_doc)
-                        valid_count += 1
-                        total_processed += 1
-
-                    except Exception as e:
-                        continue
-
-                    processed_count += 1
-
-                print(f"  - 处理了 {processed_count} 条记录，有效记录 {valid_count} 条")
-
-            except Exception as e:
-                print(f"处理文件 {csv_file} 时出错: {e}")
-                continue
-
-        print(f"✅ 总共加载了 {len(documents)} 条有效记录用于测试")
-        return documents
+# dashscope 导入时会从环境变量读取密钥；LangChain、Chroma 在用到时才导入，
+# 启动时不做任何网络请求
+from wechat_loader import WeChatCSVLoader
+from embedding_cache import CachedEmbeddings
+from message_dedup import MessageBodyEmbeddings
+from hnsw_params import hnsw_configuration, hnsw_params_from_env
+from embedding_scheduler import EmbeddingScheduler
 
 def create_small_vectorstore(documents, embeddings):
     """创建小规模测试向量数据库"""
@@ -145,11 +38,15 @@ def create_small_vectorstore(documents, embeddings):
     print(f"创建测试向量数据库，文档数量: {len(documents)}")
 
     try:
+        from langchain_chroma import Chroma
+
         # 一次性创建所有文档，无需分批
+        # HNSW参数取环境变量 RAG_HNSW_M 等，未设置时使用默认值
         vectorstore = Chroma.from_documents(
             documents=documents,
             embedding=embeddings,
-            persist_directory=db_path
+            persist_directory=db_path,
+            collection_configuration=hnsw_configuration(hnsw_params_from_env())
         )
         print("✅ 测试向量数据库创建成功")
         return vectorstore
@@ -242,8 +139,11 @@ def main():
 
         # 创建向量数据库
         print("\n🔧 正在创建测试向量数据库...")
-        embeddings = DashScopeEmbeddings(model="text-embedding-v3")
+        from langchain_community.embeddings.dashscope import DashScopeEmbeddings
+        scheduler = EmbeddingScheduler(DashScopeEmbeddings(model="text-embedding-v3", max_retries=1))
+        embeddings = MessageBodyEmbeddings(CachedEmbeddings(scheduler, model_name="dashscope/text-embedding-v3"))
         vectorstore = create_small_vectorstore(splits, embeddings)
+        embeddings.print_stats()
 
         if vectorstore is None:
             print("❌ 向量数据库创建失败")
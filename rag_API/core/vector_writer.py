@@ -0,0 +1,220 @@
+"""
+向量计算与写入解耦
+先逐批计算embedding放入缓冲区，再以大事务批量upsert到Chroma集合。
+文档ID由MsgSvrID确定，upsert天然幂等，重试不会产生重复向量；嵌入与写入的吞吐量分别统计
+"""
+
+import time
+
+try:
+    from tqdm import tqdm
+except ImportError:
+    def tqdm(iterable, desc="Processing", total=None):
+        print(f"{desc}...")
+        return iterable
+
+from wechat_loader import record_id
+from adaptive_batching import document_tokens, iter_sized_batches, print_batch_sizes
+from hnsw_params import apply_hnsw_params, hnsw_configuration
+
+
+def open_vectorstore(db_path, embeddings, hnsw=None):
+    """打开（不存在时创建）持久化的Chroma向量数据库
+
+    hnsw 为 {M, ef_construction, ef_search} 中指定的参数（见 hnsw_params.py）：新建集合时按这些参数创建，
+    集合已存在时只能修改 ef_search。
+    """
+    from langchain_chroma import Chroma
+
+    store = Chroma(persist_directory=db_path, embedding_function=embeddings,
+                   collection_configuration=hnsw_configuration(hnsw or {}))
+    if hnsw:
+        apply_hnsw_params(store._collection, hnsw)
+    return store
+
+
+class BulkVectorWriter:
+    """缓冲已经算好的向量，攒够 flush_size 条后一次性upsert
+
+    单次upsert的条数不超过Chroma客户端允许的最大批量。
+    """
+
+    def __init__(self, collection, flush_size=2000, max_batch_size=None, max_retries=3,
+                 on_commit=None, on_failure=None, on_written=None):
+        self.collection = collection
+        self.flush_size = min(flush_size, max_batch_size) if max_batch_size else flush_size
+        self.max_retries = max_retries
+        # 每组数据（通常是一个批次）全部写入成功或最终失败时回调，用于记录构建日志
+        self.on_commit = on_commit
+        self.on_failure = on_failure
+        # 每个事务写入成功后回调 (ID列表, 元数据列表, 写入前已存在的{ID: 元数据})，用于维护统计
+        self.on_written = on_written
+
+        self._ids = []
+        self._vectors = []
+        self._documents = []
+        self._metadatas = []
+        self._tags = []  # [(标签, 条数)]
+
+        self.written = 0
+        self.write_seconds = 0.0
+        self.lookup_seconds = 0.0  # 写入前读取已有元数据（维护统计用）的耗时，不计入 write_seconds
+        self.transactions = 0
+        self.failed_ids = set()  # 写入失败的消息ID（分割片段归并到所属消息）
+
+    @classmethod
+    def for_vectorstore(cls, vectorstore, flush_size=2000, max_retries=3, **callbacks):
+        try:
+            max_batch_size = vectorstore._client.get_max_batch_size()
+        except Exception:
+            max_batch_size = None
+        return cls(vectorstore._collection, flush_size=flush_size,
+                   max_batch_size=max_batch_size, max_retries=max_retries, **callbacks)
+
+    def add(self, ids, vectors, documents, metadatas, tag=None):
+        self._ids.extend(ids)
+        self._vectors.extend(vectors)
+        self._documents.extend(documents)
+        self._metadatas.extend(metadatas)
+        self._tags.append((tag, len(ids)))
+        if len(self._ids) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        """把缓冲区写入集合"""
+        errors = {}  # 写入失败的行区间起点 -> 错误
+        for start in range(0, len(self._ids), self.flush_size):
+            end = start + self.flush_size
+            error = self._upsert(self._ids[start:end], self._vectors[start:end],
+                                 self._documents[start:end], self._metadatas[start:end])
+            if error is not None:
+                errors[start] = error
+
+        # 按标签回报结果：标签内任意一行所在的事务失败，整组视为失败
+        offset = 0
+        for tag, count in self._tags:
+            rows = range(offset, offset + count)
+            failed = [errors[start] for start in errors if start < rows.stop and rows.start < start + self.flush_size]
+            if failed and self.on_failure:
+                self.on_failure(tag, [record_id(metadata) for metadata in self._metadatas[rows.start:rows.stop]],
+                                failed[0])
+            elif not failed and self.on_commit:
+                self.on_commit(tag)
+            offset += count
+
+        self._ids, self._vectors, self._documents, self._metadatas, self._tags = [], [], [], [], []
+
+    def _upsert(self, ids, vectors, documents, metadatas):
+        """写入一个事务，成功返回None，最终失败返回异常"""
+        for retry_count in range(1, self.max_retries + 1):
+            try:
+                previous = None
+                if self.on_written:
+                    start = time.perf_counter()
+                    previous = self._existing_metadatas(ids)
+                    self.lookup_seconds += time.perf_counter() - start
+                start = time.perf_counter()
+                self.collection.upsert(ids=ids, embeddings=vectors, documents=documents, metadatas=metadatas)
+                self.write_seconds += time.perf_counter() - start
+                self.written += len(ids)
+                self.transactions += 1
+                if self.on_written:
+                    self.on_written(ids, metadatas, previous)
+                return None
+            except Exception as e:
+                print(f"批量写入 {len(ids)} 条失败 (重试 {retry_count}/{self.max_retries}): {e}")
+                error = e
+                if retry_count < self.max_retries:
+                    time.sleep(2 ** retry_count)
+
+        self.failed_ids.update(record_id(metadata) for metadata in metadatas)
+        return error
+
+    def _existing_metadatas(self, ids):
+        """覆盖写入前集合中已有的元数据（续建、重试和增量更新时可能覆盖已存在的消息）"""
+        existing = self.collection.get(ids=ids, include=["metadatas"])
+        return dict(zip(existing["ids"], existing["metadatas"]))
+
+
+def embed_batch(embeddings, documents, batch_index, max_retries=3, sizer=None):
+    """计算一个批次的向量，失败时指数退避重试，返回 (向量或None, 最后的异常, 成功调用耗时)
+
+    传入 AdaptiveBatchSizer 时把每次调用的耗时和失败反馈给它，用于调整后续批次的大小。
+    """
+    texts = [doc.page_content for doc in documents]
+    tokens = sum(document_tokens(doc) for doc in documents) if sizer else 0
+    error = None
+    for retry_count in range(1, max_retries + 1):
+        try:
+            start = time.perf_counter()
+            vectors = embeddings.embed_documents(texts)
+            seconds = time.perf_counter() - start
+            if sizer:
+                sizer.observe(len(texts), tokens, seconds)
+            return vectors, None, seconds
+        except Exception as e:
+            error = e
+            if sizer:
+                sizer.observe_failure(len(texts), tokens)
+            print(f"批次 {batch_index + 1} 计算向量失败 (重试 {retry_count}/{max_retries}): {e}")
+            if retry_count < max_retries:
+                time.sleep(2 ** retry_count)  # 指数退避
+    return None, error, 0.0
+
+
+def embed_and_write(id_documents, embeddings, writer, batch_size=200, max_retries=3, total_batches=None,
+                    sizer=None):
+    """逐批计算向量交给写入器，返回构建报告
+
+    id_documents 为 (文档ID, 文档) 的可迭代对象，可以是生成器。
+    embedding失败只重试embedding本身，不会重复写入。
+    传入 sizer（AdaptiveBatchSizer）时按token数自适应切分批次，否则每批 batch_size 条。
+    """
+    report = {
+        "embedded": 0,
+        "embed_seconds": 0.0,
+        "failed_batches": 0,
+        "failed_ids": set(),
+    }
+
+    batches = enumerate(iter_sized_batches(id_documents, sizer, batch_size))
+    for batch_index, id_batch in tqdm(batches, desc="计算向量", total=None if sizer else total_batches):
+        ids = [doc_id for doc_id, _ in id_batch]
+        texts = [doc.page_content for _, doc in id_batch]
+        metadatas = [doc.metadata for _, doc in id_batch]
+
+        vectors, error, seconds = embed_batch(embeddings, [doc for _, doc in id_batch], batch_index,
+                                              max_retries, sizer)
+        report["embed_seconds"] += seconds
+
+        if vectors is None:
+            report["failed_batches"] += 1
+            report["failed_ids"].update(record_id(metadata) for metadata in metadatas)
+            print(f"批次 {batch_index + 1} 最终失败，跳过")
+            continue
+
+        report["embedded"] += len(ids)
+        writer.add(ids, vectors, texts, metadatas, tag=batch_index)
+
+    writer.flush()
+    report["failed_ids"] |= writer.failed_ids
+    report["written"] = writer.written
+    report["write_seconds"] = writer.write_seconds
+    report["lookup_seconds"] = writer.lookup_seconds
+    report["transactions"] = writer.transactions
+    if sizer:
+        report["batch_sizes"] = sizer.summary()
+    return report
+
+
+def print_build_report(report):
+    """分别打印嵌入吞吐量和写入吞吐量"""
+    embed_rate = report["embedded"] / report["embed_seconds"] if report["embed_seconds"] else 0.0
+    write_rate = report["written"] / report["write_seconds"] if report["write_seconds"] else 0.0
+    print(f"🧮 嵌入: {report['embedded']:,} 条，耗时 {report['embed_seconds']:.1f} 秒，{embed_rate:,.0f} 条/秒")
+    print(f"💾 写入: {report['written']:,} 条，{report['transactions']} 个事务，"
+          f"耗时 {report['write_seconds']:.1f} 秒，{write_rate:,.0f} 条/秒"
+          + (f"（另有读取已有元数据 {report['lookup_seconds']:.1f} 秒）" if report.get("lookup_seconds") else ""))
+    print_batch_sizes(report.get("batch_sizes"))
+    if report["failed_ids"]:
+        print(f"⚠️ {report['failed_batches']} 个批次嵌入失败，共 {len(report['failed_ids']):,} 条消息未写入")
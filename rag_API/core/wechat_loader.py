@@ -0,0 +1,347 @@
+"""
+微信聊天记录CSV流式加载器
+直接按列读取CSV（msg、talker、CreateTime、MsgSvrID 等），逐条产出记录，内存占用不随文件规模增长
+"""
+
+import csv
+import hashlib
+import io
+import os
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+# 单条消息可能是很长的粘贴文章，放宽csv模块默认的字段长度限制
+csv.field_size_limit(min(sys.maxsize, 2 ** 31 - 1))
+
+# 并行加载时每个分片的大小（字节），约5000条消息
+SHARD_BYTES = 1 << 20
+
+# 好友验证通过后的系统提示语
+FRIEND_ACCEPTED_MSG = "I've accepted your friend request. Now let's chat!"
+
+
+def is_valid_message(msg_content, type_name=""):
+    """判断消息是否值得入库（过滤表情、系统消息等无意义内容）"""
+    if not msg_content:
+        return False
+
+    if (len(msg_content) <= 2 or
+        msg_content.startswith('[') or
+        msg_content.startswith('表情') or
+        '动画表情' in type_name or
+        msg_content == FRIEND_ACCEPTED_MSG or
+        '<msg>' in msg_content):  # 过滤XML格式的系统消息
+        return False
+
+    return True
+
+
+def iter_csv_rows(csv_file, encoding="utf-8"):
+    """逐行读取单个CSV文件，产出 {列名: 值} 字典
+
+    使用标准csv模块解析，消息中的换行和冒号都能原样保留。
+    """
+    with open(csv_file, "r", encoding=encoding, newline="") as f:
+        for row in csv.DictReader(f):
+            yield row
+
+
+def row_to_record(row, source):
+    """把CSV原始行转换为规范化的聊天记录，无效消息返回None"""
+    msg_content = (row.get('msg') or '').strip()
+    type_name = (row.get('type_name') or '').strip()
+
+    if not is_valid_message(msg_content, type_name):
+        return None
+
+    return {
+        "source": source,
+        "msg_id": (row.get('MsgSvrID') or '').strip(),
+        "chat_time": (row.get('CreateTime') or '').strip(),
+        "sender": (row.get('talker') or '').strip(),
+        "msg_type": type_name,
+        "room": (row.get('room_name') or '').strip(),
+        "is_sender": (row.get('is_sender') or '0').strip(),
+        "msg": msg_content,
+    }
+
+
+def format_chat_record(record):
+    """把聊天记录格式化为写入向量数据库的文本"""
+    return f"""聊天记录:
+时间: {record['chat_time'] or '未知时间'}
+发送者: {record['sender'] or '未知用户'}
+消息类型: {record['msg_type'] or '文本'}
+内容: {record['msg']}
+房间: {record['room'] or '私聊'}
+是否自己发送: {'是' if record['is_sender'] == '1' else '否'}"""
+
+
+def message_from_formatted(page_content):
+    """从 format_chat_record 生成的文本中取回消息内容，格式不符时返回None"""
+    start = page_content.find("\n内容: ")
+    end = page_content.rfind("\n房间: ")
+    if not page_content.startswith("聊天记录:") or start < 0 or end < start:
+        return None
+    return page_content[start + len("\n内容: "):end]
+
+
+def record_metadata(record):
+    """生成向量数据库中保存的元数据"""
+    return {
+        "source": record['source'],
+        "msg_id": record['msg_id'],
+        "chat_time": record['chat_time'],
+        "sender": record['sender'],
+        "msg_type": record['msg_type'],
+        "room": record['room'],
+        "is_sender": record['is_sender'],
+        "msg_content": record['msg'][:200]  # 截取前200字符用于检索
+    }
+
+
+def record_id(metadata):
+    """由MsgSvrID生成确定性的文档ID，重复写入同一条消息时覆盖而不是新增
+
+    MsgSvrID 缺失时退回到来源、时间、发送者和内容的哈希。
+    """
+    if metadata.get('msg_id'):
+        return f"wx-{metadata['msg_id']}"
+    key = "|".join([metadata.get('source', ''), metadata.get('chat_time', ''),
+                    metadata.get('sender', ''), metadata.get('msg_content', '')])
+    return "wx-h" + hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def content_hash(text):
+    """文档内容哈希，用于判断同一条消息是否发生变化"""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def record_to_document(record):
+    """把聊天记录转换为LangChain文档"""
+    from langchain_core.documents import Document
+
+    return Document(
+        page_content=format_chat_record(record),
+        metadata=record_metadata(record)
+    )
+
+
+def iter_chat_records(csv_file, encoding="utf-8"):
+    """流式读取单个CSV文件中的有效聊天记录"""
+    source = Path(csv_file).name
+    for row in iter_csv_rows(csv_file, encoding=encoding):
+        record = row_to_record(row, source)
+        if record is not None:
+            yield record
+
+
+class WeChatCSVLoader:
+    """自定义微信聊天记录CSV加载器（流式版本）"""
+
+    def __init__(self, csv_folder_path, encoding="utf-8", max_records=None, verbose=True):
+        self.csv_folder_path = Path(csv_folder_path)
+        self.encoding = encoding
+        self.max_records = max_records  # None 表示不限制记录数量
+        self.verbose = verbose
+
+    def csv_files(self):
+        """按路径排序返回所有CSV文件，保证多次加载的顺序一致"""
+        return sorted(self.csv_folder_path.glob("**/*.csv"))
+
+    def lazy_records(self):
+        """逐条产出有效聊天记录（字典），不在内存中累积"""
+        csv_files = self.csv_files()
+        if self.verbose:
+            print(f"找到 {len(csv_files)} 个CSV文件")
+
+        total_valid = 0
+        for csv_file in csv_files:
+            if self.max_records is not None and total_valid >= self.max_records:
+                break
+
+            if self.verbose:
+                print(f"正在处理: {csv_file.name}")
+
+            processed_count = 0
+            valid_count = 0
+            try:
+                for row in iter_csv_rows(csv_file, encoding=self.encoding):
+                    if self.max_records is not None and total_valid >= self.max_records:
+                        break
+
+                    processed_count += 1
+                    record = row_to_record(row, csv_file.name)
+                    if record is None:
+                        continue
+
+                    valid_count += 1
+                    total_valid += 1
+                    yield record
+
+            except (OSError, UnicodeDecodeError, csv.Error) as e:
+                print(f"处理文件 {csv_file} 时出错: {e}")
+                continue
+
+            if self.verbose:
+                print(f"  - 处理了 {processed_count} 条记录，有效记录 {valid_count} 条")
+
+    def lazy_rows(self):
+        """逐行产出 (文件名, 原始CSV行)，不做过滤，供分阶段流水线的解析阶段使用"""
+        for csv_file in self.csv_files():
+            try:
+                for row in iter_csv_rows(csv_file, encoding=self.encoding):
+                    yield csv_file.name, row
+            except (OSError, UnicodeDecodeError, csv.Error) as e:
+                print(f"处理文件 {csv_file} 时出错: {e}")
+                continue
+
+    def lazy_load(self):
+        """逐条产出LangChain文档"""
+        for record in self.lazy_records():
+            yield record_to_document(record)
+
+    def load(self):
+        """加载所有CSV文件并返回文档列表（兼容旧接口）"""
+        return list(self.lazy_load())
+
+    def lazy_load_parallel(self, workers=None, shard_bytes=SHARD_BYTES, as_documents=True):
+        """多进程并行加载，按分片顺序产出结果（与顺序加载的结果一致）
+
+        大文件按字节区间切分（切分点在记录边界上），子进程直接 seek 到分片起点解析，每行只解析一次。
+        max_records 在并行模式下不生效。
+        """
+        shards = plan_shards(self.csv_files(), shard_bytes=shard_bytes)
+        workers = workers or os.cpu_count() or 1
+        if self.verbose:
+            print(f"并行加载: {len(shards)} 个分片，{workers} 个进程")
+
+        worker_stats = defaultdict(lambda: {"shards": 0, "rows": 0, "valid": 0, "seconds": 0.0})
+        start_time = time.perf_counter()
+
+        tasks = [(csv_file, header, start, stop, self.encoding, as_documents)
+                 for csv_file, header, start, stop in shards]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # executor.map 按提交顺序返回结果，保证合并顺序确定
+            for items, stats in executor.map(_load_shard, tasks):
+                worker = worker_stats[stats["pid"]]
+                worker["shards"] += 1
+                worker["rows"] += stats["rows"]
+                worker["valid"] += len(items)
+                worker["seconds"] += stats["seconds"]
+                yield from items
+
+        if self.verbose:
+            print_worker_stats(worker_stats, time.perf_counter() - start_time)
+
+
+def record_boundaries(csv_file, shard_bytes=SHARD_BYTES, chunk_size=1 << 20):
+    """扫描文件字节，返回分片边界的字节偏移 [表头结束, ..., 文件末尾]
+
+    只跟踪引号的奇偶（转义的 "" 成对出现，不改变奇偶），引号之外的换行才是记录边界；
+    每隔 shard_bytes 字节在其后的第一个记录边界处切分。只做字节查找，比csv解析快得多。
+    要求编码与ASCII兼容（utf-8、gbk等），多字节字符中不会出现引号和换行的字节。
+    """
+    boundaries = []
+    target = 0  # 第一个边界是表头的结束位置
+    in_quotes = False
+    position = 0
+    with open(csv_file, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            start = 0
+            while True:
+                newline = chunk.find(b"\n", max(target - position, start))
+                if newline < 0:
+                    break
+                in_quotes ^= chunk.count(b'"', start, newline) & 1
+                start = newline + 1
+                if not in_quotes:
+                    boundaries.append(position + start)
+                    target = position + start + shard_bytes
+            in_quotes ^= chunk.count(b'"', start) & 1
+            position += len(chunk)
+    if boundaries and boundaries[-1] < position:
+        boundaries.append(position)  # 最后一行没有换行
+    return boundaries
+
+
+def plan_shards(csv_files, shard_bytes=SHARD_BYTES):
+    """把CSV文件规划为 (文件, 表头结束偏移, 起始偏移, 结束偏移) 分片列表
+
+    shard_bytes 为0时每个文件一个分片；没有数据行的文件跳过。
+    """
+    shards = []
+    for csv_file in csv_files:
+        try:
+            boundaries = record_boundaries(csv_file, shard_bytes or os.path.getsize(csv_file) + 1)
+        except OSError as e:
+            print(f"处理文件 {csv_file} 时出错: {e}")
+            continue
+        for start, stop in zip(boundaries, boundaries[1:]):
+            shards.append((csv_file, boundaries[0], start, stop))
+    return shards
+
+
+def iter_shard_rows(csv_file, header, start, stop, encoding="utf-8"):
+    """解析文件中 [start, stop) 字节区间的数据行，列名取自文件开头 header 字节的表头"""
+    with open(csv_file, "rb") as f:
+        fieldnames = next(csv.reader(io.StringIO(f.read(header).decode(encoding), newline="")))
+        f.seek(start)
+        text = f.read(stop - start).decode(encoding)
+    yield from csv.DictReader(io.StringIO(text, newline=""), fieldnames=fieldnames)
+
+
+def _load_shard(task):
+    """子进程中解析一个分片，返回 (记录或文档列表, 统计信息)"""
+    csv_file, header, start, stop, encoding, as_documents = task
+    begin = time.perf_counter()
+    source = Path(csv_file).name
+
+    items = []
+    rows = 0
+    try:
+        shard_rows = list(iter_shard_rows(csv_file, header, start, stop, encoding=encoding))
+    except (OSError, UnicodeDecodeError, csv.Error) as e:
+        print(f"处理文件 {csv_file} 时出错: {e}")
+        shard_rows = []
+    for row in shard_rows:
+        rows += 1
+        record = row_to_record(row, source)
+        if record is None:
+            continue
+        items.append(record_to_document(record) if as_documents else record)
+
+    return items, {
+        "pid": os.getpid(),
+        "rows": rows,
+        "seconds": time.perf_counter() - begin,
+    }
+
+
+def print_worker_stats(worker_stats, wall_seconds):
+    """打印每个工作进程的吞吐量"""
+    total_rows = sum(stats["rows"] for stats in worker_stats.values())
+    print(f"并行加载完成: {total_rows} 行，耗时 {wall_seconds:.2f} 秒 "
+          f"({total_rows / max(wall_seconds, 1e-9):.0f} 行/秒)")
+    for pid, stats in sorted(worker_stats.items()):
+        rate = stats["rows"] / max(stats["seconds"], 1e-9)
+        print(f"  - 进程 {pid}: {stats['shards']} 个分片，{stats['rows']} 行，"
+              f"有效 {stats['valid']} 条，{stats['seconds']:.2f} 秒，{rate:.0f} 行/秒")
+
+
+def iter_batches(iterable, batch_size):
+    """把任意可迭代对象切分为固定大小的批次，不预先物化全部数据"""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -1,6 +1,7 @@
 # 利用小部分聊天记录创建向量数据库，并进行测试。测试成功
 import getpass
 import os
+import sys
 import glob
 from pathlib import Path
 import time
@@ -8,22 +9,10 @@ from tqdm import tqdm
 
 # 优先使用环境变量，缺失时再交互式输入
 os.environ["DASHSCOPE_API_KEY"] = "sk-bae62c151c524da4b4ee5f04e4e19a3f"
-import dashscope
-dashscope.api_key = os.environ["DASHSCOPE_API_KEY"]
+# dashscope 在第一次调用embedding/大模型时才导入，导入时会从环境变量读取密钥
 
-from langchain_community.chat_models.tongyi import ChatTongyi
-
-llm = ChatTongyi(model="qwen-plus")
-
-import bs4
-from langchain import hub
-from langchain_chroma import Chroma
-from langchain_community.document_loaders.csv_loader import CSVLoader
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
-from langchain_community.embeddings.dashscope import DashScopeEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_core.documents import Document
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "core"))
+from rag_chain import build_rag_chain
 
 class WeChatCSVLoader:
     """自定义微信聊天记录CSV加载器"""
@@ -35,6 +24,9 @@ class WeChatCSVLoader:
 
     def load(self):
         """加载CSV文件并返回文档列表"""
+        from langchain_community.document_loaders.csv_loader import CSVLoader
+        from langchain_core.documents import Document
+
         documents = []
 
         # 查找所有CSV文件，但只处理前几个
@@ -103,6 +95,7 @@ class WeChatCSVLoader:
 
 def create_vectorstore_with_progress(documents, embeddings):
     """分批创建向量数据库，显示进度"""
+    from langchain_chroma import Chroma
 
     # 检查是否已存在向量数据库
     db_path = "./chroma_wechat_db"
@@ -146,6 +139,9 @@ def create_vectorstore_with_progress(documents, embeddings):
 
 # 主程序
 def main():
+    from langchain_community.embeddings.dashscope import DashScopeEmbeddings
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
     try:
         # 加载微信聊天记录CSV数据（限制数量）
         print("正在加载微信聊天记录CSV文件...")
@@ -212,17 +208,8 @@ def main():
             search_kwargs={"k": 3}
         )
 
-        prompt = hub.pull("rlm/rag-prompt")
-
-        def format_docs(docs):
-            return "\n\n".join(doc.page_content for doc in docs)
-
-        rag_chain = (
-            {"context": retriever | format_docs, "question": RunnablePassthrough()}
-            | prompt
-            | llm
-            | StrOutputParser()
-        )
+        # 使用随仓库附带的提示词，大模型客户端在第一次提问时创建
+        rag_chain = build_rag_chain(retriever)
 
         # 测试查询
         print("\n" + "="*50)